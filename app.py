@@ -8,10 +8,13 @@ from blueprints.auth import bp as auth_bp
 from blueprints.auth import current_user
 from blueprints.field_labels import bp as labels_bp
 from blueprints.price_adjustment import bp as price_adj_bp
+from blueprints.export_jobs import bp as export_jobs_bp
 from dashboard import bp as dashboard_bp
 from models import *
+from rollups import refresh_dashboard_cube, refresh_freight_snapshot, refresh_po_rollup
 import json
 import logging
+import click
 import re
 from datetime import datetime, date
 from config import Config
@@ -56,6 +59,7 @@ app.register_blueprint(auth_bp)        # /auth/login
 app.register_blueprint(labels_bp)      # /admin/labels/-->FreightTrackingView
 app.register_blueprint(dashboard_bp)   # /main/dashboard/-->FreightTrackingView
 app.register_blueprint(price_adj_bp)   # /price_adjustment
+app.register_blueprint(export_jobs_bp)  # /exports (background export jobs)
 
 # Register  filters
 @app.template_filter('attr')
@@ -132,6 +136,95 @@ def inject_user_settings():
     # return app
 
 
+# ── CLI: maintenance commands (flask --app app <command>) ────────────────
+@app.cli.command("rebuild-current-status")
+def rebuild_current_status_cmd():
+    """Create (if missing) and backfill RFT_CurrentStatus from RFT_StatusHistory."""
+    RFT_CurrentStatus.__table__.create(bind=engine, checkfirst=True)
+    db = Session()
+    try:
+        rebuild_current_status(db)
+    finally:
+        db.close()
+    print("RFT_CurrentStatus rebuilt.")
+
+@app.cli.command("rebuild-invoice-summary")
+def rebuild_invoice_summary_cmd():
+    """Create (if missing) and backfill RFT_InvoiceSummary from RFT_Invoices."""
+    RFT_InvoiceSummary.__table__.create(bind=engine, checkfirst=True)
+    db = Session()
+    try:
+        rebuild_invoice_summary(db)
+    finally:
+        db.close()
+    print("RFT_InvoiceSummary rebuilt.")
+
+@app.cli.command("rebuild-landed-cost")
+def rebuild_landed_cost_cmd():
+    """Create (if missing) and backfill RFT_LandedCost from shipment costs and lines."""
+    RFT_LandedCost.__table__.create(bind=engine, checkfirst=True)
+    db = Session()
+    try:
+        rebuild_landed_cost(db)
+    finally:
+        db.close()
+    print("RFT_LandedCost rebuilt.")
+
+@app.cli.command("create-export-log")
+def create_export_log_cmd():
+    """Create RFT_ExportLog (needed by FreightTracking exports) if it is missing."""
+    RFT_ExportLog.__table__.create(bind=engine, checkfirst=True)
+    print("RFT_ExportLog ready.")
+
+@app.cli.command("refresh-dashboard-cube")
+@click.option("--full", is_flag=True, help="Rebuild every row instead of only shipments changed since the last run.")
+def refresh_dashboard_cube_cmd(full):
+    """Refresh RFT_DashboardCube (schedule this; read by the dashboard when DASHBOARD_CUBE is on)."""
+    RFT_DashboardCube.__table__.create(bind=engine, checkfirst=True)
+    RFT_RefreshWatermark.__table__.create(bind=engine, checkfirst=True)
+    db = Session()
+    try:
+        n = refresh_dashboard_cube(
+            db, full=full,
+            overlap_hours=app.config.get("CUBE_REFRESH_OVERLAP_HOURS", 24),
+        )
+    finally:
+        db.close()
+    print("RFT_DashboardCube rebuilt." if n is None else f"RFT_DashboardCube: {n} shipment(s) refreshed.")
+
+@app.cli.command("refresh-freight-snapshot")
+@click.option("--full", is_flag=True, help="Rebuild every row instead of only POs changed since the last run.")
+def refresh_freight_snapshot_cmd(full):
+    """Refresh RFT_FreightSnapshot from vw_AllFreightData (schedule this; read when FREIGHT_SNAPSHOT is on)."""
+    RFT_FreightSnapshot.__table__.create(bind=engine, checkfirst=True)
+    RFT_RefreshWatermark.__table__.create(bind=engine, checkfirst=True)
+    db = Session()
+    try:
+        n = refresh_freight_snapshot(
+            db, full=full,
+            overlap_hours=app.config.get("SNAPSHOT_REFRESH_OVERLAP_HOURS", 24),
+        )
+    finally:
+        db.close()
+    print("RFT_FreightSnapshot rebuilt." if n is None else f"RFT_FreightSnapshot: {n} PO(s) refreshed.")
+
+@app.cli.command("refresh-po-rollup")
+@click.option("--full", is_flag=True, help="Rebuild every row instead of only POs changed since the last run.")
+def refresh_po_rollup_cmd(full):
+    """Refresh RFT_PORollup (schedule this; the PO cost report and its export read it)."""
+    RFT_PORollup.__table__.create(bind=engine, checkfirst=True)
+    RFT_RefreshWatermark.__table__.create(bind=engine, checkfirst=True)
+    db = Session()
+    try:
+        n = refresh_po_rollup(
+            db, full=full,
+            overlap_hours=app.config.get("PO_ROLLUP_REFRESH_OVERLAP_HOURS", 24),
+        )
+    finally:
+        db.close()
+    print("RFT_PORollup rebuilt." if n is None else f"RFT_PORollup: {n} PO(s) refreshed.")
+
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080, debug=True)
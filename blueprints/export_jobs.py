@@ -0,0 +1,86 @@
+# blueprints/export_jobs.py
+from flask import Blueprint, request, jsonify, send_file, url_for, abort, session
+from flask_login import login_required
+
+from jobs import export_report, submit, get_job
+from exports import EXPORT_FILES, export_format
+from cache import brand_scope
+from models import Session
+from blueprints.main import (
+    FREIGHT_TRACKING_KEYS, FREIGHT_DATE_KEYWORDS,
+    _freight_export_rows, _freight_export_filters, _freight_tracking_types, _log_freight_export, _parse_since,
+)
+
+bp = Blueprint('export_jobs', __name__, url_prefix='/exports')
+
+
+# ── Reports the worker pool can build ─────────────────────────────────────
+@export_report("freight_tracking", basename="FreightTracking")
+def _freight_tracking_export(db, filters, scope):
+    keys = FREIGHT_TRACKING_KEYS
+    return dict(
+        rows       = _freight_export_rows(
+            db, filters.get("brands") or [], _parse_since(filters.get("since")), filters.get("status_after"),
+            scope=scope,
+        ),
+        columns    = keys,
+        sheet_name = "FreightTracking",
+        date_cols  = [c for c in keys if any(kw in c for kw in FREIGHT_DATE_KEYWORDS)],
+        types      = _freight_tracking_types(),
+    )
+
+
+def _job_json(job):
+    out = {k: job[k] for k in ("id", "report", "format", "status", "rows", "error")}
+    out["status_url"] = url_for("export_jobs.job_status", job_id=job["id"])
+    if job["status"] == "done":
+        out["download_url"] = url_for("export_jobs.job_file", job_id=job["id"])
+    return out
+
+@bp.route('', methods=['POST'])
+@login_required
+def start_job():
+    """Queue an export: form fields `report`, `format`, `export_brands` and optionally `delta` / `since`."""
+    report = request.form.get("report", "")
+    if report != "freight_tracking":
+        return jsonify({"error": f"unknown report: {report}"}), 400
+
+    db = Session()
+    try:
+        filters, entry = _freight_export_filters(db, request.form)
+    finally:
+        db.close()
+    # the worker thread has no request: pass the user's brand restriction along;
+    # the export is logged by the worker once its file is in place
+    job = submit(report, filters, export_format(request.form),
+                 owner=session.get("username"), scope=brand_scope(),
+                 on_success=lambda db: _log_freight_export(db, entry))
+    return jsonify(_job_json(job)), 202
+
+def _own_job(job_id):
+    """The job, if it exists and was submitted by the current user; 404 otherwise."""
+    job = get_job(job_id)
+    if job is None or job["owner"] != session.get("username"):
+        abort(404)
+    return job
+
+@bp.route('/<job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    return jsonify(_job_json(_own_job(job_id)))
+
+@bp.route('/<job_id>/file', methods=['GET'])
+@login_required
+def job_file(job_id):
+    job = _own_job(job_id)
+    if job["status"] != "done":
+        abort(404)
+    try:
+        return send_file(
+            job["path"],
+            download_name = job["filename"],
+            as_attachment = True,
+            mimetype      = EXPORT_FILES[job["format"]][1],
+        )
+    except FileNotFoundError:
+        abort(410)      # pruned from the cache since; start the export again
@@ -18,6 +18,9 @@ import re
 import random
 import logging
 import json
+import base64
+import heapq
+from datetime           import date, timedelta
 from decimal            import Decimal
 import os
 from io                 import BytesIO
@@ -28,10 +31,14 @@ from flask_login        import login_required
 from models             import *
 from collections        import defaultdict
 from blueprints.auth    import current_user
+from filter_options     import filter_options
+from exports            import export_response, export_format, frame_rows, column_types, DATE_FORMAT
+from costs              import COST_COLUMNS, cost_matrix, cost_breakdown
+from freight_facts      import freight_facts, changed_since
 from utils              import (
     get_table_metadata, generate_unique_shipment_number, export_to_excel, etl_purchase_orders,
-    get_countries, fetch_expense_data, build_expense_columns, export_shipment_expense_report,
-    export_po_report, build_po_report_df, build_po_columns, DELIVERED_STATUSES
+    get_countries, fetch_expense_data, build_expense_columns, EXPENSE_BUCKETS, export_shipment_expense_report,
+    export_po_report, build_po_report_df, build_po_columns, month_filter, DELIVERED_STATUSES
 )
 
 
@@ -89,276 +96,268 @@ def set_theme():
 def call_home():
     return render_template("dashboard/A-new_DASH.html")
 
-@bp.route("/freight_trackingView", methods=["GET", "POST"])
-def freight_trackingView():
-    model = None
-    export_brands = None
+# ── Freight tracking grid ────────────────────────────────────────────────
+# grid / export columns, in order ("BLNmuber" is the key the template and export use)
+FREIGHT_TRACKING_KEYS = [
+    "Brand", "ShipmentNumber", "BLNmuber", "PODate", "PONumber", "Site",  "LCNumber", "ModeOfTransport",
+    "LCDate", "SapItemLine", "Article", "CategoryName", "CategoryDesc",
+    "ShipmentCreatedDate", "ContainerNumber","QtyInContainer", "OriginPort", "InvoiceNumbers", "POD", "ContainerDeadline",
+    "POStatus", "ShipmentStatus", "ContainerStatus", "PlanedContainerStatus",
+    "ECCDate", "ETAOrigin", "ETDOrigin", "ETADestination", 
+    "ETDDestination", "ETAWH","CCDate", "ATAOrigin", "ATDOrigin","ATADP", "ATDDPort", "ATAWH", 
+    "YardInDate", "YardOutDate", "BiyanNumber", "SADDADNumber",
+]
+
+FREIGHT_PAGE_SIZE     = 100
+FREIGHT_MAX_PAGE_SIZE = 1000
+
+# freight_facts.FREIGHT_FACTS behind each grid column, plus the keyset tiebreaker
+FREIGHT_TRACKING_FACTS = (
+    "Brand", "ShipmentNumber", "BLNumber", "PODate", "PONumber", "Site", "LCNumber", "ModeOfTransport",
+    "LCDate", "SapItemLine", "Article", "CategoryName", "CategoryDesc",
+    "ShipmentCreatedDate", "ContainerNumber", "QtyInContainer", "OriginPort", "InvoiceNumbers", "POD", "ContainerDeadline",
+    "POStatus", "ShipmentStatus", "ContainerStatus", "PlanedContainerStatus",
+    "ECCDate", "ETAOrigin", "ETDOrigin", "ETADestination",
+    "ETDDestination", "ETAWH", "CCDate", "ATAOrigin", "ATDOrigin", "ATADP", "ATDDPort", "ATAWH",
+    "YardInDate", "YardOutDate", "BiyanNumber", "SADDADNumber",
+    "ContainerLineID",
+)
+
+def _freight_tracking_query():
+    """
+    The grid's SELECT (shared and compile-cached, see freight_facts.py). Unordered
+    and unpaged; the columns are FREIGHT_TRACKING_KEYS followed by ContainerLineID.
+    """
+    return freight_facts(FREIGHT_TRACKING_FACTS)
+
+def _freight_tracking_types():
+    """Parquet column types of the grid / export, from the query's columns."""
+    return column_types(_freight_tracking_query().selected_columns, FREIGHT_TRACKING_KEYS)
+
+def _freight_page(model, q, cursor=None, page_size=FREIGHT_PAGE_SIZE):
+    """
+    One page of the SELECT `q` in (ShipmentNumber DESC, ContainerLineID DESC) order, starting
+    after `cursor` = (ShipmentNumber, ContainerLineID) of the previous page's last row.
+    Seeks past the cursor instead of using OFFSET, so deep pages cost the same as the first.
+    Returns (rows as dicts keyed by FREIGHT_TRACKING_KEYS, next cursor or None).
+    """
+    sn_col, cl_col = RFT_Shipment.ShipmentNumber, RFT_ContainerLine.ContainerLineID
+    if cursor:
+        sn, clid = cursor
+        # SQL Server sorts NULL lowest, i.e. last in DESC order
+        if sn is None:
+            q = q.where(sn_col.is_(None), cl_col < clid)
+        else:
+            q = q.where(or_(sn_col < sn, sn_col.is_(None), and_(sn_col == sn, cl_col < clid)))
+
+    rows = model.execute(q.order_by(desc(sn_col), desc(cl_col)).limit(page_size + 1)).all()
+    more, rows = len(rows) > page_size, rows[:page_size]
+    next_cursor = (rows[-1].ShipmentNumber, rows[-1].ContainerLineID) if more else None
+    # zip stops at the last grid column, dropping ContainerLineID
+    return [dict(zip(FREIGHT_TRACKING_KEYS, row)) for row in rows], next_cursor
+
+def _encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode() if cursor else None
+
+def _decode_cursor(token):
+    sn, clid = json.loads(base64.urlsafe_b64decode(token.encode()))
+    return sn, int(clid)
+
+@bp.route("/freight_trackingView/rows", methods=["GET"])
+def freight_tracking_rows():
+    """Keyset-paged JSON for the freight tracking grid: ?page_size=N&after=<next from the previous page>"""
     model = Session()
-    
-    limit_num = request.form.get("limit", 100)
-    ofset_num = 100
-    
-    # ── 1) Latest Purchase-Order status ────────────────────────────────────
-    Hpo1 = aliased(RFT_StatusHistory)
-    latest_po = (
-        model
-        .query(
-            Hpo1.EntityID.label("POID"),
-            func.max(Hpo1.StatusDate).label("mx_po")
-        )
-        .filter(Hpo1.EntityType == literal("Purchase Order"))
-        .group_by(Hpo1.EntityID)
-        .subquery()
-    )
-    Hpo2 = aliased(RFT_StatusHistory)
 
-    # ── 2) Latest Shipment status ─────────────────────────────────────────
-    Hs1 = aliased(RFT_StatusHistory)
-    latest_shp = (
-        model
-        .query(
-            Hs1.EntityID.label("ShipmentID"),
-            func.max(Hs1.StatusDate).label("mx_shp")
-        )
-        .filter(Hs1.EntityType == literal("Shipment"))
-        .group_by(Hs1.EntityID)
-        .subquery()
-    )
-    Hs2 = aliased(RFT_StatusHistory)
+    page_size = request.args.get("page_size", FREIGHT_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, FREIGHT_MAX_PAGE_SIZE))
+    after     = request.args.get("after")
+    try:
+        cursor = _decode_cursor(after) if after else None
+    except (ValueError, TypeError):
+        return jsonify(error="bad cursor"), 400
+
+    rows, next_cursor = _freight_page(model, _freight_tracking_query(), cursor, page_size)
+    rows = [
+        {k: (v.isoformat() if isinstance(v, date) else v) for k, v in r.items()}
+        for r in rows
+    ]
+    return jsonify(rows=rows, next=_encode_cursor(next_cursor))
 
-    # ── 3) Latest Container status ────────────────────────────────────────
-    Hc1 = aliased(RFT_StatusHistory)
-    latest_ctn = (
-        model
-        .query(
-            Hc1.EntityID.label("ContainerID"),
-            func.max(Hc1.StatusDate).label("mx_ctn")
-        )
-        .filter(Hc1.EntityType == literal("Container"))
-        .group_by(Hc1.EntityID)
-        .subquery()
-    )
-    Hc2 = aliased(RFT_StatusHistory)
-    
-    # ── 3) Latest PLANED Container status ────────────────────────────────────────
-    Hcp1 = aliased(RFT_StatusHistory)
-    latest_ctn_planed = (
-        model
-        .query(
-            Hcp1.EntityID.label("ContainerID"),
-            func.max(Hcp1.StatusDate).label("mx_ctn")
-        )
-        .filter(Hcp1.EntityType == literal("Planed-Container"))
-        .group_by(Hcp1.EntityID)
-        .subquery()
-    )
-    Hcp2 = aliased(RFT_StatusHistory)
-    
-    #  ————————————————————————————————————————————————————————————
-    # Build the invoices subquery with STUFF(... FOR XML PATH(''))
-    # ————————————————————————————————————————————————————————————
-    invoice_subq = (
-        select(
-            literal_column("Inv.ShipmentID").label("ShipID"),
-            # Use literal_column for the STUFF(...) expression so we can label it
-            literal_column(
-              """
-              STUFF(
-                (
-                  SELECT ',' + i2.InvoiceNumber
-                  FROM RFT_Invoices AS i2
-                  WHERE i2.ShipmentID = Inv.ShipmentID
-                  FOR XML PATH(''), TYPE
-                ).value('.', 'NVARCHAR(MAX)')
-              , 1, 1, '')
-              """
-            ).label("InvoiceNumbers")
-        )
-        .select_from(text("RFT_Invoices AS Inv"))
-        .group_by(literal_column("Inv.ShipmentID"))
-        .subquery()
-    )
+# export: columns whose name contains any of these are written as Excel dates
+FREIGHT_DATE_KEYWORDS = [
+    "Date", "Deadline",
+    "ETAOrigin", "ETDOrigin", "ETADestination", "ETDDestination", "ETAWH",
+    "ATAOrigin", "ATDOrigin", "ATADP", "ATDDPort", "ATAWH"
+]
+
+FREIGHT_EXPORT_REPORT = "FreightTracking"     # RFT_ExportLog.Report
 
+def _parse_since(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def _delta_window(model, username, since=None):
+    """
+    (since, status_after) for a delta export: `since` if given, else the user's
+    previous FreightTracking export; (None, None) when there is nothing to
+    start from. `since` is moved back by the server's UTC offset, because
+    onupdate timestamps are written with datetime.utcnow() while the column
+    defaults use GETDATE().
+    """
+    status_after = None
+    if since is None:
+        last = (
+            model.query(RFT_ExportLog)
+                 .filter_by(Username=username, Report=FREIGHT_EXPORT_REPORT)
+                 .order_by(desc(RFT_ExportLog.ExportedAt))
+                 .first()
+        )
+        if last is None:
+            return None, None
+        since, status_after = last.ExportedAt, last.LastStatusID
+    utc_offset = model.scalar(select(func.datediff(literal_column("minute"), func.getutcdate(), func.getdate())))
+    return since - timedelta(minutes=max(utc_offset or 0, 0)), status_after
+
+def _freight_export_filters(model, form):
+    """
+    Filters for a FreightTracking export from the export form: brands, and for
+    a delta export (`delta` ticked) the since / status_after window. A first
+    delta export with no `since` falls back to full.
+    Returns (filters, log entry); pass the entry to _log_freight_export only
+    once the export has been written, so a failed export does not move the
+    next delta's starting point.
+    """
+    username = session.get("username", "system")
+    filters  = {"brands": form.getlist("export_brands"), "since": None, "status_after": None}
+
+    # taken before the export's query runs, so the next delta can't miss a change
+    exported_at    = model.scalar(select(func.getdate()))
+    last_status_id = model.scalar(select(func.max(RFT_StatusHistory.StatusHistoryID)))
+
+    if "delta" in form:
+        since, filters["status_after"] = _delta_window(model, username, _parse_since(form.get("since")))
+        filters["since"] = since.isoformat() if since else None
+
+    entry = dict(
+        Username     = username,
+        Report       = FREIGHT_EXPORT_REPORT,
+        Mode         = "delta" if filters["since"] else "full",
+        Since        = _parse_since(filters["since"]),
+        ExportedAt   = exported_at,
+        LastStatusID = last_status_id,
+    )
+    return filters, entry
+
+def _log_freight_export(db, entry):
+    """Record a finished FreightTracking export (entry from _freight_export_filters)."""
+    db.add(RFT_ExportLog(**entry))
+    db.commit()
+
+def _then(rows, done):
+    """Yield `rows`, then call done() once they have all been produced."""
+    yield from rows
+    done()
+
+def _freight_export_rows(model, brands=None, since=None, status_after=None, scope=None):
+    """
+    Export rows (dicts keyed by FREIGHT_TRACKING_KEYS) in ShipmentNumber order:
+    the PO rows streamed from the database with yield_per, with the NON-PO items
+    merged in after each shipment's PO rows. With `since`, only rows changed
+    after it (see freight_facts.changed_since), and the NON-PO items of
+    shipments updated after it.
+    scope -- > the user's brand restriction (cache.brand_scope()), always
+    applied on top of `brands`; needed where `model` has no brand filter
+    (background export jobs)
+    """
+    q = _freight_tracking_query()
+    if since is not None:
+        q = q.where(changed_since(since, status_after))
     
-    # 1) build a join from PO → PO line → Shipment PO line → Container line → Container
-    q = (
+    # NON-PO items are few: load them up front, sort them by shipment and merge
+    # them into the streamed main query below
+    non_po_items = (
         model.query(
-            RFT_PurchaseOrder.Brand.label("Brand"),
-            RFT_Shipment.ShipmentNumber.label("ShipmentNumber"),
-            RFT_Shipment.BLNumber.label("BLNumber"),
-            RFT_PurchaseOrder.PODate.label("PODate"),
-            RFT_PurchaseOrder.PONumber.label("PONumber"),
-            RFT_PurchaseOrder.Site.label("Site"),
-            RFT_PurchaseOrder.LCNumber.label("LCNumber"),
-            RFT_Shipment.ModeOfTransport.label("ModeOfTransport"),
-            RFT_PurchaseOrder.LCDate.label("LCDate"),
-            RFT_PurchaseOrderLine.SapItemLine.label("SapItemLine"),
-            RFT_PurchaseOrderLine.Article.label("Article"),
-            RFT_CategoriesMappingMain.CatName.label("CategoryName"),
-            RFT_CategoriesMappingMain.CatDesc.label("CategoryDesc"),
-            RFT_Shipment.CreatedDate.label("ShipmentCreatedDate"),
-            RFT_Container.ContainerNumber.label("ContainerNumber"),
-            RFT_ContainerLine.QtyInContainer.label("QtyInContainer"),
-            # New cols
-            RFT_Shipment.OriginPort.label("OriginPort"),
-            invoice_subq.c.InvoiceNumbers.label("InvoiceNumbers"),
-            RFT_Shipment.POD.label("POD"),
-            RFT_Shipment.ContainerDeadline.label("ContainerDeadline"),
-            
-            # Statuses
-            Hpo2.Status.label("POStatus"),
-            Hs2.Status.label("ShipmentStatus"),
-            Hc2.Status.label("ContainerStatus"),
-            Hcp2.Status.label("PlanedContainerStatus"),
-            # DATES
-            RFT_Shipment.ECCDate.label("ECCDate"),
-            RFT_Shipment.ETAOrigin.label("ETAOrigin"),
-            RFT_Shipment.ETDOrigin.label("ETDOrigin"),
-            RFT_Shipment.ETADestination.label("ETADestination"),
-            RFT_Shipment.ETDDestination.label("ETDDestination"),
-            RFT_Shipment.ETAWH.label("ETAWH"),
-            RFT_Container.CCDate.label("CCDate"),
-            RFT_Container.ATAOrigin.label("ATAOrigin"),
-            RFT_Container.ATDOrigin.label("ATDOrigin"),
-            RFT_Container.ATADP.label("ATADP"),
-            RFT_Container.ATDDPort.label("ATDDPort"),
-            RFT_Container.ATAWH.label("ATAWH"),
-            RFT_Container.YardInDate.label("YardInDate"),
-            RFT_Container.YardOutDate.label("YardOutDate"),
-            RFT_Shipment.BiyanNumber.label("BiyanNumber"),
-            RFT_Shipment.SADDADNumber.label("SADDADNumber"),
+            RFT_NonPoItems.ShipmentID,
+            RFT_NonPoItems.Brand.label("NonPo_Brand"),
+            RFT_NonPoItems.Article.label("NonPo_Article"),
+            RFT_NonPoItems.Qty.label("NonPo_Qty"),
+            RFT_NonPoItems.Value.label("NonPo_Value"),
+            RFT_Shipment.ShipmentNumber,
+            RFT_Shipment.BLNumber
         )
-        # PO → PO lines
-        .join(RFT_PurchaseOrderLine,
-              RFT_PurchaseOrder.POID == RFT_PurchaseOrderLine.POID)
-        # PO status
-        .outerjoin(latest_po,
-                latest_po.c.POID == RFT_PurchaseOrder.POID)
-        .outerjoin(Hpo2,
-                and_(
-                Hpo2.EntityType == literal("PurchaseOrder"),
-                Hpo2.EntityID   == latest_po.c.POID,
-                Hpo2.StatusDate == latest_po.c.mx_po
-                ))
-        # ← here’s the new join to pull in your mapping table
-        .outerjoin(RFT_CategoriesMappingMain,
-          RFT_PurchaseOrderLine.CategoryMappingID == RFT_CategoriesMappingMain.ID)
-        # PO line → Shipment PO lines
-        .join(RFT_ShipmentPOLine,
-              RFT_PurchaseOrderLine.POLineID == RFT_ShipmentPOLine.POLineID)
-        # Shipment PO line → Shipment (for the shipment number)
-        .join(RFT_Shipment,
-              RFT_ShipmentPOLine.ShipmentID == RFT_Shipment.ShipmentID)
-        
-        .outerjoin(latest_shp,
-            latest_shp.c.ShipmentID == RFT_Shipment.ShipmentID)
-        
-        # ← invoices concat subquery
-        .outerjoin(invoice_subq,
-                       invoice_subq.c.ShipID == RFT_Shipment.ShipmentID)
-        
-        .outerjoin(Hs2,
-                and_(
-                Hs2.EntityType == literal("Shipment"),
-                Hs2.EntityID   == latest_shp.c.ShipmentID,
-                Hs2.StatusDate == latest_shp.c.mx_shp
-                ))
-        # Shipment PO line → ContainerLine
-        .join(RFT_ContainerLine,
-              RFT_ShipmentPOLine.ShipmentPOLineID == RFT_ContainerLine.ShipmentPOLineID)
-        # ContainerLine → Container
-        .join(RFT_Container,
-              RFT_ContainerLine.ContainerID == RFT_Container.ContainerID)
-        .outerjoin(latest_ctn,
-            latest_ctn.c.ContainerID == RFT_Container.ContainerID)
-        .outerjoin(Hc2,
-                and_(
-                Hc2.EntityType == literal("Container"),
-                Hc2.EntityID   == latest_ctn.c.ContainerID,
-                Hc2.StatusDate == latest_ctn.c.mx_ctn
-                ))
-        .outerjoin(latest_ctn_planed,
-            latest_ctn_planed.c.ContainerID == RFT_Container.ContainerID)
-        .outerjoin(Hcp2,
-                and_(
-                Hcp2.EntityType == literal("Planed-Container"),
-                Hcp2.EntityID   == latest_ctn_planed.c.ContainerID,
-                Hcp2.StatusDate == latest_ctn_planed.c.mx_ctn
-                ))
-        .order_by(desc(RFT_Shipment.ShipmentNumber))
+        .join(RFT_Shipment, RFT_NonPoItems.ShipmentID == RFT_Shipment.ShipmentID)
     )
     
-    if 'export' not in request.form:
-        print("applying limit")
-        q = q.limit(limit_num)
-        q = q.offset(ofset_num)
-    else:
-        export_brands = request.form.getlist("export_brands")
-
-    # 2) pull it into a list of dicts so our template can use named keys
-    # 2) materialize and pack into dicts
-    keys = [
-        "Brand", "ShipmentNumber", "BLNmuber", "PODate", "PONumber", "Site",  "LCNumber", "ModeOfTransport",
-        "LCDate", "SapItemLine", "Article", "CategoryName", "CategoryDesc",
-        "ShipmentCreatedDate", "ContainerNumber","QtyInContainer", "OriginPort", "InvoiceNumbers", "POD", "ContainerDeadline",
-        "POStatus", "ShipmentStatus", "ContainerStatus", "PlanedContainerStatus",
-        "ECCDate", "ETAOrigin", "ETDOrigin", "ETADestination", 
-        "ETDDestination", "ETAWH","CCDate", "ATAOrigin", "ATDOrigin","ATADP", "ATDDPort", "ATAWH", 
-        "YardInDate", "YardOutDate", "BiyanNumber", "SADDADNumber",
+    if brands:
+        q = q.where(RFT_PurchaseOrder.Brand.in_(brands))
+        non_po_items = non_po_items.filter(RFT_NonPoItems.Brand.in_(brands))
+    if scope is not None:
+        q = q.where(RFT_PurchaseOrder.Brand.in_(scope))
+        non_po_items = non_po_items.filter(RFT_NonPoItems.Brand.in_(scope))
+    if since is not None:
+        non_po_items = non_po_items.filter(RFT_Shipment.LastUpdated > since)
+    
+    non_po_rows = [
+        # a row with mostly empty values, only NON-PO fields filled
+        {
+            "Brand": item.NonPo_Brand,
+            "ShipmentNumber": item.ShipmentNumber,
+            "BLNmuber": item.BLNumber,
+            "PONumber": "NON-PO",
+            "Article": item.NonPo_Article,
+            "QtyInContainer": item.NonPo_Qty,
+        }
+        for item in non_po_items.all()
     ]
     
-    if export_brands:
-        q = q.filter(RFT_PurchaseOrder.Brand.in_(export_brands))
+    def by_shipment(r):
+        return r["ShipmentNumber"] or ""
     
-    results = q.all() 
-    regular_rows  = [dict(zip(keys, row)) for row in results]
-
+    non_po_rows.sort(key=by_shipment)
     
-    # 3. Create additional rows for NON-PO items
-    non_po_rows = []
-    if 'export' in request.form:
-        non_po_items = (
-            model.query(
-                RFT_NonPoItems.ShipmentID,
-                RFT_NonPoItems.Brand.label("NonPo_Brand"),
-                RFT_NonPoItems.Article.label("NonPo_Article"),
-                RFT_NonPoItems.Qty.label("NonPo_Qty"),
-                RFT_NonPoItems.Value.label("NonPo_Value"),
-                RFT_Shipment.ShipmentNumber,
-                RFT_Shipment.BLNumber
-            )
-            .join(RFT_Shipment, RFT_NonPoItems.ShipmentID == RFT_Shipment.ShipmentID)
+    regular_rows = (
+        dict(zip(FREIGHT_TRACKING_KEYS, row))
+        for row in model.execute(
+            q.order_by(RFT_Shipment.ShipmentNumber, RFT_ContainerLine.ContainerLineID)
+             .execution_options(yield_per=1000)
         )
-        
-        if export_brands:
-            non_po_items = non_po_items.filter(RFT_NonPoItems.Brand.in_(export_brands))
-            
-        
-        non_po_items = non_po_items.all()
-        
-        
-        for item in non_po_items:
-            # Create a new row with mostly empty values
-            new_row = {
-                "Brand": item.NonPo_Brand,
-                "ShipmentNumber": item.ShipmentNumber,
-                "BLNmuber": item.BLNumber,
-                "PONumber": "NON-PO",  # Only NON-PO fields filled
-                "Article": item.NonPo_Article,
-                "QtyInContainer": item.NonPo_Qty,
-            }
-            non_po_rows.append(new_row)
-        
-        # 4. Combine both sets of rows
-        combined_rows = regular_rows + non_po_rows
-    else:
-        combined_rows = regular_rows
-    
-    # 5. Sort by ShipmentNumber (optional)
-    combined_rows.sort(key=lambda x: x["ShipmentNumber"])
+    )
+    return heapq.merge(regular_rows, non_po_rows, key=by_shipment)
 
+@bp.route("/freight_trackingView", methods=["GET", "POST"])
+def freight_trackingView():
+    model = None
+    model = Session()
     
-    # 3) load any saved labels for this “view”
+    keys = FREIGHT_TRACKING_KEYS
+    
+    if request.method == 'POST' and 'export' in request.form:
+        filters, entry = _freight_export_filters(model, request.form)
+        since          = _parse_since(filters["since"])
+        
+        # streamed straight into the workbook / csv / parquet file, see exports.py;
+        # logged once every row has been written
+        return export_response(
+            export_format(request.form),
+            _then(
+                _freight_export_rows(model, filters["brands"], since, filters["status_after"]),
+                lambda: _log_freight_export(model, entry),
+            ),
+            columns    = keys,
+            basename   = f"FreightTracking_changes_since_{since:%Y-%m-%d_%H%M}" if since else "FreightTracking",
+            sheet_name = "FreightTracking",
+            date_cols  = [c for c in keys if any(kw in c for kw in FREIGHT_DATE_KEYWORDS)],
+            types      = _freight_tracking_types(),
+        )
+    
+    # first page only; the grid fetches the rest from freight_tracking_rows while scrolling
+    page_size = request.form.get("limit", FREIGHT_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, FREIGHT_MAX_PAGE_SIZE))
+    rows, next_cursor = _freight_page(model, _freight_tracking_query(), page_size=page_size)
+    
+    # load any saved labels for this “view”
     table_name = "FreightTrackingView"
     label_rows = (
         model.query(RFT_FieldLabels)
@@ -367,57 +366,54 @@ def freight_trackingView():
     )
     friendly = {lbl.FieldName: lbl.Label for lbl in label_rows}
 
-    # 4) build our columns metadata in the desired order
+    # build our columns metadata in the desired order
     columns = [
       {"name": k, "label": friendly.get(k, k)}
       for k in keys
     ]
     
-    if request.method == 'POST' and 'export' in request.form:
-        # 2) build DataFrame & write to Excel in-memory
-        df = pd.DataFrame(combined_rows, columns=keys)
-        
-        # 2) convert any “date-like” columns to date-only
-        #    – here we pick up every column whose name contains 'Date' or 'Deadline'
-        # List all the substrings you care about
-        keywords = [
-            "Date", "Deadline",
-            "ETAOrigin", "ETDOrigin", "ETADestination", "ETDDestination", "ETAWH",
-            "ATAOrigin", "ATDOrigin", "ATADP", "ATDDPort", "ATAWH"
-        ]
+    return render_template(
+      "FreightTrackingView.html",
+      rows=rows,
+      columns=columns,
+      next_cursor=_encode_cursor(next_cursor),
+      page_size=page_size
+    )
+
+# ── Container deadlines ───────────────────────────────────────────────────
+DEADLINE_KEYS = ["Status", "Brand", "Origin", "Destination", "CAT", "Cont.", "Mode. T", "Remarks", "DeadlineDate", "Days"]
+
+# days-to-deadline buckets: (bucket, last day in it); Days <= 0 is overdue
+DEADLINE_BUCKETS = [
+    ("overdue", 0),
+    ("due_2d",  2),
+    ("due_5d",  5),
+    ("later",   None),
+]
+# (bucket, background, font) shared by the page and the workbook
+DEADLINE_COLOURS = [
+    ("missing", "#A93226", "#FFFFFF"),
+    ("overdue", "#FFC7CE", "#9C0006"),
+    ("due_2d",  "#FFEB9C", "#9C5700"),
+    ("due_5d",  "#C6EFCE", "#006100"),
+    ("later",   "#A9D08E", "#006100"),
+]
+
+def _deadline_frame(rows):
+    """
+    Deadline rows as a DataFrame sorted by DeadlineDate (missing dates last),
+    with Days (to the deadline, negative when overdue) and its Bucket computed
+    column-wide.
+    """
+    df = pd.DataFrame([tuple(r) for r in rows], columns=DEADLINE_KEYS[:-1])
+    df["DeadlineDate"] = pd.to_datetime(df["DeadlineDate"], errors="coerce")
+    df["Days"] = (df["DeadlineDate"].dt.normalize() - pd.Timestamp.today().normalize()).dt.days.astype("Int64")
 
-        # Pick only those columns whose name contains any of the keywords
-        date_cols = [
-            c for c in df.columns
-            if any(kw in c for kw in keywords)
-        ]
-        for col in date_cols:
-            # turn it into a proper datetime, then take only the date part
-            # df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-        
-        
-        
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            # Sheet 1: FreightTracking
-            df.to_excel(writer, index=False, sheet_name="FreightTracking")
-
-        output.seek(0)
-
-        # 3) send back to browser
-        return send_file(
-        output,
-        download_name="FreightTracking.xlsx",
-        as_attachment=True,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-    else:
-        return render_template(
-        "FreightTrackingView.html",
-        rows=combined_rows,
-        columns=columns
-        )
+    edges  = [float("-inf")] + [last for _, last in DEADLINE_BUCKETS[:-1]] + [float("inf")]
+    bucket = pd.cut(df["Days"].astype("float"), bins=edges, labels=[b for b, _ in DEADLINE_BUCKETS])
+    df["Bucket"] = bucket.astype(object).where(df["Days"].notna(), "missing")
+
+    return df.sort_values("DeadlineDate", kind="stable", na_position="last").reset_index(drop=True)
 
 @bp.route("/containers_deadline_report", methods=["GET", "POST"])
 @login_required
@@ -428,22 +424,11 @@ def containers_deadline_report():
     export_brands = request.form.getlist("export_brands")
     
     # ── 3) Latest Container status ────────────────────────────────────────
-    Hc1 = aliased(RFT_StatusHistory)
-    latest_ctn = (
-        model
-        .query(
-            Hc1.EntityID.label("ContainerID"),
-            func.max(Hc1.StatusDate).label("mx_ctn")
-        )
-        .filter(Hc1.EntityType == literal("Container"))
-        .group_by(Hc1.EntityID)
-        .subquery()
-    )
-    Hc2 = aliased(RFT_StatusHistory)
+    ctn_status = current_status("Container", "ContainerID")
     
     deadline_rows = (
         model.query(
-            Hc2.Status.label("Status"),
+            ctn_status.c.Status.label("Status"),
             RFT_PurchaseOrder.Brand.label("Brand"),
             RFT_Shipment.OriginPort.label("Origin"),
             RFT_Shipment.POD.label("Destination"),
@@ -459,17 +444,10 @@ def containers_deadline_report():
         .join(RFT_Shipment, RFT_ShipmentPOLine.ShipmentID == RFT_Shipment.ShipmentID)
         .join(RFT_ContainerLine, RFT_ShipmentPOLine.ShipmentPOLineID == RFT_ContainerLine.ShipmentPOLineID)
         .join(RFT_Container, RFT_ContainerLine.ContainerID == RFT_Container.ContainerID)
-        .outerjoin(latest_ctn, latest_ctn.c.ContainerID == RFT_Container.ContainerID)
-        .outerjoin(Hc2,
-            and_(
-                Hc2.EntityType == literal("Container"),
-                Hc2.EntityID == latest_ctn.c.ContainerID,
-                Hc2.StatusDate == latest_ctn.c.mx_ctn
-            )
-        )
-        .filter(~ Hc2.Status.in_(DELIVERED_STATUSES))
+        .outerjoin(ctn_status, ctn_status.c.ContainerID == RFT_Container.ContainerID)
+        .filter(~ ctn_status.c.Status.in_(DELIVERED_STATUSES))
         .group_by(
-            Hc2.Status,
+            ctn_status.c.Status,
             RFT_PurchaseOrder.Brand,
             RFT_Shipment.OriginPort,
             RFT_Shipment.POD,
@@ -484,18 +462,7 @@ def containers_deadline_report():
     if export_brands and len(export_brands)>0:
         deadline_rows = deadline_rows.filter(RFT_PurchaseOrder.Brand.in_(export_brands))
     
-    deadline_data = deadline_rows.all()
-    deadline_keys = ["Status", "Brand", "Origin", "Destination", "CAT", "Cont.", "Mode. T", "Remarks", "DeadlineDate", "Days"]
-    deadline_dicts = [dict(zip(deadline_keys, row)) for row in deadline_data]
-    
-    # Calculate days remaining (can be negative)
-    for row in deadline_dicts:
-        deadline = row.get("DeadlineDate")
-        if deadline:
-            deadline_dt = pd.to_datetime(deadline).date()
-            row["Days"] = (deadline_dt - datetime.today().date()).days
-        else:
-            row["Days"] = None
+    deadline_dicts = frame_rows(_deadline_frame(deadline_rows.all()))
     
     # 3) load any saved labels for this “view”
     table_name = "FreightTrackingView"
@@ -509,188 +476,32 @@ def containers_deadline_report():
     # 4) build our columns metadata in the desired order
     columns = [
       {"name": k, "label": friendly.get(k, k)}
-      for k in deadline_keys
+      for k in DEADLINE_KEYS
     ]
     
     
     if request.method == 'POST' and 'export' in request.form:
-        output = BytesIO()
-
-        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-            deadline_df = pd.DataFrame(deadline_dicts, columns=deadline_keys)
-            
-            workbook = writer.book
-        
-            # Convert DeadlineDate to date and drop nulls
-            deadline_df["DeadlineDate"] = pd.to_datetime(deadline_df["DeadlineDate"], errors='coerce')
-            # deadline_df["ETA_Destination"] = pd.to_datetime(deadline_df["ETA_Destination"], errors='coerce')
-            # deadline_df = deadline_df.dropna(subset=["DeadlineDate"])
-        
-            # Sort by DeadlineDate
-            deadline_df = deadline_df.sort_values(by="DeadlineDate")
-            
-            # Write data first
-            date_format = workbook.add_format({
-                'num_format': 'd-mmmm-yyyy',
-                'border': 1
-            })
-            header_format = workbook.add_format({'bold': True, 'border': 1, 'bg_color': '#D9E1F2'})
-            missing_format = workbook.add_format({'bg_color': '#A93226', 'font_color': '#FFFFFF'})
-            
-            # Manually write column headers
-            worksheet = writer.book.add_worksheet("Container Deadlines")
-            writer.sheets["Container Deadlines"] = worksheet
-            for col_num, col_name in enumerate(deadline_df.columns):
-                worksheet.write(0, col_num, col_name, header_format)
-            
-            # Write row by row
-            # With border
-            bordered_format = workbook.add_format({'border': 1})  # Thin border on all sides
-            for row_num, row in enumerate(deadline_df.itertuples(index=False), start=1):
-                for col_num, value in enumerate(row):
-                    if deadline_df.columns[col_num] == "DeadlineDate" and pd.notnull(value):
-                        worksheet.write_datetime(row_num, col_num, value, date_format)
-                    elif pd.isna(value):
-                        worksheet.write_blank(row_num, col_num, None, bordered_format)
-                    else:
-                        worksheet.write(row_num, col_num, value, bordered_format)
-            
-            
-            # Apply date format (e.g., 6-June-2025)
-            deadline_col_idx = deadline_df.columns.get_loc("DeadlineDate")  # 0-based
-            col_letter = chr(65 + deadline_col_idx)
-            worksheet.set_column(f"{col_letter}:{col_letter}", 20, date_format)
-            
-            
-            # For width formating 
-            for idx, col in enumerate(deadline_df.columns):
-                # Convert all values in this column to string and get their lengths
-                series = deadline_df[col].astype(str)
-                max_len = max(
-                    series.map(len).max(),
-                    len(str(col))  # Also consider the header
-                )
-                worksheet.set_column(idx, idx, max_len + 2)  # +2 for padding
-            
-            worksheet.autofilter(0, 0, worksheet.dim_rowmax, worksheet.dim_colmax)
-            # Freez 1st row
-            worksheet.freeze_panes(1, 0)
-
-        
-            # Define format styles
-            red_format = workbook.add_format({'bg_color': '#FFC7CE', 'font_color': '#9C0006'})
-            yellow_format = workbook.add_format({'bg_color': '#FFEB9C', 'font_color': '#9C5700'})
-            light_green_format = workbook.add_format({'bg_color': '#C6EFCE', 'font_color': '#006100'})
-            dark_green_format = workbook.add_format({'bg_color': '#A9D08E', 'font_color': '#006100'})
-        
-            # Find the column index of DeadlineDate
-            deadline_col_idx = deadline_df.columns.get_loc("DeadlineDate")
-        
-            # Apply conditional formatting based on date difference
-            date_cell_range = f"{chr(65 + deadline_col_idx)}2:{chr(65 + deadline_col_idx)}{len(deadline_df)+1}"
-        
-            today_str = pd.Timestamp.today().strftime("%Y-%m-%d")
-
-            # Highlight rows where DeadlineDate is blank (NaT or empty)
-            worksheet.conditional_format(date_cell_range, {
-                'type': 'blanks',
-                'format': missing_format
-            })
-            
-            
-            # Red: Overdue or today
-            worksheet.conditional_format(date_cell_range, {
-                'type': 'formula',
-                'criteria': f'=TODAY()-{chr(65 + deadline_col_idx)}2 >= 0',
-                'format': red_format
-            })
-            
-            # Yellow: 1–2 days left
-            worksheet.conditional_format(date_cell_range, {
-                'type': 'formula',
-                'criteria': f'=AND({chr(65 + deadline_col_idx)}2 - TODAY() <= 2, {chr(65 + deadline_col_idx)}2 - TODAY() > 0)',
-                'format': yellow_format
-            })
-            
-            # Light green: 3–5 days left
-            worksheet.conditional_format(date_cell_range, {
-                'type': 'formula',
-                'criteria': f'=AND({chr(65 + deadline_col_idx)}2 - TODAY() <= 5, {chr(65 + deadline_col_idx)}2 - TODAY() > 2)',
-                'format': light_green_format
-            })
-            
-            # Dark green: 6–10 days left
-            worksheet.conditional_format(date_cell_range, {
-                'type': 'formula',
-                'criteria': f'=AND({chr(65 + deadline_col_idx)}2 - TODAY() <= 10, {chr(65 + deadline_col_idx)}2 - TODAY() > 5)',
-                'format': dark_green_format
-            })
-            
-            # Dark green: >10 days
-            worksheet.conditional_format(date_cell_range, {
-                'type': 'formula',
-                'criteria': f'={chr(65 + deadline_col_idx)}2 - TODAY() > 10',
-                'format': dark_green_format
-            })
-            
-            # DAYS FORMATING 
-            days_col_idx = deadline_df.columns.get_loc("Days")
-            days_range = f"{chr(65 + days_col_idx)}2:{chr(65 + days_col_idx)}{len(deadline_df)+1}"
-            
-            worksheet.conditional_format(days_range, {
-                'type': 'blanks',
-                'format': missing_format
-            })
-            
-            # Red (overdue or 0 days)
-            worksheet.conditional_format(days_range, {
-                'type': 'cell',
-                'criteria': '<=',
-                'value': 0,
-                'format': red_format
-            })
-            
-            # Yellow (1–2 days)
-            worksheet.conditional_format(days_range, {
-                'type': 'cell',
-                'criteria': 'between',
-                'minimum': 1,
-                'maximum': 2,
-                'format': yellow_format
-            })
-            
-            # Light Green (3–5 days)
-            worksheet.conditional_format(days_range, {
-                'type': 'cell',
-                'criteria': 'between',
-                'minimum': 3,
-                'maximum': 5,
-                'format': light_green_format
-            })
-            
-            # Dark Green (6+ days)
-            worksheet.conditional_format(days_range, {
-                'type': 'cell',
-                'criteria': '>=',
-                'value': 6,
-                'format': dark_green_format
-            })
-            
-        
-        output.seek(0)
-        
-        # 3) send back to browser
-        return send_file(
-        output,
-        download_name="Cont_-Deadline-report-RFT.xlsx",
-        as_attachment=True,
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        # DeadlineDate / Days cells are coloured by their bucket, like the page
+        return export_response(
+            export_format(request.form),
+            deadline_dicts,
+            columns     = DEADLINE_KEYS,
+            basename    = "Cont_-Deadline-report-RFT",
+            sheet_name  = "Container Deadlines",
+            date_cols   = ["DeadlineDate"],
+            types       = dict(column_types(deadline_rows.statement.selected_columns), Days=Integer()),
+            date_format = DATE_FORMAT,
+            bordered    = True,
+            styles      = {bucket: {"bg_color": bg, "font_color": fg} for bucket, bg, fg in DEADLINE_COLOURS},
+            row_style   = lambda row: row["Bucket"],
+            styled_cols = ["DeadlineDate", "Days"],
         )
     else:
         return render_template(
         "containerDeadlineReport.html",
         rows=deadline_dicts,
-        columns=columns
+        columns=columns,
+        bucket_colours={bucket: bg for bucket, bg, _ in DEADLINE_COLOURS},
         )
 
 @bp.route("/freight_tracking_report", methods=["GET", "POST"])
@@ -702,179 +513,21 @@ def freight_tracking_report():
     limit_num = request.form.get("limit", 100)
     ofset_num = 100
     
-    # ── 1) Latest Purchase-Order status ────────────────────────────────────
-    Hpo1 = aliased(RFT_StatusHistory)
-    latest_po = (
-        model
-        .query(
-            Hpo1.EntityID.label("POID"),
-            func.max(Hpo1.StatusDate).label("mx_po")
-        )
-        .filter(Hpo1.EntityType == literal("Purchase Order"))
-        .group_by(Hpo1.EntityID)
-        .subquery()
-    )
-    Hpo2 = aliased(RFT_StatusHistory)
-
-    # ── 2) Latest Shipment status ─────────────────────────────────────────
-    Hs1 = aliased(RFT_StatusHistory)
-    latest_shp = (
-        model
-        .query(
-            Hs1.EntityID.label("ShipmentID"),
-            func.max(Hs1.StatusDate).label("mx_shp")
-        )
-        .filter(Hs1.EntityType == literal("Shipment"))
-        .group_by(Hs1.EntityID)
-        .subquery()
-    )
-    Hs2 = aliased(RFT_StatusHistory)
-
-    # ── 3) Latest Container status ────────────────────────────────────────
-    Hc1 = aliased(RFT_StatusHistory)
-    latest_ctn = (
-        model
-        .query(
-            Hc1.EntityID.label("ContainerID"),
-            func.max(Hc1.StatusDate).label("mx_ctn")
-        )
-        .filter(Hc1.EntityType == literal("Container"))
-        .group_by(Hc1.EntityID)
-        .subquery()
-    )
-    Hc2 = aliased(RFT_StatusHistory)
-    
-    # ── 3) Latest PLANED Container status ────────────────────────────────────────
-    Hcp1 = aliased(RFT_StatusHistory)
-    latest_ctn_planed = (
-        model
-        .query(
-            Hcp1.EntityID.label("ContainerID"),
-            func.max(Hcp1.StatusDate).label("mx_ctn")
-        )
-        .filter(Hcp1.EntityType == literal("Planed-Container"))
-        .group_by(Hcp1.EntityID)
-        .subquery()
-    )
-    Hcp2 = aliased(RFT_StatusHistory)
-    
-    #  ————————————————————————————————————————————————————————————
-    # Build the invoices subquery with STUFF(... FOR XML PATH(''))
-    # ————————————————————————————————————————————————————————————
-    invoice_subq = (
-        select(
-            literal_column("Inv.ShipmentID").label("ShipID"),
-            # Use literal_column for the STUFF(...) expression so we can label it
-            literal_column(
-              """
-              STUFF(
-                (
-                  SELECT ',' + i2.InvoiceNumber
-                  FROM RFT_Invoices AS i2
-                  WHERE i2.ShipmentID = Inv.ShipmentID
-                  FOR XML PATH(''), TYPE
-                ).value('.', 'NVARCHAR(MAX)')
-              , 1, 1, '')
-              """
-            ).label("InvoiceNumbers")
-        )
-        .select_from(text("RFT_Invoices AS Inv"))
-        .group_by(literal_column("Inv.ShipmentID"))
-        .subquery()
-    )
-
-    
-    # 1) build a join from PO → PO line → Shipment PO line → Container line → Container
-    q = (
-        model.query(
-            RFT_PurchaseOrder.Brand.label("Brand"),
-            RFT_Shipment.BLNumber.label("BLNumber"),
-            RFT_PurchaseOrder.PODate.label("PODate"),
-            RFT_PurchaseOrder.PONumber.label("PONumber"),
-            RFT_PurchaseOrderLine.SapItemLine.label("SapItemLine"),
-            RFT_PurchaseOrderLine.Article.label("Article"),
-            RFT_CategoriesMappingMain.CatName.label("CategoryName"),
-            RFT_CategoriesMappingMain.CatDesc.label("CategoryDesc"),
-            RFT_Container.ContainerNumber.label("ContainerNumber"),
-            RFT_ContainerLine.QtyInContainer.label("QtyInContainer"),
-            invoice_subq.c.InvoiceNumbers.label("InvoiceNumbers"),
-            # RFT_Shipment.ECCDate.label("ECCDate"),
-            RFT_Shipment.ETDOrigin.label("ETDOrigin"),
-            RFT_Shipment.ETADestination.label("ETADestination"),
-            RFT_Container.CCDate.label("CCDate"),
-            RFT_Shipment.ContainerDeadline.label("ContainerDeadline"),
-            # Hs2.Status.label("ShipmentStatus"),
-            Hc2.Status.label("ContainerStatus"),
-            Hcp2.Status.label("PlanedContainerStatus"),
-        )
-        # PO → PO lines
-        .join(RFT_PurchaseOrderLine,
-              RFT_PurchaseOrder.POID == RFT_PurchaseOrderLine.POID)
-        # PO status
-        .outerjoin(latest_po,
-                latest_po.c.POID == RFT_PurchaseOrder.POID)
-        .outerjoin(Hpo2,
-                and_(
-                Hpo2.EntityType == literal("PurchaseOrder"),
-                Hpo2.EntityID   == latest_po.c.POID,
-                Hpo2.StatusDate == latest_po.c.mx_po
-                ))
-        # ← here’s the new join to pull in your mapping table
-        .outerjoin(RFT_CategoriesMappingMain,
-          RFT_PurchaseOrderLine.CategoryMappingID == RFT_CategoriesMappingMain.ID)
-        # PO line → Shipment PO lines
-        .join(RFT_ShipmentPOLine,
-              RFT_PurchaseOrderLine.POLineID == RFT_ShipmentPOLine.POLineID)
-        # Shipment PO line → Shipment (for the shipment number)
-        .join(RFT_Shipment,
-              RFT_ShipmentPOLine.ShipmentID == RFT_Shipment.ShipmentID)
-        
-        .outerjoin(latest_shp,
-            latest_shp.c.ShipmentID == RFT_Shipment.ShipmentID)
-        
-        # ← invoices concat subquery
-        .outerjoin(invoice_subq,
-                       invoice_subq.c.ShipID == RFT_Shipment.ShipmentID)
-        
-        # .outerjoin(Hs2,
-        #         and_(
-        #         Hs2.EntityType == literal("Shipment"),
-        #         Hs2.EntityID   == latest_shp.c.ShipmentID,
-        #         Hs2.StatusDate == latest_shp.c.mx_shp
-        #         ))
-        # Shipment PO line → ContainerLine
-        .join(RFT_ContainerLine,
-              RFT_ShipmentPOLine.ShipmentPOLineID == RFT_ContainerLine.ShipmentPOLineID)
-        # ContainerLine → Container
-        .join(RFT_Container,
-              RFT_ContainerLine.ContainerID == RFT_Container.ContainerID)
-        .outerjoin(latest_ctn,
-            latest_ctn.c.ContainerID == RFT_Container.ContainerID)
-        .outerjoin(Hc2,
-                and_(
-                Hc2.EntityType == literal("Container"),
-                Hc2.EntityID   == latest_ctn.c.ContainerID,
-                Hc2.StatusDate == latest_ctn.c.mx_ctn
-                ))
-        .outerjoin(latest_ctn_planed,
-            latest_ctn_planed.c.ContainerID == RFT_Container.ContainerID)
-        .outerjoin(Hcp2,
-                and_(
-                Hcp2.EntityType == literal("Planed-Container"),
-                Hcp2.EntityID   == latest_ctn_planed.c.ContainerID,
-                Hcp2.StatusDate == latest_ctn_planed.c.mx_ctn
-                ))
-        .order_by(desc(RFT_Shipment.ShipmentNumber))
-    )
+    # only the columns the report shows (shared builder, see freight_facts.py)
+    q = freight_facts((
+        "Brand", "BLNumber", "PODate", "PONumber", "SapItemLine", "Article", "CategoryName", "CategoryDesc",
+        "ContainerNumber", "QtyInContainer", "InvoiceNumbers", "ETDOrigin", "ETADestination",
+        "CCDate", "ContainerDeadline", "ContainerStatus", "PlanedContainerStatus",
+    )).order_by(desc(RFT_Shipment.ShipmentNumber))
     
     keys = ["Brand", "BL Number", "PO Date", "PO Number", "Item Line", "Article", "Category", "Desc",
             "Container Number", "Qty In Container", "Invoice Numbers", "ETD Origin", "ETA Destination",
             "Clearance Date", "Container Deadline", "Container Status", "Planed TO"]
     
     if export_brands:
-        q = q.filter(RFT_PurchaseOrder.Brand.in_(export_brands))
+        q = q.where(RFT_PurchaseOrder.Brand.in_(export_brands))
     
-    results = q.all() 
+    results = model.execute(q).all()
     regular_rows  = [dict(zip(keys, row)) for row in results]
 
     
@@ -932,80 +585,33 @@ def freight_tracking_report():
     ]
     
     if request.method == 'POST' and 'export' in request.form:
-        output = BytesIO()
-
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            workbook = writer.book
-            worksheet = workbook.add_worksheet("Shipment Status")
-            writer.sheets["Shipment Status"] = worksheet
-
-            df = pd.DataFrame(combined_rows, columns=keys)
-
-            # Define formats
-            bold_header = workbook.add_format({'bold': True, 'border': 1, 'bg_color': '#D9E1F2'})
-            bordered = workbook.add_format({
-                'border': 1
-            })
-            format_map = {
-                "Under Clearance": workbook.add_format({'bg_color': '#92D050', 'border': 1, 'num_format': 'd-mmmm-yyyy'}),
-                "In Yard": workbook.add_format({'bg_color': "#F2A877", 'border': 1, 'num_format': 'd-mmmm-yyyy'}),
-                "IN-Transit": workbook.add_format({'bg_color': '#9BC2E6', 'border': 1, 'num_format': 'd-mmmm-yyyy'}),
-                "Under Collection": workbook.add_format({'bg_color': '#D9D9D9', 'border': 1, 'num_format': 'd-mmmm-yyyy'}),
-                "Delivered": workbook.add_format({'bg_color': '#FFFFFF', 'border': 1, 'num_format': 'd-mmmm-yyyy'}),
-            }
-
-            # Write legend
-            legend_data = [
-                ["Under Clearance", "Green"],
-                ["Storage Yard", "Orange"],
-                ["In Transit", "Blue"],
-                ["Under Collection", "Grey"],
-                ["Delivered", "White"],
-            ]
-            worksheet.write(0, 0, "Legend", bold_header)
-            for i, (status, color_name) in enumerate(legend_data, start=1):
-                fmt = format_map.get(status, bordered)
-                worksheet.write(i, 0, status, fmt)
-                worksheet.write(i, 1, color_name, fmt)
-
-            start_row = len(legend_data) + 2  # leave gap
-
-            # Write headers
-            for col_num, col_name in enumerate(df.columns):
-                worksheet.write(start_row, col_num, col_name, bold_header)
-
-            # Write data rows
-            for row_idx, row in enumerate(df.itertuples(index=False), start=start_row + 1):
-                row_fmt = format_map.get(row[-2], bordered)  # based on "Shipment Status"
-                for col_idx, value in enumerate(row):
-                    if df.columns[col_idx] != "Qty In Container" and pd.notnull(value):
-                        worksheet.write(row_idx, col_idx, value, row_fmt)
-                    elif df.columns[col_idx] == "Qty In Container" and pd.notnull(value):
-                         worksheet.write(row_idx, col_idx, value, bordered)
-                    else:
-                        worksheet.write_blank(row_idx, col_idx, value, bordered)
-
-            # Autofilter
-            worksheet.autofilter(start_row, 0, row_idx, len(keys) - 1)
-            # Freez rows
-            worksheet.freeze_panes(8, 0)
-
-            # Auto-adjust column widths
-            for idx, col in enumerate(df.columns):
-                max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.set_column(idx, idx, max_len)
+        # rows filled by container status, with a legend above the table
+        status_fills = [
+            ("Under Clearance",  "Green",  "#92D050"),
+            ("In Yard",          "Orange", "#F2A877"),
+            ("IN-Transit",       "Blue",   "#9BC2E6"),
+            ("Under Collection", "Grey",   "#D9D9D9"),
+            ("Delivered",        "White",  "#FFFFFF"),
+        ]
+        legend = [[("Legend", "header")]]
+        legend += [[(status, status), (colour, status)] for status, colour, _ in status_fills]
+        legend += [[]]
 
-        output.seek(0)
-        
-        now = datetime.now()
-        formatted_time = now.strftime("[%#d %B] [%I;%M] %p")  # on Windows  # e.g., "7 July 12:10 PM"
         brands_str = " & ".join(export_brands)
-        file_name = f"Freight Tracker [{brands_str}] {formatted_time}.xlsx"
-        return send_file(
-            output,
-            download_name=file_name,
-            as_attachment=True,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        return export_response(
+            export_format(request.form),
+            combined_rows,
+            columns     = keys,
+            basename    = f"Freight Tracker [{brands_str}] {datetime.now():%Y-%m-%d %H%M}",
+            sheet_name  = "Shipment Status",
+            date_cols   = ["PO Date", "ETD Origin", "ETA Destination", "Clearance Date", "Container Deadline"],
+            types       = column_types(q.selected_columns, keys),
+            date_format = DATE_FORMAT,
+            bordered    = True,
+            preamble    = legend,
+            styles      = {status: {"bg_color": bg} for status, _, bg in status_fills},
+            row_style   = lambda row: row.get("Container Status"),
+            styled_cols = [k for k in keys if k != "Qty In Container"],
         )
 
     else:
@@ -1451,27 +1057,15 @@ def createdShipments():
     # ─── GET ────────────────────────────────────────────────────────────
 
     # build the shipments + attach latest status
-    H1 = aliased(RFT_StatusHistory)
-    latest = (
-        model
-        .query(
-        H1.EntityID.label("ShipmentID"),
-        func.max(H1.StatusDate).label("mx")
-        )
-        .filter(H1.EntityType == literal("Shipment"))
-        # .filter(~H1.Status.in_(DELIVERED_STATUSES) )
-        .group_by(H1.EntityID)
-        .subquery()
-    )
+    latest = current_status("Shipment", "ShipmentID")
 
-    H2 = aliased(RFT_StatusHistory)
     PO     = aliased(RFT_PurchaseOrder)
     POLine = aliased(RFT_PurchaseOrderLine)
     q = (
         model.query(
             RFT_Shipment,
             PO.Brand.label("Brand"),   
-            H2.Status.label("ShipmentLevelStatus")
+            latest.c.Status.label("ShipmentLevelStatus")
         )
         # join PO via the ShipmentPO → PO‐Line → PO chain
         .join(
@@ -1486,18 +1080,9 @@ def createdShipments():
             PO,
             PO.POID == POLine.POID
         )
-        # join to get each shipment’s max(StatusDate)
+        # join each shipment’s current status
         .outerjoin(latest, latest.c.ShipmentID == RFT_Shipment.ShipmentID)
-        # now join back *only* on Shipment history rows
-        .outerjoin(
-            H2,
-            and_(
-                H2.EntityType == literal("Shipment"),
-                H2.EntityID == latest.c.ShipmentID,
-                H2.StatusDate == latest.c.mx
-            )
-        )
-        .filter(~H2.Status.in_(DELIVERED_STATUSES) )
+        .filter(~latest.c.Status.in_(DELIVERED_STATUSES) )
         .order_by(desc(RFT_Shipment.CreatedDate))
     )
     shipments = []
@@ -1590,19 +1175,8 @@ def shipments_status(status=None, mot=None):
     ]
 
     # 2) Latest shipment-level status
-    Hist1 = aliased(RFT_StatusHistory)
-    latest = (
-        model
-        .query(
-            Hist1.EntityID.label("ShipmentID"),
-            func.max(Hist1.StatusDate).label("mx")
-        )
-        .filter(Hist1.EntityType == literal("Shipment"))
-        .group_by(Hist1.EntityID)
-        .subquery()
-    )
+    latest = current_status("Shipment", "ShipmentID")
 
-    Hist2 = aliased(RFT_StatusHistory)
     PO     = aliased(RFT_PurchaseOrder)
     POLine = aliased(RFT_PurchaseOrderLine)
 
@@ -1610,22 +1184,15 @@ def shipments_status(status=None, mot=None):
         model.query(
             RFT_Shipment,
             PO.Brand.label("Brand"),   
-            Hist2.Status.label("ShipmentLevelStatus")
+            latest.c.Status.label("ShipmentLevelStatus")
         )
         .join(RFT_ShipmentPOLine, RFT_ShipmentPOLine.ShipmentID == RFT_Shipment.ShipmentID)
         .join(POLine, POLine.POLineID == RFT_ShipmentPOLine.POLineID)
         .join(PO, PO.POID == POLine.POID)
         .outerjoin(latest, latest.c.ShipmentID == RFT_Shipment.ShipmentID)
-        .outerjoin(Hist2,
-            and_(
-                Hist2.EntityType == literal("Shipment"),
-                Hist2.EntityID == latest.c.ShipmentID,
-                Hist2.StatusDate == latest.c.mx
-            )
-        )
     )
 
-    filters = [Hist2.Status == status]
+    filters = [latest.c.Status == status]
     if mot:
         filters.append(RFT_Shipment.ModeOfTransport == mot)
 
@@ -1689,7 +1256,6 @@ def completedShipments():
     All Shipments / completed
     """
     
-    H2 = aliased(RFT_StatusHistory)
     PO     = aliased(RFT_PurchaseOrder)
     POLine = aliased(RFT_PurchaseOrderLine)
 
@@ -1810,25 +1376,14 @@ def completedShipments():
     # ─── GET ────────────────────────────────────────────────────────────
 
     # build the shipments + attach latest status
-    H1 = aliased(RFT_StatusHistory)
-    latest = (
-        model
-        .query(
-        H1.EntityID.label("ShipmentID"),
-        func.max(H1.StatusDate).label("mx")
-        )
-        .filter(H1.EntityType == literal("Shipment"))
-        .group_by(H1.EntityID)
-        .subquery()
-    )
+    latest = current_status("Shipment", "ShipmentID")
 
-    H2 = aliased(RFT_StatusHistory)
     q = (
         model
         .query(
         RFT_Shipment,
         PO.Brand.label("Brand"),   
-        H2.Status.label("ShipmentLevelStatus")
+        latest.c.Status.label("ShipmentLevelStatus")
         )
         # join PO via the ShipmentPO → PO‐Line → PO chain
         .join(
@@ -1843,18 +1398,9 @@ def completedShipments():
             PO,
             PO.POID == POLine.POID
         )
-        # join to get each shipment’s max(StatusDate)
+        # join each shipment’s current status
         .outerjoin(latest, latest.c.ShipmentID == RFT_Shipment.ShipmentID)
-        # now join back *only* on Shipment history rows
-        .outerjoin(
-        H2,
-        and_(
-            H2.EntityType == literal("Shipment"),
-            H2.EntityID == latest.c.ShipmentID,
-            H2.StatusDate == latest.c.mx
-        )
-        )
-        .filter(H2.Status.in_(DELIVERED_STATUSES) )
+        .filter(latest.c.Status.in_(DELIVERED_STATUSES) )
         .order_by(desc(RFT_Shipment.CreatedDate))
     )
     shipments = []
@@ -2340,17 +1886,18 @@ def updateShipments(shipment_id):
         ]
         
         if container_ids:
-            all_delivered = True
-            for cid in container_ids:
-                latest = (
-                    model.query(RFT_StatusHistory.Status)
-                         .filter_by(EntityType="Container", EntityID=cid)
-                         .order_by(RFT_StatusHistory.StatusDate.desc())
-                         .first()
-                )
-                if not latest or latest.Status != 'Delivered':
-                    all_delivered = False
-                    break
+            # push pending history rows so RFT_CurrentStatus reflects this request
+            model.flush()
+            delivered = (
+                model.query(func.count(RFT_CurrentStatus.EntityID))
+                     .filter(
+                         RFT_CurrentStatus.EntityType == "Container",
+                         RFT_CurrentStatus.EntityID.in_(container_ids),
+                         RFT_CurrentStatus.Status == 'Delivered'
+                     )
+                     .scalar()
+            )
+            all_delivered = delivered == len(container_ids)
         
             if all_delivered:
                 i = RFT_StatusHistory(
@@ -2476,27 +2023,21 @@ def updateShipments(shipment_id):
         .all()
     )
     
-    # 2) for each container, look up its latest “live” and “planned” status
+    # 2) latest “live” and “planned” status for all containers in one lookup
+    cont_ids = [cont.ContainerID for cont in current_form_data.containers]
+    statuses = {}
+    if cont_ids:
+        statuses = {
+            (r.EntityType, r.EntityID): r.Status
+            for r in model.query(RFT_CurrentStatus)
+                          .filter(
+                              RFT_CurrentStatus.EntityType.in_(["Container", "Planed-Container"]),
+                              RFT_CurrentStatus.EntityID.in_(cont_ids)
+                          )
+        }
     for cont in current_form_data.containers:
-        # latest live
-        hist = (
-          model
-          .query(RFT_StatusHistory)
-          .filter_by(EntityType="Container", EntityID=cont.ContainerID)
-          .order_by(RFT_StatusHistory.StatusDate.desc())
-          .first()
-        )
-        cont.current_status = hist.Status if hist else ""
-
-        # latest planned
-        hist2 = (
-          model
-          .query(RFT_StatusHistory)
-          .filter_by(EntityType="Planed-Container", EntityID=cont.ContainerID)
-          .order_by(RFT_StatusHistory.StatusDate.desc())
-          .first()
-        )
-        cont.planned_status = hist2.Status if hist2 else ""
+        cont.current_status = statuses.get(("Container", cont.ContainerID)) or ""
+        cont.planned_status = statuses.get(("Planed-Container", cont.ContainerID)) or ""
     
     custom_agents     = model.query(RFT_CustomAgents).all()
     origin_ports      = model.query(RFT_OriginPorts).all()
@@ -3029,23 +2570,10 @@ def update_containers():
     
     # =============GET
     # --- 1) master filter‐lists ---
-    # All brands (distinct) from your PO → Shipment → Container chain
-    all_brands = [
-        b for (b,) in model
-            .query(RFT_PurchaseOrder.Brand)
-            # .join(RFT_Shipment, RFT_PurchaseOrder.POID==RFT_Shipment.POID)
-            .distinct()
-            .order_by(RFT_PurchaseOrder.Brand)
-            .all()
-    ]
-    # All months (yyyy-MM) from the PO date
-    all_months = [
-        m for (m,) in model
-            .query(func.format(RFT_PurchaseOrder.CreatedDate, "yyyy-MM"))
-            .distinct()
-            .order_by(literal_column("1"))
-            .all()
-    ]
+    # All brands / months (yyyy-MM) from the PO, cached (see filter_options.py)
+    opts       = filter_options()
+    all_brands = opts["po_brands"]
+    all_months = opts["po_created_months"]
     # All container‐level statuses from your master table
     all_status = [
         s.StatusName for s in model
@@ -3057,39 +2585,22 @@ def update_containers():
 
     # --- 2) what the user selected (or “All”) ---
     sel_brands = request.values.getlist("brand_filter") or all_brands
-    sel_months = request.values.getlist("month_filter") or all_months
+    sel_months = request.values.getlist("month_filter")   # empty -> no month filter
     sel_status = request.values.getlist("status_filter") or all_status
 
-    # --- 3) subquery: for each container, its latest status date ---
-    Hist1 = aliased(RFT_StatusHistory)
-    latest = (
-        model
-        .query(
-            Hist1.EntityID.label("ContainerID"),
-            func.max(Hist1.StatusDate).label("max_date")
-        )
-        .filter(Hist1.EntityType == "Container")
-        .group_by(Hist1.EntityID)
-        .subquery()
-    )
+    # --- 3) each container's current status ---
+    latest = current_status("Container", "ContainerID")
 
-    # --- 4) join that back to the history table to get the actual status text ---
-    Hist2 = aliased(RFT_StatusHistory)
+    # --- 4) containers + status text ---
     q = (
       model
       .query(RFT_Container,
              RFT_PurchaseOrder.Brand,
              RFT_Shipment.BLNumber,
              RFT_Shipment.ShipmentNumber.label("ShipmentNumber"),
-             Hist2.Status.label("ContainerLevelStatus"))
+             latest.c.Status.label("ContainerLevelStatus"))
         
       .outerjoin(latest, latest.c.ContainerID == RFT_Container.ContainerID)
-      .outerjoin(
-          Hist2,
-          (Hist2.EntityID   == latest.c.ContainerID) &
-          (Hist2.StatusDate == latest.c.max_date)    &
-          (Hist2.EntityType == "Container")
-      )
       # your other joins (shipment, purchase‐order chain) if you need brand/month filters…
       .join(RFT_Shipment, RFT_Container.ShipmentID == RFT_Shipment.ShipmentID)
       .join(RFT_ShipmentPOLine,
@@ -3100,11 +2611,11 @@ def update_containers():
             RFT_PurchaseOrderLine.POID == RFT_PurchaseOrder.POID)
       .filter(
          RFT_PurchaseOrder.Brand.in_(sel_brands),
-         func.format(RFT_PurchaseOrder.CreatedDate,"yyyy-MM").in_(sel_months),
+         *month_filter(RFT_PurchaseOrder.CreatedDate, sel_months),
          # allow either a chosen status *or* no status at all
          or_(
-           Hist2.Status.in_(sel_status),
-           Hist2.Status.is_(None)
+           latest.c.Status.in_(sel_status),
+           latest.c.Status.is_(None)
          )
       )
       .distinct()
@@ -3230,48 +2741,10 @@ def containers_status(status = None, sel_entity = None, mot=None):
     mot = mot
 
     # 2️⃣ Latest Normal Status (Container)
-    HistC = aliased(RFT_StatusHistory)
-    latest_container = (
-        model.query(
-            HistC.EntityID.label("ContainerID"),
-            func.max(HistC.StatusDate).label("max_date")
-        )
-        .filter(HistC.EntityType == "Container")
-        .group_by(HistC.EntityID)
-        .subquery()
-    )
-
-    HistC2 = aliased(RFT_StatusHistory)
-    latest_status = (
-        model.query(
-            latest_container.c.ContainerID,
-            HistC2.Status.label("NormalStatus")
-        )
-        .join(HistC2, (HistC2.EntityID == latest_container.c.ContainerID) & (HistC2.StatusDate == latest_container.c.max_date))
-        .subquery()
-    )
+    latest_status = current_status("Container", "ContainerID", "NormalStatus")
 
     # 3️⃣ Latest Planned Status (Planed-Container)
-    HistP = aliased(RFT_StatusHistory)
-    latest_planned = (
-        model.query(
-            HistP.EntityID.label("ContainerID"),
-            func.max(HistP.StatusDate).label("max_date")
-        )
-        .filter(HistP.EntityType == "Planed-Container")
-        .group_by(HistP.EntityID)
-        .subquery()
-    )
-
-    HistP2 = aliased(RFT_StatusHistory)
-    latest_plan_status = (
-        model.query(
-            latest_planned.c.ContainerID,
-            HistP2.Status.label("PlannedStatus")
-        )
-        .join(HistP2, (HistP2.EntityID == latest_planned.c.ContainerID) & (HistP2.StatusDate == latest_planned.c.max_date))
-        .subquery()
-    )
+    latest_plan_status = current_status("Planed-Container", "ContainerID", "PlannedStatus")
 
     # 4️⃣ Now Join Containers with latest statuses
     q = (
@@ -3441,33 +2914,8 @@ def inTransitDetails():
         .subquery()
     )
 
-    # --- B) find latest status per container ---
-    H1 = aliased(RFT_StatusHistory)
-    latest_cont = (
-        model.query(
-            H1.EntityID.label("ContainerID"),
-            func.max(H1.StatusDate).label("MaxDate")
-        )
-        .filter(H1.EntityType == literal("Container"))
-        .group_by(H1.EntityID)
-        .subquery()
-    )
-    H2 = aliased(RFT_StatusHistory)
-    cont_status = (
-        model.query(
-            H2.EntityID.label("ContainerID"),
-            H2.Status.label("status")
-        )
-        .join(
-            latest_cont,
-            and_(
-                H2.EntityID   == latest_cont.c.ContainerID,
-                H2.StatusDate == latest_cont.c.MaxDate,
-                H2.EntityType == literal("Container")
-            )
-        )
-        .subquery()
-    )
+    # --- B) latest status per container ---
+    cont_status = current_status("Container", "ContainerID", "status")
 
     # --- C) intransit_qty per Article/Brand from non-delivered containers ---
     intransit_subq = (
@@ -3547,174 +2995,185 @@ def inTransitDetails():
         columns=columns
     )
 
-@bp.route("/coastAnalysis", methods=["GET", "POST"])
-def coastAnalysis():
-    export_brands = request.form.getlist("export_brands")
-    
-    # 1) Load all shipments that have a ShipmentNumber
-    shipments = model.query(RFT_Shipment)
-
-    if export_brands:
-        shipments = (
-            shipments
-            .join(RFT_Shipment.po_lines)
-            .join(RFT_ShipmentPOLine.po_line)
-            .join(RFT_PurchaseOrderLine.purchase_order)
-            .filter(RFT_PurchaseOrder.Brand.in_(export_brands))
+# ── Cost analysis ─────────────────────────────────────────────────────────
+# cost column -> the key the cost analysis page / export uses for it
+COAST_COST_KEYS = dict(zip(COST_COLUMNS, [
+    "freight_cost", "saber_saddad", "custom_duties", "demurrage_charges", "penalties", "others",
+    "YardCharges", "DO_Port_Charges", "ClearanceTransportCharges", "InspectionCharges", "MAWANICharges",
+]))
+
+COAST_PAGE_SIZE     = 200
+COAST_MAX_PAGE_SIZE = 1000
+
+# (key, label) of each page / export column, in order
+COAST_SPECS = [
+    ("shipment_number",   "Shipment #"),
+    ("bill_of_lading",    "B/L"),
+    ("po_numbers",        "PO Numbers"),
+    ("brands",            "Brand"),
+    ("port_of_loading",   "Loading Port"),
+    ("port_of_delivery",  "Release Port"),
+    ("total_qty_shipped", "Total Qty Shipped"),
+    ("total_value_shipped","Total Value Shipped"),
+    ("container_count",   "Num. Containers"),
+    ("cost_per_Container","Cost Per.Container"),
+    ("total_expense",     "Total Expensees"),
+    ("freight_cost",      "Freight Cost"),
+    ("custom_duties",     "Custom Duties"),
+    ("saber_saddad",      "Saber SADDAD"),
+    ("penalties",         "Penalties"),
+    ("demurrage_charges", "Demurrage Charges"),
+    ("others",            "Others"),
+    ("invoice_total",     "Total supplier Invoices"),
+    ("DO_Port_Charges",   "DO_Port_Charges"),
+    ("ClearanceTransportCharges", "ClearanceTransportCharges"),
+    ("InspectionCharges", "InspectionCharges"),
+    ("MAWANICharges",     "MAWANICharges"),
+    ("YardCharges",       "YardCharges")
+]
+
+def _coast_joined(col, name):
+    """Per shipment: the distinct non-null values of PO column `col` over its lines, ', '-joined in order."""
+    SP, POL, PO = RFT_ShipmentPOLine, RFT_PurchaseOrderLine, RFT_PurchaseOrder
+    pairs = (
+        select(SP.ShipmentID, col.label("v"))
+        .join(POL, POL.POLineID == SP.POLineID)
+        .join(PO,  PO.POID      == POL.POID)
+        .where(col.isnot(None))
+        .distinct()
+        .subquery()
+    )
+    return (
+        select(
+            pairs.c.ShipmentID,
+            func.string_agg(cast(pairs.c.v, Text), literal_column("', '")).within_group(pairs.c.v).label(name),
         )
-
-    shipments = shipments.options(
-        joinedload(RFT_Shipment.po_lines)
-        .joinedload(RFT_ShipmentPOLine.po_line)
-        .joinedload(RFT_PurchaseOrderLine.purchase_order)
+        .group_by(pairs.c.ShipmentID)
+        .subquery(name)
     )
-    
-    shipments = shipments.all()
-    
-    # 2) roll up per shipment
-    summary_map = {}
-    for s in shipments:
-        sid = s.ShipmentID
-        if sid not in summary_map:
-            summary_map[sid] = {
-                "shipment_id":       sid,
-                "shipment_number":   s.ShipmentNumber,
-                "bill_of_lading":    s.BLNumber,
-                "port_of_loading":   s.OriginPort,
-                "port_of_delivery":  s.POD,
-                "brands":            set(),
-                "po_numbers":        set(),
-                "total_qty_shipped": 0,
-                "total_value_shipped": 0,
-                "container_ids":     set(),
-                "invoice_total":     Decimal('0'),
-                "freight_cost":      s.FreightCost or Decimal('0'),
-                "custom_duties":     s.CustomDuties or Decimal('0'),
-                "saber_saddad":      s.SaberSADDAD or Decimal('0'),
-                "penalties":         s.Penalties or Decimal('0'),
-                "demurrage_charges": s.DemurrageCharges or Decimal('0'),
-                "others":            s.OtherCharges or Decimal('0'),
-                "DO_Port_Charges":   s.DO_Port_Charges or Decimal('0'),
-                "ClearanceTransportCharges": s.ClearanceTransportCharges or Decimal('0'),
-                "InspectionCharges": s.InspectionCharges or Decimal('0'),
-                "MAWANICharges":     s.MAWANICharges or Decimal('0'),
-                "YardCharges":       s.YardCharges or Decimal('0'),
-            }
 
-        grp = summary_map[sid]
-
-        for sp_line in s.po_lines:
-            po_line = sp_line.po_line
-            if po_line:
-                po = po_line.purchase_order
-                if po:
-                    grp["brands"].add(po.Brand)
-                    grp["po_numbers"].add(po.PONumber)
-                grp["total_qty_shipped"] += sp_line.QtyShipped or 0
-                grp["total_value_shipped"] += po_line.TotalValue or 0
-
-        for container in s.containers:
-            grp["container_ids"].add(container.ContainerID)
-
-        # Sum invoice values
-        grp["invoice_total"] += sum(inv.InvoiceValue for inv in s.invoices if inv.InvoiceValue)
-
-    # 3) finalize each summary record
-    summary = []
-    for grp in summary_map.values():
-        grp["brands"] = ", ".join(sorted(grp["brands"]))
-        grp["po_numbers"] = ", ".join(sorted(grp["po_numbers"]))
-        grp["container_count"] = len(grp["container_ids"])
-
-        grp["total_expense"] = (
-            grp["freight_cost"] 
-            + grp["custom_duties"] 
-            + grp["penalties"] 
-            + grp["demurrage_charges"] 
-            + grp["saber_saddad"] 
-            + grp["others"] 
-            + grp["DO_Port_Charges"] 
-            + grp["ClearanceTransportCharges"] 
-            + grp["InspectionCharges"] 
-            + grp["MAWANICharges"]
+def _coast_query(brands=None):
+    """
+    One row per shipment for the cost analysis, newest first: ports, the
+    shipment's brands / PO numbers, shipped qty / value, container count,
+    supplier invoice total and each cost (keys as in COAST_SPECS, plus
+    shipment_id). Everything is grouped in SQL; see _coast_rows for totals.
+    brands -- > only shipments with a line of one of these brands (all of the
+    shipment's brands / POs are still listed)
+    """
+    S, SP, POL, PO, C = RFT_Shipment, RFT_ShipmentPOLine, RFT_PurchaseOrderLine, RFT_PurchaseOrder, RFT_Container
+    INV = RFT_InvoiceSummary
+
+    lines = (
+        select(
+            SP.ShipmentID,
+            func.sum(SP.QtyShipped).label("qty"),
+            func.sum(POL.TotalValue).label("value"),
         )
+        .join(POL, POL.POLineID == SP.POLineID)
+        .group_by(SP.ShipmentID)
+        .subquery("lines")
+    )
+    ctn = (
+        select(C.ShipmentID, func.count(C.ContainerID).label("n"))
+        .group_by(C.ShipmentID)
+        .subquery("ctn")
+    )
+    brand_list = _coast_joined(PO.Brand,    "brands")
+    po_list    = _coast_joined(PO.PONumber, "po_numbers")
 
-        grp["cost_per_Container"] = round(grp["total_expense"] / grp["container_count"], 2) if grp["container_count"] else 0
-        summary.append(grp)
+    q = (
+        select(
+            S.ShipmentID.label("shipment_id"),
+            S.ShipmentNumber.label("shipment_number"),
+            S.BLNumber.label("bill_of_lading"),
+            S.OriginPort.label("port_of_loading"),
+            S.POD.label("port_of_delivery"),
+            func.coalesce(brand_list.c.brands, "").label("brands"),
+            func.coalesce(po_list.c.po_numbers, "").label("po_numbers"),
+            func.coalesce(lines.c.qty,   0).label("total_qty_shipped"),
+            func.coalesce(lines.c.value, 0).label("total_value_shipped"),
+            func.coalesce(ctn.c.n,       0).label("container_count"),
+            func.coalesce(INV.InvoiceTotal, 0).label("invoice_total"),
+            *[func.coalesce(getattr(S, col), 0).label(key) for col, key in COAST_COST_KEYS.items()],
+        )
+        .outerjoin(lines,      lines.c.ShipmentID      == S.ShipmentID)
+        .outerjoin(ctn,        ctn.c.ShipmentID        == S.ShipmentID)
+        .outerjoin(brand_list, brand_list.c.ShipmentID == S.ShipmentID)
+        .outerjoin(po_list,    po_list.c.ShipmentID    == S.ShipmentID)
+        .outerjoin(INV,        INV.ShipmentID          == S.ShipmentID)
+    )
+    if brands:
+        q = q.where(S.ShipmentID.in_(
+            select(SP.ShipmentID)
+            .join(POL, POL.POLineID == SP.POLineID)
+            .join(PO,  PO.POID      == POL.POID)
+            .where(PO.Brand.in_(brands))
+        ))
+    return q.order_by(S.ShipmentID.desc())
+
+def _coast_rows(rows):
+    """Rows of _coast_query as dicts, with total_expense / cost_per_Container for the whole batch in one pass."""
+    rows = [dict(r._mapping) for r in rows]
+    cb = cost_breakdown(
+        cost_matrix(rows, list(COAST_COST_KEYS.values())),
+        containers=[r["container_count"] for r in rows],
+    )
+    for row, total, per_ctn in zip(rows, cb.total, cb.per_container):
+        row["total_expense"]      = round(float(total), 2)
+        row["cost_per_Container"] = round(float(per_ctn), 2)
+    return rows
+
+def _coast_export_rows(model, brands=None):
+    """Every shipment's row, streamed (yield_per) and totalled a batch at a time."""
+    result = model.execute(_coast_query(brands).execution_options(yield_per=1000))
+    for batch in result.partitions():
+        yield from _coast_rows(batch)
 
-    # 4) build column metadata manually
-    sample = summary[0] if summary else {}
-    cols = []
-    specs = [
-        ("shipment_number",   "Shipment #"),
-        ("bill_of_lading",    "B/L"),
-        ("po_numbers",        "PO Numbers"),
-        ("brands",            "Brand"),
-        ("port_of_loading",   "Loading Port"),
-        ("port_of_delivery",  "Release Port"),
-        ("total_qty_shipped", "Total Qty Shipped"),
-        ("total_value_shipped","Total Value Shipped"),
-        ("container_count",   "Num. Containers"),
-        ("cost_per_Container","Cost Per.Container"),
-        ("total_expense",     "Total Expensees"),
-        ("freight_cost",      "Freight Cost"),
-        ("custom_duties",     "Custom Duties"),
-        ("saber_saddad",      "Saber SADDAD"),
-        ("penalties",         "Penalties"),
-        ("demurrage_charges", "Demurrage Charges"),
-        ("others",            "Others"),
-        ("invoice_total",     "Total supplier Invoices"),
-        ("DO_Port_Charges",   "DO_Port_Charges"),
-        ("ClearanceTransportCharges", "ClearanceTransportCharges"),
-        ("InspectionCharges", "InspectionCharges"),
-        ("MAWANICharges",     "MAWANICharges"),
-        ("YardCharges",       "YardCharges")
-    ]
+@bp.route("/coastAnalysis", methods=["GET", "POST"])
+def coastAnalysis():
+    specs = COAST_SPECS
 
     if request.method == 'POST' and 'export' in request.form:
-        df = pd.DataFrame(summary)
-        df = df[[key for key, _ in specs]]
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name="Shipment Costs")
-            workbook  = writer.book
-            worksheet = writer.sheets["Shipment Costs"]
-
-            header_format = workbook.add_format({
-                'bold': True, 'bg_color': '#D9E1F2',
-                'border': 1, 'text_wrap': True, 'align': 'center'
-            })
-            for col_num, (key, label) in enumerate(specs):
-                worksheet.write(0, col_num, label, header_format)
-
-            worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
-
-            for i, col in enumerate(df.columns):
-                max_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.set_column(i, i, max_len)
-
-            cell_format = workbook.add_format({'border': 1})
-            worksheet.conditional_format(
-                1, 0, len(df), len(df.columns) - 1,
-                {'type': 'no_errors', 'format': cell_format}
-            )
-
-            worksheet.freeze_panes(1, 0)
-
-        output.seek(0)
-        
-        now = datetime.now()
-        formatted_time = now.strftime("[%#d %B] [%I;%M] %p")  # on Windows  # e.g., "7 July 12:10 PM"
-        # brands_str = " & ".join(export_brands)
-        file_name = f"Cost_Analysis_Report_{formatted_time}.xlsx"
-        
-        return send_file(output, download_name=file_name, as_attachment=True)
-    
+        return export_response(
+            export_format(request.form),
+            _coast_export_rows(model, request.form.getlist("export_brands")),
+            columns    = [key for key, _ in specs],
+            headers    = [label for _, label in specs],
+            basename   = f"Cost_Analysis_Report_{datetime.now():%Y-%m-%d %H%M}",
+            sheet_name = "Shipment Costs",
+            types      = dict(column_types(_coast_query().selected_columns),
+                              total_expense=Float(), cost_per_Container=Float()),
+            bordered   = True,
+            money_cols = [key for key, _ in specs if key not in (
+                "shipment_number", "bill_of_lading", "po_numbers", "brands",
+                "port_of_loading", "port_of_delivery", "total_qty_shipped", "container_count",
+            )],
+        )
+
+    # one page, keyset on ShipmentID: ?after=<last shipment_id of the previous page>
+    page_size = request.args.get("page_size", COAST_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, COAST_MAX_PAGE_SIZE))
+    after     = request.args.get("after", type=int)
+    start     = request.args.get("start", 0, type=int)    # rows on earlier pages, for Sr.
+
+    q = _coast_query()
+    if after is not None:
+        q = q.where(RFT_Shipment.ShipmentID < after)
+    summary = _coast_rows(model.execute(q.limit(page_size + 1)).all())
+    more, summary = len(summary) > page_size, summary[:page_size]
+    next_url = url_for(
+        "main.coastAnalysis", after=summary[-1]["shipment_id"], start=start + len(summary), page_size=page_size,
+    ) if more else None
+
+    # column metadata; select filters from the values on this page
+    sample = summary[0] if summary else {}
     distinct = defaultdict(set)
     for row in summary:
         for key,_ in specs:
             distinct[key].add(row[key])
 
+    cols = []
     for key,label in specs:
         dtype = type(sample.get(key)).__name__
         col = {"name":key, "label":label}
@@ -3722,17 +3181,17 @@ def coastAnalysis():
         if dtype=="str" and 1 < len(vals) <= 50:
             col["filter_type"] = "select"
             col["options"]     = sorted(vals)
-        elif dtype in ("int","float"):
-            col["filter_type"] = "text"
         else:
             col["filter_type"] = "text"
         cols.append(col)
     
-    
     return render_template(
       "coastAnalysis.html",
-      columns = cols,
-      rows    = summary
+      columns  = cols,
+      rows     = summary,
+      start    = start,
+      next_url = next_url,
+      first_url = url_for("main.coastAnalysis", page_size=page_size) if start else None,
     )
 
 
@@ -3934,11 +3393,8 @@ def upload_file():
         records = model.execute(qyery, {"export_Batch": export_Batch})
         # records = qyery.all() 
         sheet_name = f"""RFT_Batch_{export_Batch}_{datetime.now().strftime("%d/%m/%Y")}"""
-        table_view = []
-        columns_of_tables = records.keys()
-        table_view = [dict(zip(columns_of_tables, row)) for row in records.all()]
 
-        return export_to_excel(sheet_name, table_view)
+        return export_to_excel(sheet_name, records.mappings(), columns=records.keys())
     
     # Export request for tables 
     if request.method == "POST" and "export_table" in request.form:
@@ -3950,11 +3406,8 @@ def upload_file():
         records = model.execute(qyery, {"export_table":export_table})
         # records = qyery.all() 
         sheet_name = f"""{export_table}_{datetime.now().strftime("%d/%m/%Y")}"""
-        table_view = []
-        columns_of_tables = records.keys()
-        table_view = [dict(zip(columns_of_tables, row)) for row in records.all()]
 
-        return export_to_excel(sheet_name, table_view)
+        return export_to_excel(sheet_name, records.mappings(), columns=records.keys())
     
 
     return render_template('upload_file.html', 
@@ -3963,36 +3416,56 @@ def upload_file():
                            table_names = table_names,
                            batches = batches) 
 
+EXPENSE_PAGE_SIZE     = 100
+EXPENSE_MAX_PAGE_SIZE = 1000
+
 @bp.route("/expense_report", methods=["GET","POST"])
 def expense_report():
     # read filter form-values
     sel_brands    = request.values.getlist("brand") or None
     sel_start     = request.values.get("start_date") or None
     sel_end       = request.values.get("end_date") or None
+    sel_top_n     = request.values.get("top_n", type=int) or None
+    sel_bucket    = request.values.get("bucket") if request.values.get("bucket") in EXPENSE_BUCKETS else None
+
+    # ?page=N&page_size=M: pivot rows (brand / category / article) per page
+    page_size = request.values.get("page_size", EXPENSE_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, EXPENSE_MAX_PAGE_SIZE))
+    page      = max(1, request.values.get("page", 1, type=int))
 
     rows    = fetch_expense_data(sel_brands, sel_start, sel_end)
-    rows,  columns   = build_expense_columns(rows)
+    rows, columns, total = build_expense_columns(
+        rows, top_n=sel_top_n, bucket=sel_bucket,
+        offset=(page - 1) * page_size, limit=page_size,
+    )
+    page_count = max(1, -(-total // page_size))
+
+    # the filters, for the page links
+    page_args = {k: v for k, v in request.values.lists() if k != "page"}
 
-    # print(rows)
-    # print(columns)
-    
     return render_template("articleExpenseReport.html",
                            rows=rows,
                            columns=columns,
                            sel_brands=sel_brands,
                            sel_start=sel_start,
-                           sel_end=sel_end)
+                           sel_end=sel_end,
+                           sel_top_n=sel_top_n,
+                           sel_bucket=sel_bucket,
+                           buckets=list(EXPENSE_BUCKETS),
+                           page=page,
+                           page_count=page_count,
+                           total=total,
+                           page_args=page_args)
 
 @bp.route("/po_report", methods=["GET","POST"])
 def po_report_page():
-    if request.method == 'POST' and 'export' in request.form:
-        shp_ids = request.form.getlist('export') #TODO
-        return export_po_report()
-    
-    # read any filters from the form
+    # read any filters from the form / query string (the export form carries them along)
     shipments = request.values.getlist("shipment") or None
 
-    # 1) get the DataFrame
+    if request.method == 'POST' and 'export' in request.form:
+        return export_po_report(shipments)
+
+    # 1) get the DataFrame (from RFT_PORollup)
     df = build_po_report_df(shipments)
 
     # 2) turn into rows+columns for DataTables
@@ -0,0 +1,160 @@
+# cache.py
+"""
+In-process cache for dashboard aggregates.
+
+Results are keyed on (function, normalized arguments, caller's brand scope,
+data version). The data version is bumped after any commit that wrote one of
+the WATCHED tables, so a write makes every older entry unreachable; LRU
+eviction then drops them. Entries also expire after DASHBOARD_CACHE_TTL
+seconds, which bounds staleness across processes (each worker has its own
+version counter).
+"""
+import copy
+import functools
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import session, has_request_context, current_app
+from sqlalchemy import event
+
+from models import (
+    Session,
+    RFT_Shipment, RFT_ShipmentPOLine, RFT_Container, RFT_ContainerLine,
+    RFT_PurchaseOrder, RFT_PurchaseOrderLine, RFT_StatusHistory,
+    RFT_Invoices, RFT_IntervalConfig, RFT_CategoriesMappingMain, RFT_StatusManagement,
+)
+
+# writes to any of these invalidate cached aggregates
+WATCHED = (
+    RFT_Shipment, RFT_ShipmentPOLine, RFT_Container, RFT_ContainerLine,
+    RFT_PurchaseOrder, RFT_PurchaseOrderLine, RFT_StatusHistory,
+    RFT_Invoices, RFT_IntervalConfig, RFT_CategoriesMappingMain, RFT_StatusManagement,
+)
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL         = 300   # seconds
+
+_version      = 0
+_version_lock = Lock()
+
+def data_version():
+    return _version
+
+def bump_data_version():
+    global _version
+    with _version_lock:
+        _version += 1
+    return _version
+
+
+@event.listens_for(Session, "after_flush")
+def _note_watched_writes(db, flush_context):
+    for obj in (*db.new, *db.dirty, *db.deleted):
+        if isinstance(obj, WATCHED):
+            db.info["dash_dirty"] = True
+            return
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(db):
+    # bump on commit, not flush: a reader between flush and commit would
+    # otherwise cache pre-commit data under the new version
+    if db.info.pop("dash_dirty", False):
+        bump_data_version()
+
+@event.listens_for(Session, "after_rollback")
+def _clear_on_rollback(db):
+    db.info.pop("dash_dirty", None)
+
+
+class LRUCache:
+    """Thread-safe LRU with a size cap and per-entry TTL."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl         = ttl
+        self._data       = OrderedDict()
+        self._lock       = Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None or hit[0] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return hit[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_dash_cache = None
+
+def dashboard_cache():
+    global _dash_cache
+    if _dash_cache is None:
+        cfg = current_app.config
+        _dash_cache = LRUCache(
+            max_entries = cfg.get("DASHBOARD_CACHE_SIZE", DEFAULT_MAX_ENTRIES),
+            ttl         = cfg.get("DASHBOARD_CACHE_TTL", DEFAULT_TTL),
+        )
+    return _dash_cache
+
+
+def normalize_filter(value):
+    """Make filter values hashable and order-insensitive ('' and [] mean no filter)."""
+    if value in (None, "", [], ()):
+        return None
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(str(v) for v in value))
+    return value
+
+def brand_scope():
+    """The caller's brand restriction, as applied by models._add_brand_filter."""
+    if not has_request_context() or session.get("role") == "admin":
+        return None
+    return normalize_filter(session.get("user_brand_access"))
+
+def cached_aggregate(fn):
+    """
+    Cache a compute_* function's result. The `model` kwarg (session) is not
+    part of the key. Callers get a copy, so mutating a result is safe.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        db = kwargs.pop("model", None)
+        key = (
+            fn.__name__,
+            tuple(normalize_filter(a) for a in args),
+            tuple(sorted((k, normalize_filter(v)) for k, v in kwargs.items())),
+            brand_scope(),
+            data_version(),
+        )
+        cache = dashboard_cache()
+        hit = cache.get(key)
+        if hit is not None:
+            return copy.deepcopy(hit)
+
+        if db is not None:
+            kwargs["model"] = db
+        result = fn(*args, **kwargs)
+        cache.put(key, copy.deepcopy(result))
+        return result
+
+    wrapper.uncached = fn
+    return wrapper
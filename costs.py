@@ -0,0 +1,88 @@
+# costs.py
+"""
+Shipment cost columns and the arithmetic every cost report shares.
+
+COST_LABELS is the one list of RFT_Shipment cost columns (in declaration
+order) with their display labels; COST_COLUMNS is its keys. ValueDecByCC is
+a declared value, not a cost, and is not listed. The landed-cost ledger,
+the dashboard cost panels, the cost analysis and the PO report all read
+their columns from here.
+
+cost_breakdown() takes a shipment x cost matrix (cost_matrix()) and returns
+every derived figure in one vectorized pass: total per shipment, per
+container, per unit and, given each line's shipment and quantity, the
+per-line allocation (the same rule RFT_LandedCost applies in SQL). Divisions
+by a zero or missing count give 0.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+COST_LABELS = {
+    "FreightCost":               "Freight Cost",
+    "SaberSADDAD":               "Saber SADDAD",
+    "CustomDuties":              "Custom Duties",
+    "DemurrageCharges":          "Demurrage Charges",
+    "Penalties":                 "Penalties",
+    "OtherCharges":              "Other Charges",
+    "YardCharges":               "Yard Charges",
+    "DO_Port_Charges":           "DO Port Charges",
+    "ClearanceTransportCharges": "Clearance Transport",
+    "InspectionCharges":         "Inspection Charges",
+    "MAWANICharges":             "MAWANI Charges",
+}
+COST_COLUMNS = tuple(COST_LABELS)
+
+CostBreakdown = namedtuple("CostBreakdown", [
+    "costs",            # shipments x cost columns
+    "total",            # per shipment
+    "per_container",    # total / containers
+    "per_unit",         # total / units
+    "line_costs",       # lines x cost columns (None without lines)
+    "line_total",       # per line (None without lines)
+])
+
+
+def _ratio(num, den):
+    num = np.asarray(num, dtype=float)
+    den = np.asarray(den, dtype=float)
+    ok  = np.isfinite(den) & (den != 0)
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=ok)
+
+def cost_matrix(rows, columns=COST_COLUMNS):
+    """
+    rows -- > DataFrame, or sequence of dicts / Rows / objects carrying the cost columns
+    Returns a float array of len(rows) x len(columns), missing costs as 0.
+    """
+    if hasattr(rows, "to_numpy"):
+        return rows[list(columns)].astype(float).fillna(0).to_numpy()
+
+    def get(row, col):
+        return row.get(col) if isinstance(row, dict) else getattr(row, col, None)
+
+    flat = [get(row, col) for row in rows for col in columns]
+    return np.array([0 if v is None else v for v in flat], dtype=float).reshape(-1, len(columns))
+
+def cost_breakdown(costs, containers=None, units=None, line_shipment=None, line_qty=None):
+    """
+    costs         -- > 2-D array, shipments x cost columns (see cost_matrix)
+    containers    -- > containers per shipment (per_container is 0s without it)
+    units         -- > units shipped per shipment (per_unit / line allocation use it)
+    line_shipment -- > for each line, the row of its shipment in `costs`
+    line_qty      -- > for each line, its units; the line gets line_qty / units of each cost
+    """
+    costs = np.asarray(costs, dtype=float)
+    total = costs.sum(axis=1)
+    n     = len(total)
+
+    per_container = _ratio(total, containers) if containers is not None else np.zeros(n)
+    per_unit      = _ratio(total, units)      if units      is not None else np.zeros(n)
+
+    line_costs = line_total = None
+    if line_shipment is not None:
+        idx        = np.asarray(line_shipment, dtype=int)
+        share      = _ratio(line_qty, np.asarray(units, dtype=float)[idx])
+        line_costs = costs[idx] * share[:, None]
+        line_total = line_costs.sum(axis=1)
+
+    return CostBreakdown(costs, total, per_container, per_unit, line_costs, line_total)
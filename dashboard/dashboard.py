@@ -1,16 +1,21 @@
-from flask import request, render_template, redirect, url_for, jsonify
+from flask import request, render_template, redirect, url_for, jsonify, make_response
 from sqlalchemy import func, literal_column, cast, Numeric
+import logging
 from . import bp
+from .panels import panel, run_panels, server_timing_header
+from filter_options import filter_options
 from models import *
 from utils import (
     get_distinct, get_distinct_format,
     compute_leadtime_by_brand, compute_cost_by_brand,
     compute_fulfillment_by_brand,
-    compute_container_plan_stage_counts_grouped, compute_shipment_status_counts,
-    compute_upcoming_eta, pivot_matrix_to_rows, compute_plan_status_by_brand,
+    compute_container_plan_stage_counts_by_mot, compute_shipment_status_counts_by_mot,
+    compute_upcoming_eta_by_mot, pivot_matrix_to_rows, compute_plan_status_by_brand,
     compute_pod_by_brand_only_delivered, compute_monthly_dtc_vs_total, CONTAINER_STAGES
 )
 All_HAP = ['ADMIRAL','BISSELL','GIBSON','HITACHI','PANASONIC', 'RUUD', 'UFESA']
+MOTS    = ["Sea", "Land", "Air"]
+log = logging.getLogger(__name__)
 
 
 @bp.route("/", methods=["GET", "POST"])
@@ -18,11 +23,12 @@ def dashboard():
     model = None
     model = Session()
     
-    # 1) Get the universe of options
-    all_brands  = get_distinct("Brand")
-    all_months  = get_distinct_format(RFT_PurchaseOrder ,"PODate","yyyy-MM")
-    all_shp_months = get_distinct_format(RFT_Shipment, "CreatedDate","yyyy-MM")
-    all_cats    = get_distinct("CatName")
+    # 1) Get the universe of options (cached, see filter_options.py)
+    opts        = filter_options()
+    all_brands  = opts["brands"]
+    all_months  = opts["po_months"]
+    all_shp_months = opts["shp_months"]
+    all_cats    = opts["categories"]
     
     
     # 2) Read exactly what the user picked (could be an empty list)
@@ -62,19 +68,21 @@ def dashboard():
     else:
         sel_cats_query = all_cats
     
+    # Months: "All" / nothing picked -> None, i.e. no date filter at all
+    # (the compute_* functions turn picked months into date ranges, see utils.month_filter)
     if 'All' in raw_months and len(raw_months)==1 :
-        sel_months_query = all_months
+        sel_months_query = None
     elif len(raw_months)>=1:
         sel_months_query = raw_months
     else:
-        sel_months_query = all_months
+        sel_months_query = None
         
     if 'All' in raw_shp_months and len(raw_shp_months)==1 :
-        sel_shp_months_query = all_shp_months
+        sel_shp_months_query = None
     elif len(raw_shp_months)>=1:
         sel_shp_months_query = raw_shp_months
     else:
-        sel_shp_months_query = all_shp_months
+        sel_shp_months_query = None
     
 
     sel_po_query    = raw_pos  
@@ -83,15 +91,9 @@ def dashboard():
     # — 2) lead‐time (uses only brands+months)
     intervals     = model.query(RFT_IntervalConfig).order_by(RFT_IntervalConfig.ID).all()
     iv_data       = [{"name":c.IntervalName,"start":c.StartField,"end":c.EndField} for c in intervals]
-    lt_data       = compute_leadtime_by_brand(
-        brands      =sel_brands_query,
-        months      =sel_months_query,
-        shp_months  = sel_shp_months_query # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-    )
-    ##
-    
-    # — 3) cost (brands, months, categories)
-    cost_data      = compute_cost_by_brand(
+
+    # shared dashboard filters
+    flt = dict(
         brands     = sel_brands_query,
         months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
         shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
@@ -99,6 +101,34 @@ def dashboard():
         sel_shp    = sel_shp_query, #str
         sel_po     = sel_po_query #str
     )
+
+    # Every panel below is independent -> run them side by side (see panels.py)
+    panels = [
+        panel("leadtime",    compute_leadtime_by_brand, default=[],
+              brands=sel_brands_query, months=sel_months_query, shp_months=sel_shp_months_query),
+        panel("cost",        compute_cost_by_brand, default=[], **flt),
+        panel("fulfillment", compute_fulfillment_by_brand, default=[], brands=sel_brands_query),
+        # Plan groups (Sea / Land / Air) -> one query grouped by ModeOfTransport
+        panel("plan_groups", compute_container_plan_stage_counts_by_mot, ["Planed"], MOTS,
+              default={m: ({}, []) for m in MOTS}, **flt),
+        # Warehouse x Brands / POD x Brands / ATA-WH x Months
+        panel("wh_brand",    compute_plan_status_by_brand, ["Planed"], default=([], []), **flt),
+        panel("pod_brand",   compute_pod_by_brand_only_delivered, default=([], []), **flt),
+        panel("ata_month",   compute_monthly_dtc_vs_total, ["Planed"], default=([], []), **flt),
+        # Shipment Level Statuses (all modes)
+        panel("shp_status",  compute_shipment_status_counts_by_mot, MOTS, default={m: [] for m in MOTS}, **flt),
+        # Upcomming ETA (all modes)
+        panel("eta",         compute_upcoming_eta_by_mot, MOTS, brands=sel_brands_query, days_ahead=7,
+              default={m: [] for m in MOTS}),
+    ]
+    res, timings = run_panels(panels)
+    log.info("dashboard panels: %s", {k: f'{v["ms"]:.0f}ms/{v["status"]}' for k, v in timings.items()})
+
+    lt_data = res["leadtime"]
+    ##
+    
+    # — 3) cost (brands, months, categories)
+    cost_data      = res["cost"]
     # derive totals/averages...
     total_expense    = sum(d["total_expense"]   for d in cost_data)
     total_shipments  = sum(d["num_shipments"]   for d in cost_data) or 1
@@ -109,19 +139,10 @@ def dashboard():
     avg_per_article   = round(total_expense/total_articles,2)
 
     # — 4) fulfillment % by brand & by PO
-    fulfill_brand = compute_fulfillment_by_brand(brands=sel_brands_query)
+    fulfill_brand = res["fulfillment"]
  
     ############################################# ─── SEA SHIP ─────────────────────────────────────────────────────────
-    sea_matrix, sea_plan_groups = compute_container_plan_stage_counts_grouped(
-        ["Planed"],
-        mot="Sea",
-        brands     = sel_brands_query,
-        months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-        shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-        categories = sel_cats_query, #list
-        sel_shp    = sel_shp_query, #str
-        sel_po     = sel_po_query #str
-    )
+    sea_matrix, sea_plan_groups = res["plan_groups"]["Sea"]
 
     wh_rows_sea  = pivot_matrix_to_rows(
         sea_matrix,
@@ -135,16 +156,7 @@ def dashboard():
     ]
     
     ######################################### ─── LAND SHIP ────────────────────────────────────────────────────────────
-    land_matrix, land_plan_groups = compute_container_plan_stage_counts_grouped(
-        ["Planed"],
-        mot="Land",
-        brands     = sel_brands_query,
-        months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-        shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-        categories = sel_cats_query, #list
-        sel_shp    = sel_shp_query, #str
-        sel_po     = sel_po_query #str
-    )
+    land_matrix, land_plan_groups = res["plan_groups"]["Land"]
 
     # 4) Build the WH rows 
     wh_rows_land = pivot_matrix_to_rows(
@@ -158,16 +170,7 @@ def dashboard():
         for grp in land_plan_groups
     ]
     ########################################## ─── AIR SHIP ─────────────────────────────────────────────────────────────
-    air_matrix, air_plan_groups = compute_container_plan_stage_counts_grouped(
-        ["Planed"],
-        mot="Air",
-        brands     = sel_brands_query,
-        months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-        shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-        categories = sel_cats_query, #list
-        sel_shp    = sel_shp_query, #str
-        sel_po     = sel_po_query #str
-    )
+    air_matrix, air_plan_groups = res["plan_groups"]["Air"]
 
     # 4) Build the WH rows 
     wh_rows_air = pivot_matrix_to_rows(
@@ -186,16 +189,7 @@ def dashboard():
     ################################                          ################################ 
     ################################ Warehouse x Brands table ################################ 
     ################################                          ################################ 
-    table_data, brand_cols = compute_plan_status_by_brand(
-                    ["Planed"],
-                    # mot="Land",
-                    brands     = sel_brands_query,
-                    months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-                    shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-                    categories = sel_cats_query, #list
-                    sel_shp    = sel_shp_query, #str
-                    sel_po     = sel_po_query #str
-                )
+    table_data, brand_cols = res["wh_brand"]
     
     # Warehouse x Brands cheart
     pie_labels = [row[0] for row in table_data]      # Warehouse names
@@ -204,14 +198,7 @@ def dashboard():
     ##################################              ################################ 
     ################################## POD x Brands ################################ 
     ##################################              ################################ 
-    table_data2, brand_cols2 = compute_pod_by_brand_only_delivered(
-                    brands     = sel_brands_query,
-                    months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-                    shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-                    categories = sel_cats_query, #list
-                    sel_shp    = sel_shp_query, #str
-                    sel_po     = sel_po_query #str
-                )
+    table_data2, brand_cols2 = res["pod_brand"]
     
     # Warehouse x Brands cheart
     pie_labels2 = [row[0] for row in table_data2]      # Warehouse names
@@ -220,55 +207,23 @@ def dashboard():
     ##################################              ################################ 
     ################################## ATA-WH x Months ################################ 
     ##################################              ################################ 
-    table_data3, brand_cols3 = compute_monthly_dtc_vs_total(
-                    ["Planed"],
-                    brands     = sel_brands_query,
-                    months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-                    shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-                    categories = sel_cats_query, #list
-                    sel_shp    = sel_shp_query, #str
-                    sel_po     = sel_po_query #str
-                )
+    table_data3, brand_cols3 = res["ata_month"]
     
     # Warehouse x Brands cheart
     pie_labels3 = [row[0] for row in table_data3]      # Warehouse names
     pie_values3 = [row[-1] for row in table_data3]
     
     # For shipment statuses 
-    shipment_status_sea      = compute_shipment_status_counts(
-        "Sea", 
-        brands     = sel_brands_query,
-        months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-        shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-        categories = sel_cats_query, #list
-        sel_shp    = sel_shp_query, #str
-        sel_po     = sel_po_query #str
-    )
-    shipment_status_land     = compute_shipment_status_counts(
-        "Land",
-        brands     = sel_brands_query,
-        months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-        shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-        categories = sel_cats_query, #list
-        sel_shp    = sel_shp_query, #str
-        sel_po     = sel_po_query #str
-    )
-    shipment_status_air      = compute_shipment_status_counts(
-        "Air",
-        brands     = sel_brands_query,
-        months     = sel_months_query, # RFT_PurchaseOrder.PODate  --> (yyyy-MM) formated list
-        shp_months = sel_shp_months_query, # RFT_Shipment.CreatedDate --> (yyyy-MM) formated list
-        categories = sel_cats_query, #list
-        sel_shp    = sel_shp_query, #str
-        sel_po     = sel_po_query #str
-    )
+    shipment_status_sea      = res["shp_status"]["Sea"]
+    shipment_status_land     = res["shp_status"]["Land"]
+    shipment_status_air      = res["shp_status"]["Air"]
 
     # For Upcomming ETA
-    upcoming_eta_sea         = compute_upcoming_eta("Sea",   brands     = sel_brands_query, days_ahead  = 7)
-    upcoming_eta_land        = compute_upcoming_eta("Land",  brands     = sel_brands_query, days_ahead  = 7)
-    upcoming_eta_air         = compute_upcoming_eta("Air",   brands     = sel_brands_query, days_ahead  = 7)
+    upcoming_eta_sea         = res["eta"]["Sea"]
+    upcoming_eta_land        = res["eta"]["Land"]
+    upcoming_eta_air         = res["eta"]["Air"]
 
-    return render_template("dashboard/A-new_DASH.html",
+    html = render_template("dashboard/A-new_DASH.html",
         # lead‐time
         lt_intervals     = intervals,
         lt_intervals_data= iv_data,
@@ -348,3 +303,6 @@ def dashboard():
         avg_per_container = avg_per_container,
         avg_per_article   = avg_per_article,
     )
+    resp = make_response(html)
+    resp.headers["Server-Timing"] = server_timing_header(timings)
+    return resp
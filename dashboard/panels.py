@@ -0,0 +1,114 @@
+"""
+Runs the independent dashboard computations side by side.
+
+Each panel gets its own brand-scoped Session (a Session is not thread-safe)
+and runs with a copy of the request context so the Brand filter still sees
+session["user_brand_access"]. A panel that errors or overruns its timeout
+falls back to its default so the rest of the page still renders.
+"""
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+
+from flask import current_app, copy_current_request_context
+
+from models import brand_scoped_session
+
+log = logging.getLogger(__name__)
+
+# name     -> key in the results dict
+# fn       -> compute_* function; must accept model=<Session>
+# args     -> positional args, kwargs -> keyword args
+# default  -> value used when the panel fails or times out
+Panel = namedtuple("Panel", ["name", "fn", "args", "kwargs", "default"])
+
+def panel(name, fn, *args, default=None, **kwargs):
+    return Panel(name, fn, args, kwargs, default)
+
+_pool      = None
+_pool_lock = Lock()
+
+def _get_pool():
+    """One bounded pool per process, shared by all requests, so concurrent
+    dashboard loads can't open more than DASHBOARD_PANEL_WORKERS sessions."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = current_app.config.get("DASHBOARD_PANEL_WORKERS", 6)
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dash-panel")
+    return _pool
+
+
+def run_panels(panels, timeout=None):
+    """
+    Run `panels` concurrently and return (results, timings).
+
+    results -> { panel.name: value or panel.default }
+    timings -> { panel.name: {"ms": float, "status": "ok" | "error" | "timeout"} }
+
+    `timeout` (seconds, default DASHBOARD_PANEL_TIMEOUT or 30) is counted from
+    when a panel actually starts, so time spent queued behind other panels
+    doesn't count against it. A panel still queued `timeout` seconds after
+    submission is cancelled.
+    """
+    if timeout is None:
+        timeout = current_app.config.get("DASHBOARD_PANEL_TIMEOUT", 30)
+
+    started = {}
+
+    def _make_task(p):
+        @copy_current_request_context
+        def _task():
+            started[p.name] = time.perf_counter()
+            db = brand_scoped_session()
+            try:
+                return p.fn(*p.args, model=db, **p.kwargs)
+            finally:
+                db.close()
+        return _task
+
+    pool    = _get_pool()
+    queued  = time.perf_counter()
+    futures = {pool.submit(_make_task(p)): p for p in panels}
+
+    results = {}
+    timings = {}
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+        now = time.perf_counter()
+
+        for fut in done:
+            p  = futures[fut]
+            ms = (now - started.get(p.name, now)) * 1000
+            try:
+                results[p.name] = fut.result()
+                timings[p.name] = {"ms": ms, "status": "ok"}
+            except Exception:
+                log.exception("dashboard panel %s failed", p.name)
+                results[p.name] = p.default
+                timings[p.name] = {"ms": ms, "status": "error"}
+
+        for fut in list(pending):
+            p     = futures[fut]
+            begun = started.get(p.name)
+            # never started: give it the same budget measured from submission
+            if now - (begun if begun is not None else queued) <= timeout:
+                continue
+            fut.cancel()   # no-op once running; the thread finishes and closes its session
+            pending.discard(fut)
+            log.warning("dashboard panel %s timed out after %ss", p.name, timeout)
+            results[p.name] = p.default
+            timings[p.name] = {"ms": timeout * 1000, "status": "timeout"}
+
+    return results, timings
+
+
+def server_timing_header(timings):
+    """Format timings for the Server-Timing response header (shown in browser devtools)."""
+    return ", ".join(
+        f'{name};dur={t["ms"]:.1f};desc="{t["status"]}"'
+        for name, t in timings.items()
+    )
@@ -12,6 +12,7 @@ from models import ( model, FreightTrackingView, inspect,
     or_
   )
 from itertools import cycle
+from costs import COST_COLUMNS
 from utils import (
   get_distinct, get_distinct_format,
  compute_cost_by_shipment
@@ -27,44 +28,20 @@ def cost_drilldown():
   categories = request.args.getlist("cost_categories[]") 
   # or get_distinct("CatName")
   
-  filters = []
+  # paging, only when asked for: every shipment by number (default), or
+  # ?limit=N&order=total for the top-N by total expense
+  limit  = request.args.get("limit", 0, type=int)   # 0 -> no limit
+  offset = request.args.get("offset", 0, type=int)
+  order  = request.args.get("order", "shipment")
   
-  if brand:
-      filters.append(PO.Brand == brand)
-  
-  if months:
-      filters.append(func.format(PO.PODate, 'yyyy-MM').in_(months))
-  
-  if categories:
-    filters.append(
-        or_(
-            CM.CatName.in_(categories),
-            CM.CatName.is_(None)
-        )
-    )
-  
-  # --- 1) find all shipments matching brand/month/category ---
-  shipments = [
-    s for (s,) in model.query(S.ShipmentNumber)
-      .join(SP, SP.ShipmentID   == S.ShipmentID)
-      .join(POL, POL.POLineID   == SP.POLineID)
-      .join(PO,  PO.POID        == POL.POID)
-      .outerjoin(CM, CM.ID      == POL.CategoryMappingID)
-      .filter(*filters)
-      .distinct()
-      .order_by(S.ShipmentNumber)
-      .all()
-  ]
-  
-  # shipments.remove("RFT517284019")
-  # shipments.remove("RFT204314178")
-  # shipments.remove("RFT125014076")
-  # shipments.remove("RFT441069197")
-
-  # print(f"🟡 Found {len(shipments)} shipments: {shipments}")
-  
-  # --- 2) get per-shipment costs ---
-  drill = compute_cost_by_shipment(shipments)
+  # --- 1+2) shipments matching brand/month/category with their costs (one query) ---
+  # fetch one extra row to know whether there is a next page
+  drill = compute_cost_by_shipment(
+    brand=brand, months=months, categories=categories,
+    limit=(limit + 1) if limit else None, offset=offset, order=order,
+  )
+  has_more = bool(limit) and len(drill) > limit
+  drill    = drill[:limit] if limit else drill
 
   # print(f"🟢 Cost breakdown for each shipment:")
   # for row in drill:
@@ -76,7 +53,7 @@ def cost_drilldown():
   
   
   
-  # --- 3) palette & discover cost columns ---
+  # --- 3) palette & cost columns ---
   base_palette = [
     '#4e79a7','#f28e2b','#e15759','#76b7b2',
     '#59a14f','#edc949','#af7aa1','#ff9da7',
@@ -84,12 +61,7 @@ def cost_drilldown():
   ]
   pal = cycle(base_palette)
 
-  cost_cols = [
-      col.name
-      for col in inspect(S).c
-      if isinstance(col.type, Numeric)
-          and (col.name.endswith("Cost") or col.name.endswith("Charges") or col.name in ("CustomDuties", "Penalties", "SaberSADDAD"))
-  ]
+  cost_cols = COST_COLUMNS
 
   # --- 4) build datasets for Chart.js ---
   datasets = []
@@ -107,7 +79,8 @@ def cost_drilldown():
     "datasets": datasets,
     "meta": {
       "num_containers":   [r.get("num_containers", 0) for r in drill],
-      "cost_per_ctn":     [round(r["total_expense"] / r["num_containers"], 1) if r["num_containers"] else 0 for r in drill],
+      "cost_per_ctn":     [round(r["cost_per_container"], 1) for r in drill],
       "bl_list": [r.get("bl", "") for r in drill]
-    }
+    },
+    "page": {"limit": limit, "offset": offset, "order": order, "has_more": has_more}
   })
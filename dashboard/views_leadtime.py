@@ -1,50 +1,63 @@
 from flask import request, jsonify, render_template
-from sqlalchemy import func, literal_column
+from sqlalchemy import func, literal_column, select
 from . import bp
-from models import model, FreightTrackingView, RFT_IntervalConfig, RFT_PurchaseOrder
-from utils import get_distinct, get_distinct_format
+from models import model, FreightTrackingData, RFT_IntervalConfig, RFT_PurchaseOrder
+from utils import get_distinct, get_distinct_format, month_filter
 
 
 @bp.route("/leadtime/drilldown", methods=["GET"])
 def leadtime_drilldown():
     brand = request.args["brand"]
-    months = request.args.getlist("lt_months") or get_distinct_format(RFT_PurchaseOrder, "PODate","yyyy-MM")
+    months = request.args.getlist("lt_months")   # empty -> all months
     limit  = request.args.get("lt_limit", 10, type=int)
 
     intervals = model.query(RFT_IntervalConfig).order_by(RFT_IntervalConfig.ID).all()
 
     # shipments for that brand/month
+    ship_sq = (
+      model.query(FreightTrackingData.ShipmentNumber,
+                  FreightTrackingData.BLNumber
+            )
+           .filter(FreightTrackingData.Brand==brand,
+                   *month_filter(FreightTrackingData.POCreatedDate, months))
+           .filter(FreightTrackingData.ShipmentNumber.is_not(None))
+           .distinct()
+           .order_by(FreightTrackingData.ShipmentNumber)
+           .limit(limit)
+           .subquery()
+    )
     shipments = [{
         "ShipmentNumber": s,
         "BLNumber": bl
     } for (s, bl) in 
-      model.query(FreightTrackingView.ShipmentNumber,
-                  FreightTrackingView.BLNumber
-            )
-           .filter(FreightTrackingView.Brand==brand,
-                   func.format(FreightTrackingView.POCreatedDate,'yyyy-MM').in_(months))
-           .filter(FreightTrackingView.ShipmentNumber.is_not(None))
-           .distinct()
-           .order_by(FreightTrackingView.ShipmentNumber)
-           .limit(limit)
+      model.query(ship_sq.c.ShipmentNumber, ship_sq.c.BLNumber)
+           .order_by(ship_sq.c.ShipmentNumber)
            .all()
     ]
 
-    # compute per-shipment lead times
+    # per-shipment lead times: one grouped query, one AVG column per interval
+    # (DATEDIFF is NULL when either date is missing, and AVG skips NULLs)
+    cols = [
+      func.avg(func.datediff(literal_column("day"),
+                             getattr(FreightTrackingData, cfg.StartField),
+                             getattr(FreightTrackingData, cfg.EndField))).label(f"i{i}")
+      for i, cfg in enumerate(intervals)
+    ]
+    avgs = {}
+    if cols:
+      avgs = {
+        r[0]: r[1:] for r in
+          model.query(FreightTrackingData.ShipmentNumber, *cols)
+               .filter(FreightTrackingData.ShipmentNumber.in_(
+                   select(ship_sq.c.ShipmentNumber)))
+               .group_by(FreightTrackingData.ShipmentNumber)
+               .all()
+      }
+
     drill = []
     for ship in shipments:
-      ship_no = ship["ShipmentNumber"]
-      bl_no   = ship["BLNumber"]
-      
-      rec = {}
-      for cfg in intervals:
-          sf, ef = getattr(FreightTrackingView, cfg.StartField), getattr(FreightTrackingView, cfg.EndField)
-          avgd = (model.query(func.avg(func.datediff(literal_column("day"), sf, ef)))
-                        .filter(FreightTrackingView.ShipmentNumber==ship_no,
-                                sf.isnot(None), ef.isnot(None))
-                        .scalar() or 0)
-          rec[cfg.IntervalName] = round(avgd,1)
-      drill.append(rec)
+      vals = avgs.get(ship["ShipmentNumber"]) or [None] * len(intervals)
+      drill.append({cfg.IntervalName: round(v or 0, 1) for cfg, v in zip(intervals, vals)})
 
     # build Chart.js JSON
     palette = ['#ed7d31','#5b9bd5','#70ad00','#ffc000']
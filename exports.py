@@ -0,0 +1,443 @@
+# exports.py
+"""
+Streaming exports: Excel, gzip-compressed CSV and Parquet.
+
+write_xlsx() is the one Excel writer: it writes rows one at a time into an
+xlsxwriter workbook in constant_memory mode (each row is flushed to a temp
+file once written), and xlsx_response() builds that workbook in a
+SpooledTemporaryFile and streams it back in chunks. Memory stays flat however
+many rows are exported, as long as `rows` is itself an iterator (e.g. a query
+with yield_per), not a list. Every sheet gets the same header style,
+autofilter and frozen header; column widths are estimated from the first
+WIDTH_SAMPLE_ROWS rows. Reports add date / money / percent columns, rows
+above the header, per-row fills and conditional formats through the layout
+arguments of write_xlsx().
+
+csv_gz_response() skips the temp file altogether: each row is encoded and
+gzip-compressed as the response is sent. parquet_response() writes row groups
+of PARQUET_BATCH_ROWS with pyarrow, Brand and status columns dictionary
+encoded. The Parquet schema comes from the columns' declared types (`types`,
+e.g. column_types() of the query's selected columns); undeclared columns are
+typed from the first batch. A value that doesn't fit its column's type raises
+instead of being truncated or turned into text. export_response() picks one of
+the three from the form's `format`.
+"""
+import csv
+import gzip
+import io
+import itertools
+import math
+import tempfile
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+from flask import Response, stream_with_context
+from sqlalchemy import types as sqltypes
+
+XLSX_MIMETYPE    = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_GZ_MIMETYPE  = "application/gzip"
+PARQUET_MIMETYPE = "application/vnd.apache.parquet"
+SPOOL_MAX_BYTES  = 8 * 1024 * 1024    # finished workbooks above this go to disk
+CHUNK_SIZE       = 64 * 1024
+DATETIME_FORMAT  = "yyyy-mm-dd hh:mm:ss"   # what pandas' to_excel used for datetime columns
+DATE_FORMAT      = "d-mmmm-yyyy"           # the reports' dates, e.g. 6-June-2025
+MONEY_FORMAT     = "#,##0.00"
+PERCENT_FORMAT   = "0.00%"
+HEADER_STYLE     = {"bold": True, "border": 1, "bg_color": "#D9E1F2",
+                    "text_wrap": True, "align": "center", "valign": "top"}
+
+WIDTH_SAMPLE_ROWS = 200     # rows looked at to size the columns
+MAX_COL_WIDTH     = 60
+
+EXPORT_FORMATS     = ("xlsx", "csv", "parquet")
+PARQUET_BATCH_ROWS = 10000
+
+# format -> (file extension, mimetype)
+EXPORT_FILES = {
+    "xlsx":    (".xlsx",    XLSX_MIMETYPE),
+    "csv":     (".csv.gz",  CSV_GZ_MIMETYPE),
+    "parquet": (".parquet", PARQUET_MIMETYPE),
+}
+
+
+def _as_datetime(value):
+    """Like pd.to_datetime(errors='coerce') for one value: None when it isn't a date."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.strip())
+        except ValueError:
+            return None
+    return None
+
+def _is_blank(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+def frame_rows(df):
+    """A DataFrame's rows as dicts for the writers below, NaN / NaT / <NA> as None."""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+def _cell_width(value, kind):
+    """Rough rendered width of one cell, for column sizing."""
+    if _is_blank(value):
+        return 0
+    if kind == "date":
+        return 19
+    try:
+        if kind == "money":
+            return len(f"{float(value):,.2f}")
+        if kind == "percent":
+            return len(f"{float(value):.2%}")
+    except (TypeError, ValueError):
+        pass
+    return len(str(value))
+
+def _write_cell(ws, r, c, value, kind, fmt):
+    if _is_blank(value):
+        ws.write_blank(r, c, None, fmt)
+    elif kind == "date":
+        value = _as_datetime(value)
+        if value is None:
+            ws.write_blank(r, c, None, fmt)
+        else:
+            ws.write_datetime(r, c, value, fmt)
+    elif isinstance(value, Decimal):
+        ws.write_number(r, c, float(value), fmt)
+    else:
+        ws.write(r, c, value, fmt)
+
+def write_xlsx(fh, rows, columns, sheet_name="Sheet1", date_cols=(), headers=None,
+               money_cols=(), percent_cols=(), date_format=DATETIME_FORMAT, bordered=False,
+               preamble=(), styles=None, row_style=None, styled_cols=None, conditional=None):
+    """
+    fh           -- > path or seekable binary file to write the workbook to
+    rows         -- > iterable of dicts keyed by column name (missing keys -> blank cell)
+    columns      -- > column names, in order
+    headers      -- > header row to write instead of `columns`
+    date_cols    -- > columns written as Excel datetimes, in `date_format`
+    money_cols   -- > columns written with MONEY_FORMAT
+    percent_cols -- > columns written with PERCENT_FORMAT (values are fractions)
+    bordered     -- > thin border around every data cell
+    preamble     -- > rows written above the header (totals, a legend); a cell is a
+                     value or a (value, style) pair, style being "header" or a key of `styles`
+    styles       -- > style name -> xlsxwriter format properties (e.g. a bg_color)
+    row_style    -- > fn(row) -> style name or None, applied to `styled_cols` (default: all)
+    conditional  -- > column -> list of worksheet.conditional_format() options over its
+                     data cells; each option's "format" is a dict of format properties
+
+    Returns the number of data rows written.
+    """
+    wb = xlsxwriter.Workbook(fh, {"constant_memory": True, "default_date_format": date_format})
+    ws = wb.add_worksheet(sheet_name)
+    styles = styles or {}
+
+    kinds = {}
+    for c in columns:
+        kinds[c] = ("date"    if c in date_cols    else
+                    "money"   if c in money_cols   else
+                    "percent" if c in percent_cols else None)
+    num_formats = {"date": date_format, "money": MONEY_FORMAT, "percent": PERCENT_FORMAT}
+    styled_cols = set(columns if styled_cols is None else styled_cols)
+
+    formats = {}
+    def fmt(kind, style=None):
+        # one Format per (column kind, style), created on first use
+        if (kind, style) not in formats:
+            props = {"border": 1} if bordered else {}
+            if style == "header":
+                props = dict(HEADER_STYLE)
+            elif style is not None:
+                props.update(styles[style])
+            if kind is not None:
+                props["num_format"] = num_formats[kind]
+            formats[(kind, style)] = wb.add_format(props) if props else None
+        return formats[(kind, style)]
+
+    # rows above the header
+    for r, cells in enumerate(preamble):
+        for c, cell in enumerate(cells):
+            value, style = cell if isinstance(cell, tuple) else (cell, None)
+            if not _is_blank(value):
+                ws.write(r, c, value, fmt(None, style))
+    header_row = len(preamble)
+    ws.write_row(header_row, 0, list(headers or columns), fmt(None, "header"))
+
+    # size columns from a sample, then write the sample and the rest
+    rows   = iter(rows)
+    sample = list(itertools.islice(rows, WIDTH_SAMPLE_ROWS))
+    for c, (name, label) in enumerate(zip(columns, headers or columns)):
+        width = max([len(str(label))] + [_cell_width(row.get(name), kinds[name]) for row in sample])
+        ws.set_column(c, c, min(width + 2, MAX_COL_WIDTH))
+
+    n = 0
+    for n, row in enumerate(itertools.chain(sample, rows), start=1):
+        style = row_style(row) if row_style else None
+        if style not in styles:
+            style = None
+        for c, name in enumerate(columns):
+            _write_cell(ws, header_row + n, c, row.get(name), kinds[name],
+                        fmt(kinds[name], style if name in styled_cols else None))
+
+    last_row = header_row + max(n, 1)
+    ws.autofilter(header_row, 0, last_row, max(len(columns) - 1, 0))
+    ws.freeze_panes(header_row + 1, 0)
+    for name, options in (conditional or {}).items():
+        c = list(columns).index(name)
+        for opt in options:
+            ws.conditional_format(header_row + 1, c, last_row, c, dict(opt, format=wb.add_format(opt["format"])))
+
+    wb.close()
+    return n
+
+def _attachment(resp, filename):
+    resp.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return resp
+
+def _spooled_response(write, mimetype, filename):
+    """Run write(fh) against a spooled temp file, then stream the file back in chunks."""
+    fh = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    try:
+        write(fh)
+        size = fh.seek(0, 2)
+        fh.seek(0)
+    except Exception:
+        fh.close()
+        raise
+
+    def generate():
+        try:
+            while True:
+                chunk = fh.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            fh.close()
+
+    resp = Response(generate(), mimetype=mimetype, direct_passthrough=True)
+    resp.headers["Content-Length"] = str(size)
+    return _attachment(resp, filename)
+
+def xlsx_response(rows, columns, filename, **layout):
+    """Write `rows` (see write_xlsx, which takes `layout`) to a spooled temp file and stream it as a download."""
+    def write(fh):
+        write_xlsx(fh, rows, columns, **layout)
+    return _spooled_response(write, XLSX_MIMETYPE, filename)
+
+
+def _csv_cells(row, columns):
+    return ["" if row.get(c) is None else row.get(c) for c in columns]
+
+def write_csv_gz(fh, rows, columns, headers=None):
+    """
+    Write `rows` (dicts, see write_xlsx) to `fh` as gzip-compressed UTF-8 CSV.
+    Returns the number of data rows written.
+    """
+    n = 0
+    with gzip.GzipFile(fileobj=fh, mode="wb") as gz, \
+         io.TextIOWrapper(gz, encoding="utf-8-sig", newline="") as text:
+        out = csv.writer(text)
+        out.writerow(headers or columns)
+        for n, row in enumerate(rows, start=1):
+            out.writerow(_csv_cells(row, columns))
+    return n
+
+def csv_gz_response(rows, columns, filename, headers=None):
+    """
+    Stream `rows` (dicts, see write_xlsx) as gzip-compressed CSV, one row at a
+    time. Nothing is buffered beyond the compressor's window, so there is no
+    Content-Length; the query behind `rows` runs while the response is sent.
+    headers -- > header row to write instead of `columns`
+    """
+    def generate():
+        buf     = io.StringIO()
+        out     = csv.writer(buf)
+        deflate = zlib.compressobj(6, zlib.DEFLATED, 31)    # wbits 31 -> gzip container
+
+        def drain():
+            data = buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+            return deflate.compress(data)
+
+        pending = bytearray()
+        buf.write("\ufeff")    # BOM, so Excel opens the CSV as UTF-8
+        out.writerow(headers or columns)
+        for row in rows:
+            out.writerow(_csv_cells(row, columns))
+            pending += drain()
+            if len(pending) >= CHUNK_SIZE:
+                yield bytes(pending)
+                pending.clear()
+        pending += drain() + deflate.flush()
+        yield bytes(pending)
+
+    resp = Response(stream_with_context(generate()), mimetype=CSV_GZ_MIMETYPE)
+    return _attachment(resp, filename)
+
+
+def _is_dictionary_col(name):
+    """Low-cardinality text columns stored dictionary encoded: Brand and the statuses."""
+    return name.lower() in ("brand", "brands") or "status" in name.lower()
+
+def arrow_type(sqltype):
+    """pyarrow type for a SQLAlchemy column type (Numeric as float64, dates as timestamp[ms]); pyarrow types pass through."""
+    if isinstance(sqltype, pa.DataType):
+        return sqltype
+    if isinstance(sqltype, sqltypes.Boolean):
+        return pa.bool_()
+    if isinstance(sqltype, sqltypes.Integer):
+        return pa.int64()
+    if isinstance(sqltype, (sqltypes.Numeric, sqltypes.Float)):
+        return pa.float64()
+    if isinstance(sqltype, (sqltypes.Date, sqltypes.DateTime)):
+        return pa.timestamp("ms")
+    return pa.string()
+
+def column_types(selected, keys=None):
+    """
+    Column name -> pyarrow type for a select's `selected_columns`, for
+    write_parquet(types=...). keys -- > names to use instead of the column
+    labels, position by position (extra columns are ignored).
+    """
+    selected = list(selected)
+    keys     = keys or [c.key for c in selected]
+    return {k: arrow_type(c.type) for k, c in zip(keys, selected)}
+
+def _arrow_value(value, is_date):
+    if value is None:
+        return None
+    if is_date:
+        return _as_datetime(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def _arrow_array(values, typ, name, declared):
+    """
+    Arrow array of `values` as `typ`. Numbers are cast safely, so 2.5 in an
+    int64 column raises rather than becoming 2; text columns only take strings
+    unless their type was declared (then values are str()-ed). Timestamps are
+    kept to the millisecond.
+    """
+    try:
+        if pa.types.is_dictionary(typ) or pa.types.is_string(typ):
+            if declared:
+                values = [None if v is None else str(v) for v in values]
+            return pa.array(values, type=typ)
+        if pa.types.is_timestamp(typ):
+            return pa.array(values, type=typ)
+        arr = pa.array(values)
+        return arr if arr.type == typ else arr.cast(typ)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise ValueError(f"Parquet column {name!r} does not fit type {typ}: {e}") from e
+
+def _arrow_schema(batch, columns, names, date_cols, types):
+    """Schema for the file: declared types first, then what the first batch holds."""
+    fields = []
+    for c, name in zip(columns, names):
+        if c in date_cols:
+            typ = pa.timestamp("ms")
+        elif c in types:
+            typ = types[c]
+        else:
+            typ = pa.array([_arrow_value(row.get(c), False) for row in batch]).type
+            if pa.types.is_null(typ):
+                # nothing to go on: text, and a later non-text value raises (declare it in `types`)
+                typ = pa.string()
+        if _is_dictionary_col(name) and pa.types.is_string(typ):
+            typ = pa.dictionary(pa.int32(), pa.string())
+        fields.append(pa.field(name, typ))
+    return pa.schema(fields)
+
+def _arrow_batch(batch, columns, date_cols, types, schema):
+    """RecordBatch of `schema` for a list of row dicts."""
+    arrays = []
+    for c, field in zip(columns, schema):
+        values = [_arrow_value(row.get(c), c in date_cols) for row in batch]
+        arrays.append(_arrow_array(values, field.type, field.name, c in date_cols or c in types))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def write_parquet(fh, rows, columns, date_cols=(), headers=None, types=None):
+    """
+    Write `rows` (dicts, see write_xlsx) as Parquet, PARQUET_BATCH_ROWS per row group.
+    types -- > column -> pyarrow or SQLAlchemy type (see column_types); columns
+    missing from it are typed from the first batch. Timestamp columns are read like `date_cols`.
+    Returns the number of rows written.
+    """
+    names     = list(headers or columns)
+    types     = {c: arrow_type(t) for c, t in (types or {}).items()}
+    date_cols = set(date_cols) | {c for c, t in types.items() if pa.types.is_timestamp(t)}
+    writer    = None
+    n         = 0
+
+    def flush(batch):
+        nonlocal writer
+        if writer is None:
+            schema = _arrow_schema(batch, columns, names, date_cols, types)
+            writer = pq.ParquetWriter(
+                fh, schema, compression="snappy",
+                use_dictionary=[f.name for f in schema if pa.types.is_dictionary(f.type)],
+            )
+        writer.write_batch(_arrow_batch(batch, columns, date_cols, types, writer.schema))
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= PARQUET_BATCH_ROWS:
+            flush(batch)
+            n += len(batch)
+            batch = []
+    if batch or writer is None:
+        flush(batch)
+        n += len(batch)
+    writer.close()
+    return n
+
+def parquet_response(rows, columns, filename, date_cols=(), headers=None, types=None):
+    """Write `rows` (see write_parquet) to a spooled temp file and stream it as a download."""
+    def write(fh):
+        write_parquet(fh, rows, columns, date_cols=date_cols, headers=headers, types=types)
+    return _spooled_response(write, PARQUET_MIMETYPE, filename)
+
+
+def export_format(form):
+    """The requested export format from a form's `format` field; xlsx when missing or unknown."""
+    fmt = (form.get("format") or "xlsx").lower()
+    return fmt if fmt in EXPORT_FORMATS else "xlsx"
+
+def write_export(fh, fmt, rows, columns, sheet_name="Sheet1", date_cols=(), headers=None, types=None, **layout):
+    """
+    write_xlsx / write_csv_gz / write_parquet by format; returns the number of rows written.
+    `types` is passed on to write_parquet, `layout` to write_xlsx; the others ignore them.
+    """
+    if fmt == "csv":
+        return write_csv_gz(fh, rows, columns, headers=headers)
+    if fmt == "parquet":
+        return write_parquet(fh, rows, columns, date_cols=date_cols, headers=headers, types=types)
+    return write_xlsx(fh, rows, columns, sheet_name=sheet_name, date_cols=date_cols, headers=headers, **layout)
+
+def export_response(fmt, rows, columns, basename, sheet_name="Sheet1", date_cols=(), headers=None,
+                    types=None, **layout):
+    """
+    One download of `rows` in `fmt` ("xlsx", "csv" or "parquet"), named
+    basename + .xlsx / .csv.gz / .parquet. `headers` replaces the column names
+    in the header row; `types` (see write_parquet) only applies to parquet and
+    `layout` (money_cols, styles, preamble, ...) only to xlsx, see write_xlsx.
+    """
+    if fmt == "csv":
+        return csv_gz_response(rows, columns, f"{basename}.csv.gz", headers=headers)
+    if fmt == "parquet":
+        return parquet_response(rows, columns, f"{basename}.parquet", date_cols=date_cols, headers=headers,
+                                types=types)
+    return xlsx_response(
+        rows, columns, f"{basename}.xlsx",
+        sheet_name=sheet_name, date_cols=date_cols, headers=headers, **layout,
+    )
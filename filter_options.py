@@ -0,0 +1,133 @@
+# filter_options.py
+"""
+Cached option lists for the filter dropdowns (brands, categories, months).
+
+One unscoped snapshot is built from a few GROUP BY queries and kept per
+process. Each caller's lists are derived from it in Python for their brand
+scope, so the per-user Brand filter still applies without a query per user.
+
+The snapshot goes stale after FILTER_OPTIONS_TTL seconds or as soon as a
+write to a watched table bumps cache.data_version(). A stale snapshot is
+still served while a background thread rebuilds it (stale-while-revalidate);
+only the very first call in a process waits for the queries.
+"""
+import logging
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from models import (
+    Session, func,
+    FreightTrackingData, RFT_PurchaseOrder, RFT_Shipment,
+)
+from cache import data_version, brand_scope
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TTL = 600   # seconds
+
+_snapshot      = None   # {"built": monotonic, "version": int, ...}
+_refreshing    = False
+_snapshot_lock = threading.Lock()
+
+
+def _month_rows(db, date_col, brand_col=None):
+    """(brand, 'yyyy-MM') pairs, grouped on YEAR/MONTH rather than FORMAT()."""
+    keys = ([brand_col] if brand_col is not None else []) + [func.year(date_col), func.month(date_col)]
+    rows = db.query(*keys).filter(date_col.isnot(None)).group_by(*keys).all()
+    return [(r[0] if brand_col is not None else None, f"{r[-2]:04d}-{r[-1]:02d}") for r in rows]
+
+def _build():
+    """Run the option queries on an unscoped session (no request context needed)."""
+    version = data_version()
+    db = Session()
+    try:
+        view_pairs = db.query(FreightTrackingData.Brand, FreightTrackingData.CatName).distinct().all()
+        po_brands  = [b for (b,) in db.query(RFT_PurchaseOrder.Brand).distinct().all()]
+        return {
+            "built":             time.monotonic(),
+            "version":           version,
+            "view_pairs":        view_pairs,                                                     # vw_AllFreightData (Brand, CatName)
+            "po_brands":         po_brands,                                                      # RFT_PurchaseOrder.Brand
+            "po_months":         _month_rows(db, RFT_PurchaseOrder.PODate, RFT_PurchaseOrder.Brand),
+            "po_created_months": _month_rows(db, RFT_PurchaseOrder.CreatedDate, RFT_PurchaseOrder.Brand),
+            "shp_months":        _month_rows(db, RFT_Shipment.CreatedDate),
+        }
+    finally:
+        db.close()
+
+def _ttl():
+    if has_app_context():
+        return current_app.config.get("FILTER_OPTIONS_TTL", DEFAULT_TTL)
+    return DEFAULT_TTL
+
+def _is_stale(snap):
+    return snap["version"] != data_version() or time.monotonic() - snap["built"] > _ttl()
+
+def _refresh_in_background():
+    global _refreshing
+    with _snapshot_lock:
+        if _refreshing:
+            return
+        _refreshing = True
+
+    def _run():
+        global _snapshot, _refreshing
+        try:
+            snap = _build()
+            with _snapshot_lock:
+                _snapshot = snap
+        except Exception:
+            log.exception("filter options refresh failed; keeping the stale lists")
+        finally:
+            with _snapshot_lock:
+                _refreshing = False
+
+    threading.Thread(target=_run, name="filter-options", daemon=True).start()
+
+def _get_snapshot():
+    global _snapshot
+    snap = _snapshot
+    if snap is None:
+        snap = _build()
+        with _snapshot_lock:
+            _snapshot = snap
+    elif _is_stale(snap):
+        _refresh_in_background()
+    return snap
+
+def invalidate():
+    """Force the next call to rebuild synchronously (e.g. after a bulk import)."""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
+
+
+def _in_scope(brand, scope):
+    return scope is None or brand in scope
+
+def _values(pairs, scope):
+    return sorted({v for (b, v) in pairs if v not in (None, "") and _in_scope(b, scope)})
+
+def filter_options():
+    """
+    Option lists for the current user's brand scope:
+
+      brands            -- > distinct Brand in vw_AllFreightData      (was get_distinct("Brand"))
+      categories        -- > distinct CatName in vw_AllFreightData    (was get_distinct("CatName"))
+      po_brands         -- > distinct RFT_PurchaseOrder.Brand
+      po_months         -- > 'yyyy-MM' of RFT_PurchaseOrder.PODate
+      po_created_months -- > 'yyyy-MM' of RFT_PurchaseOrder.CreatedDate
+      shp_months        -- > 'yyyy-MM' of RFT_Shipment.CreatedDate (not brand scoped)
+    """
+    snap  = _get_snapshot()
+    scope = brand_scope()
+    return {
+        "brands":            _values([(b, b) for (b, _) in snap["view_pairs"]], scope),
+        "categories":        _values(snap["view_pairs"], scope),
+        "po_brands":         _values([(b, b) for b in snap["po_brands"]], scope),
+        "po_months":         _values(snap["po_months"], scope),
+        "po_created_months": _values(snap["po_created_months"], scope),
+        "shp_months":        _values(snap["shp_months"], None),
+    }
@@ -0,0 +1,152 @@
+# freight_facts.py
+"""
+One query builder for the freight tracking rows (PO -> PO line -> shipment
+PO line -> shipment -> container line -> container), shared by the freight
+tracking grid, its exports and the freight tracking report.
+
+freight_facts(names) returns a SELECT of just the named FREIGHT_FACTS, each
+labelled with its name. Statements are built once per column set and reused,
+so repeated requests skip the Python construction and their SQL comes out of
+SQLAlchemy's compiled cache; callers add their own .where() / .order_by() /
+.limit(). Filter values such as a brand list are bound parameters (IN lists
+expand at execution), so they don't defeat the cache.
+
+Only the outer joins a column set needs are emitted: every optional join is
+on a unique key (status, invoice summary, category mapping), so leaving one
+out never changes the row count.
+"""
+import functools
+
+from models import (
+    select, or_, current_status,
+    RFT_PurchaseOrder, RFT_PurchaseOrderLine, RFT_ShipmentPOLine, RFT_Shipment,
+    RFT_ContainerLine, RFT_Container, RFT_CategoriesMappingMain, RFT_InvoiceSummary,
+    RFT_StatusHistory,
+)
+
+PO   = RFT_PurchaseOrder
+POL  = RFT_PurchaseOrderLine
+SPL  = RFT_ShipmentPOLine
+SHP  = RFT_Shipment
+CL   = RFT_ContainerLine
+CTN  = RFT_Container
+CAT  = RFT_CategoriesMappingMain
+INV  = RFT_InvoiceSummary
+SH   = RFT_StatusHistory
+
+# latest statuses, one row per entity (RFT_CurrentStatus)
+PO_STATUS         = current_status("Purchase Order", "POID")
+SHP_STATUS        = current_status("Shipment", "ShipmentID")
+CTN_STATUS        = current_status("Container", "ContainerID")
+CTN_PLANED_STATUS = current_status("Planed-Container", "ContainerID")
+
+FREIGHT_FACTS = {
+    "Brand":                 PO.Brand,
+    "PODate":                PO.PODate,
+    "PONumber":              PO.PONumber,
+    "Site":                  PO.Site,
+    "LCNumber":              PO.LCNumber,
+    "LCDate":                PO.LCDate,
+    "SapItemLine":           POL.SapItemLine,
+    "Article":               POL.Article,
+    "CategoryName":          CAT.CatName,
+    "CategoryDesc":          CAT.CatDesc,
+    "ShipmentID":            SHP.ShipmentID,
+    "ShipmentNumber":        SHP.ShipmentNumber,
+    "BLNumber":              SHP.BLNumber,
+    "ModeOfTransport":       SHP.ModeOfTransport,
+    "ShipmentCreatedDate":   SHP.CreatedDate,
+    "OriginPort":            SHP.OriginPort,
+    "POD":                   SHP.POD,
+    "ContainerDeadline":     SHP.ContainerDeadline,
+    "ECCDate":               SHP.ECCDate,
+    "ETAOrigin":             SHP.ETAOrigin,
+    "ETDOrigin":             SHP.ETDOrigin,
+    "ETADestination":        SHP.ETADestination,
+    "ETDDestination":        SHP.ETDDestination,
+    "ETAWH":                 SHP.ETAWH,
+    "BiyanNumber":           SHP.BiyanNumber,
+    "SADDADNumber":          SHP.SADDADNumber,
+    "InvoiceNumbers":        INV.InvoiceNumbers,
+    "ContainerLineID":       CL.ContainerLineID,
+    "QtyInContainer":        CL.QtyInContainer,
+    "ContainerNumber":       CTN.ContainerNumber,
+    "CCDate":                CTN.CCDate,
+    "ATAOrigin":             CTN.ATAOrigin,
+    "ATDOrigin":             CTN.ATDOrigin,
+    "ATADP":                 CTN.ATADP,
+    "ATDDPort":              CTN.ATDDPort,
+    "ATAWH":                 CTN.ATAWH,
+    "YardInDate":            CTN.YardInDate,
+    "YardOutDate":           CTN.YardOutDate,
+    "POStatus":              PO_STATUS.c.Status,
+    "ShipmentStatus":        SHP_STATUS.c.Status,
+    "ContainerStatus":       CTN_STATUS.c.Status,
+    "PlanedContainerStatus": CTN_PLANED_STATUS.c.Status,
+}
+
+# (target, on clause, facts that need it)
+_OPTIONAL_JOINS = [
+    (CAT,               POL.CategoryMappingID == CAT.ID,                   {"CategoryName", "CategoryDesc"}),
+    (PO_STATUS,         PO_STATUS.c.POID == PO.POID,                       {"POStatus"}),
+    (SHP_STATUS,        SHP_STATUS.c.ShipmentID == SHP.ShipmentID,         {"ShipmentStatus"}),
+    (INV,               INV.ShipmentID == SHP.ShipmentID,                  {"InvoiceNumbers"}),
+    (CTN_STATUS,        CTN_STATUS.c.ContainerID == CTN.ContainerID,       {"ContainerStatus"}),
+    (CTN_PLANED_STATUS, CTN_PLANED_STATUS.c.ContainerID == CTN.ContainerID, {"PlanedContainerStatus"}),
+]
+
+
+@functools.lru_cache(maxsize=None)
+def freight_facts(names):
+    """
+    SELECT <names> FROM the freight join, unordered and unfiltered.
+    names -- > tuple of FREIGHT_FACTS keys, in output order (a tuple, so it can key the cache)
+    """
+    unknown = [n for n in names if n not in FREIGHT_FACTS]
+    if unknown:
+        raise KeyError(f"unknown freight facts: {unknown}")
+
+    stmt = (
+        select(*[FREIGHT_FACTS[n].label(n) for n in names])
+        .select_from(PO)
+        .join(POL, PO.POID          == POL.POID)
+        .join(SPL, POL.POLineID     == SPL.POLineID)
+        .join(SHP, SPL.ShipmentID   == SHP.ShipmentID)
+        .join(CL,  SPL.ShipmentPOLineID == CL.ShipmentPOLineID)
+        .join(CTN, CL.ContainerID   == CTN.ContainerID)
+    )
+    wanted = set(names)
+    for target, on, provides in _OPTIONAL_JOINS:
+        if provides & wanted:
+            stmt = stmt.outerjoin(target, on)
+    return stmt
+
+
+def changed_since(since, status_after=None):
+    """
+    WHERE clause for freight_facts() rows that changed after `since`: the PO,
+    PO line, shipment line, shipment, container line or container was updated,
+    the shipment's invoices changed, or the PO / shipment / container got a new
+    status. New statuses are StatusHistoryID > status_after when given (status
+    dates can be backdated), else StatusDate > since.
+    """
+    if status_after is not None:
+        new_status = SH.StatusHistoryID > status_after
+    else:
+        new_status = SH.StatusDate > since
+
+    def with_new_status(*entity_types):
+        return select(SH.EntityID).where(SH.EntityType.in_(entity_types), new_status)
+
+    return or_(
+        PO.LastUpdated  > since,
+        POL.LastUpdated > since,
+        SPL.LastUpdated > since,
+        SHP.LastUpdated > since,
+        CL.LastUpdated  > since,
+        CTN.UpdatedAt   > since,
+        SHP.ShipmentID.in_(select(INV.ShipmentID).where(INV.UpdatedAt > since)),
+        PO.POID.in_(with_new_status("Purchase Order")),
+        SHP.ShipmentID.in_(with_new_status("Shipment")),
+        CTN.ContainerID.in_(with_new_status("Container", "Planed-Container")),
+    )
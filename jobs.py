@@ -0,0 +1,186 @@
+# jobs.py
+"""
+Background export jobs.
+
+A route calls submit(report, filters, fmt, owner, scope) and gets a job id
+back at once; a small thread pool (EXPORT_WORKERS, default 2) builds the file
+while the page polls get_job(job_id). Reports are registered with
+@export_report(name, basename): the builder gets an unscoped Session, the
+filters and the submitting user's brand scope (cache.brand_scope(); None =
+unrestricted), and returns the rows plus the layout arguments of
+exports.write_export(). The pool thread has no request, so the `model`
+session's brand filter does not apply there: the builder must restrict its
+rows to `scope` itself. `basename` names the downloaded file. submit()'s
+`on_success(db)` runs in the worker once the file is in place (not for a
+file served from the cache or a job shared with an earlier submit).
+
+Finished files are cached in EXPORT_CACHE_DIR, named after a hash of
+(report, normalized filters, brand scope, format, data version), so the same
+export asked again before the data changes is served from disk without
+queueing anything. A job belongs to the user who submitted it.
+Files older than EXPORT_CACHE_TTL seconds are removed on the next submit.
+
+Jobs live in this process: run the app as a single (threaded) process, or
+pin a user to one worker, so the status poll reaches the process that owns
+the job.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from models import Session
+from cache import data_version, normalize_filter
+from exports import EXPORT_FILES, write_export
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS   = 2
+DEFAULT_CACHE_TTL = 24 * 3600   # seconds
+JOB_KEEP_SECONDS  = 3600        # finished jobs are forgotten after this
+
+# process-local: data_version() restarts at 0 with the process, so files
+# written by an earlier process must not match keys computed by this one
+_EPOCH = uuid.uuid4().hex
+
+_reports   = {}     # name -> (builder(db, filters, scope) -> dict(rows=..., columns=..., ...), basename)
+_jobs      = {}     # job id -> job dict (see _new_job)
+_jobs_lock = threading.Lock()
+_executor  = None
+
+
+def export_report(name, basename):
+    """Register `fn(db, filters, scope)` as the builder for report `name`."""
+    def register(fn):
+        _reports[name] = (fn, basename)
+        return fn
+    return register
+
+def _config(key, default):
+    return current_app.config.get(key, default)
+
+def _cache_dir():
+    path = _config("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "rft_exports"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _pool():
+    global _executor
+    with _jobs_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers        = _config("EXPORT_WORKERS", DEFAULT_WORKERS),
+                thread_name_prefix = "export",
+            )
+    return _executor
+
+def normalize_filters(filters):
+    """Filters as a hashable, order-insensitive tuple ('' / [] / None mean no filter)."""
+    return tuple(sorted((k, normalize_filter(v)) for k, v in (filters or {}).items() if normalize_filter(v) is not None))
+
+def cache_key(report, filters, fmt, scope=None):
+    raw = json.dumps([report, normalize_filters(filters), normalize_filter(scope), fmt, data_version(), _EPOCH], default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+def _prune(cache_dir, ttl):
+    cutoff = time.time() - ttl
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass    # another worker got there first
+    with _jobs_lock:
+        for job_id in [j for j, job in _jobs.items()
+                       if job["finished"] and job["finished"] < time.time() - JOB_KEEP_SECONDS]:
+            del _jobs[job_id]
+
+
+def _new_job(report, fmt, path, status, owner):
+    ext, _ = EXPORT_FILES[fmt]
+    return {
+        "id":       uuid.uuid4().hex,
+        "owner":    owner,       # username that submitted it
+        "report":   report,
+        "format":   fmt,
+        "filename": _reports[report][1] + ext,
+        "status":   status,      # queued | running | done | failed
+        "path":     path,
+        "rows":     None,
+        "error":    None,
+        "created":  time.time(),
+        "finished": time.time() if status == "done" else None,
+    }
+
+def _set(job, **changes):
+    with _jobs_lock:
+        job.update(changes)
+
+def _run(app, job, filters, scope, on_success=None):
+    builder, _ = _reports[job["report"]]
+    with app.app_context():
+        _set(job, status="running")
+        db  = Session()
+        tmp = job["path"] + f".{job['id']}.part"
+        try:
+            spec = builder(db, filters, scope)
+            with open(tmp, "wb") as fh:
+                n = write_export(fh, job["format"], **spec)
+            os.replace(tmp, job["path"])      # readers never see a half-written file
+            if on_success is not None:
+                try:
+                    on_success(db)
+                except Exception:
+                    log.exception("export job %s (%s): on_success failed", job["id"], job["report"])
+            _set(job, status="done", rows=n, finished=time.time())
+        except Exception as e:
+            log.exception("export job %s (%s) failed", job["id"], job["report"])
+            _set(job, status="failed", error=str(e) or type(e).__name__, finished=time.time())
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        finally:
+            db.close()
+
+def submit(report, filters, fmt, owner, scope=None, on_success=None):
+    """
+    Queue an export of `report` for user `owner`, restricted to brand `scope`
+    (None = all brands), and return its job dict. When the same export is
+    already cached on disk the job comes back as "done" straight away.
+    on_success -- > callable(db) run once this submit's file has been written
+    """
+    if report not in _reports:
+        raise KeyError(f"unknown export report: {report}")
+    ext, _  = EXPORT_FILES[fmt]
+    cache   = _cache_dir()
+    _prune(cache, _config("EXPORT_CACHE_TTL", DEFAULT_CACHE_TTL))
+    path    = os.path.join(cache, cache_key(report, filters, fmt, scope) + ext)
+
+    if os.path.exists(path):
+        job = _new_job(report, fmt, path, "done", owner)
+        with _jobs_lock:
+            _jobs[job["id"]] = job
+        return dict(job)
+
+    with _jobs_lock:
+        # same user already building the same export -> share that job
+        for job in _jobs.values():
+            if job["path"] == path and job["owner"] == owner and job["status"] in ("queued", "running"):
+                return dict(job)
+        job = _new_job(report, fmt, path, "queued", owner)
+        _jobs[job["id"]] = job
+
+    _pool().submit(_run, current_app._get_current_object(), job, dict(filters or {}), scope, on_success)
+    return dict(job)
+
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
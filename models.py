@@ -4,7 +4,7 @@ from sqlalchemy import ( create_engine, inspect, case,
                         BigInteger, ForeignKey, Text, DateTime,
                         Float, Date, bindparam, func, desc, and_, or_, 
                         bindparam, select, distinct, literal, literal_column,
-                        text, PrimaryKeyConstraint, extract, delete)
+                        text, PrimaryKeyConstraint, extract, delete, Index)
 # from sqlalchemy import coalesce
 import urllib.parse
 from sqlalchemy.orm import declarative_base, aliased
@@ -16,6 +16,7 @@ from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy import event
 from sqlalchemy.orm import with_loader_criteria
 from config import Config
+from costs import COST_COLUMNS
 from flask import session
 from functools import reduce
 from operator import add
@@ -90,6 +91,16 @@ def _add_brand_filter(execute_state):
     if opts:
         execute_state.statement = execute_state.statement.options(*opts)
 
+def brand_scoped_session():
+    """
+    A fresh Session with the same per-user Brand filter as `model`.
+    For work that can't share the request's session (e.g. worker threads);
+    the caller owns it and must close it.
+    """
+    db = Session()
+    event.listen(db, "do_orm_execute", _add_brand_filter)
+    return db
+
 class Users(Base):
     __tablename__ = 'Users'
 
@@ -410,7 +421,191 @@ class RFT_Invoices(Base):
 
     # relationship back to shipment
     shipment      = relationship('RFT_Shipment', back_populates='invoices')
-   
+
+class RFT_InvoiceSummary(Base):
+    """One row per shipment with invoices: comma-joined numbers, count and total.
+    Maintained by the RFT_Invoices hooks below, in the same transaction as the
+    invoice write, so the freight views join on ShipmentID instead of running a
+    FOR XML PATH subquery per shipment."""
+    __tablename__ = 'RFT_InvoiceSummary'
+
+    ShipmentID      = Column(Integer, primary_key=True, autoincrement=False)
+    InvoiceNumbers  = Column(Text)              # 'INV1,INV2', in InvoiceID order
+    InvoiceCount    = Column(Integer, nullable=False)
+    InvoiceTotal    = Column(Numeric(18,2), nullable=False)
+    UpdatedAt       = Column(DateTime, server_default=text('GETDATE()'), nullable=False)
+
+# Recompute one shipment's row; the aggregate always yields one source row, so
+# a shipment whose last invoice was deleted loses its summary row.
+_INVOICE_SUMMARY_MERGE = text("""
+    MERGE RFT_InvoiceSummary WITH (HOLDLOCK) AS cur
+    USING (
+        SELECT :sid AS ShipmentID,
+               COUNT(*) AS InvoiceCount,
+               COALESCE(SUM(InvoiceValue), 0) AS InvoiceTotal,
+               STUFF((
+                   SELECT ',' + i2.InvoiceNumber
+                   FROM RFT_Invoices AS i2
+                   WHERE i2.ShipmentID = :sid
+                   ORDER BY i2.InvoiceID
+                   FOR XML PATH(''), TYPE
+               ).value('.', 'NVARCHAR(MAX)'), 1, 1, '') AS InvoiceNumbers
+        FROM RFT_Invoices
+        WHERE ShipmentID = :sid
+    ) AS src
+    ON cur.ShipmentID = src.ShipmentID
+    WHEN MATCHED AND src.InvoiceCount = 0 THEN
+        DELETE
+    WHEN MATCHED THEN
+        UPDATE SET InvoiceNumbers = src.InvoiceNumbers,
+                   InvoiceCount   = src.InvoiceCount,
+                   InvoiceTotal   = src.InvoiceTotal,
+                   UpdatedAt      = GETDATE()
+    WHEN NOT MATCHED AND src.InvoiceCount > 0 THEN
+        INSERT (ShipmentID, InvoiceNumbers, InvoiceCount, InvoiceTotal)
+        VALUES (src.ShipmentID, src.InvoiceNumbers, src.InvoiceCount, src.InvoiceTotal);
+""")
+
+@event.listens_for(RFT_Invoices, "after_insert")
+@event.listens_for(RFT_Invoices, "after_delete")
+def _sync_invoice_summary(mapper, connection, target):
+    connection.execute(_INVOICE_SUMMARY_MERGE, {"sid": target.ShipmentID})
+
+@event.listens_for(RFT_Invoices, "after_update")
+def _sync_invoice_summary_on_update(mapper, connection, target):
+    # an invoice moved to another shipment changes both summaries
+    moved_from = inspect(target).attrs.ShipmentID.history.deleted
+    for sid in {target.ShipmentID, *moved_from}:
+        connection.execute(_INVOICE_SUMMARY_MERGE, {"sid": sid})
+
+def rebuild_invoice_summary(db):
+    """Repopulate RFT_InvoiceSummary from RFT_Invoices (backfill / repair)."""
+    db.execute(text("DELETE FROM RFT_InvoiceSummary"))
+    db.execute(text("""
+        INSERT INTO RFT_InvoiceSummary (ShipmentID, InvoiceNumbers, InvoiceCount, InvoiceTotal)
+        SELECT Inv.ShipmentID,
+               STUFF((
+                   SELECT ',' + i2.InvoiceNumber
+                   FROM RFT_Invoices AS i2
+                   WHERE i2.ShipmentID = Inv.ShipmentID
+                   ORDER BY i2.InvoiceID
+                   FOR XML PATH(''), TYPE
+               ).value('.', 'NVARCHAR(MAX)'), 1, 1, ''),
+               COUNT(*),
+               SUM(Inv.InvoiceValue)
+        FROM RFT_Invoices AS Inv
+        GROUP BY Inv.ShipmentID
+    """))
+    db.commit()
+
+####################################
+####### Landed cost ledger #########
+####################################
+LANDED_COST_CHUNK = 1000    # shipment ids per refresh statement (SQL Server allows ~2100 parameters)
+
+class _CostColumns:
+    """One Numeric(18, 4) column per costs.COST_COLUMNS, shared by the landed-cost ledger and the PO rollup."""
+
+for _col in COST_COLUMNS:
+    setattr(_CostColumns, _col, Column(Numeric(18, 4), nullable=False))
+del _col
+
+class RFT_LandedCost(_CostColumns, Base):
+    """One row per shipment PO line: each shipment cost (costs.COST_COLUMNS)
+    allocated to the line by QtyShipped / the shipment's total QtyShipped.
+    Kept current by the after_flush hook below (shipment costs saved, shipment lines or container
+    lines changed), so the expense and PO reports read allocated costs
+    instead of spreading every shipment's costs on each request."""
+    __tablename__ = 'RFT_LandedCost'
+
+    ShipmentPOLineID            = Column(Integer, primary_key=True, autoincrement=False)
+    ShipmentID                  = Column(Integer, nullable=False, index=True)
+    QtyShipped                  = Column(Integer, nullable=False)
+    ShipmentQty                 = Column(Integer, nullable=False)   # the shipment's total QtyShipped
+    TotalCost                   = Column(Numeric(18, 4), nullable=False)
+    UpdatedAt                   = Column(DateTime, server_default=text('GETDATE()'), nullable=False)
+
+def _landed_cost_select(shipment_ids=None):
+    """SELECT of RFT_LandedCost rows for `shipment_ids` (all shipments when None)."""
+    SPL, SHP = RFT_ShipmentPOLine, RFT_Shipment
+    lines = select(
+        SPL.ShipmentPOLineID, SPL.ShipmentID, SPL.QtyShipped,
+        func.sum(SPL.QtyShipped).over(partition_by=SPL.ShipmentID).label("ShipmentQty"),
+    )
+    if shipment_ids is not None:
+        lines = lines.where(SPL.ShipmentID.in_(shipment_ids))
+    lines = lines.subquery("lines")
+
+    def allocated(cost):
+        # cost * qty first, then divide: the line shares add back up to the shipment cost
+        return func.coalesce(cost * lines.c.QtyShipped / func.nullif(lines.c.ShipmentQty, 0), 0)
+
+    costs = [func.coalesce(getattr(SHP, col), 0) for col in COST_COLUMNS]
+    return (
+        select(
+            lines.c.ShipmentPOLineID, lines.c.ShipmentID, lines.c.QtyShipped, lines.c.ShipmentQty,
+            *[allocated(cost).label(col) for col, cost in zip(COST_COLUMNS, costs)],
+            allocated(reduce(add, costs)).label("TotalCost"),
+        )
+        .join_from(lines, SHP, SHP.ShipmentID == lines.c.ShipmentID)
+    )
+
+_LANDED_COST_INSERT_COLUMNS = ["ShipmentPOLineID", "ShipmentID", "QtyShipped", "ShipmentQty", *COST_COLUMNS, "TotalCost"]
+
+def refresh_landed_cost(connection, shipment_ids):
+    """Recompute the RFT_LandedCost rows of `shipment_ids` (a shipment without lines loses its rows)."""
+    ids = sorted({i for i in shipment_ids if i is not None})
+    for i in range(0, len(ids), LANDED_COST_CHUNK):
+        chunk = ids[i:i + LANDED_COST_CHUNK]
+        connection.execute(delete(RFT_LandedCost).where(RFT_LandedCost.ShipmentID.in_(chunk)))
+        connection.execute(
+            RFT_LandedCost.__table__.insert().from_select(_LANDED_COST_INSERT_COLUMNS, _landed_cost_select(chunk))
+        )
+
+def _landed_cost_shipments(session):
+    """Shipments whose allocation the pending flush changes."""
+    sids, spl_ids = set(), set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, RFT_Shipment):
+            if obj in session.new:
+                continue        # no lines yet; they bring it in
+            state = inspect(obj)
+            if obj in session.deleted or any(state.attrs[c].history.has_changes() for c in COST_COLUMNS):
+                sids.add(obj.ShipmentID)
+        elif isinstance(obj, RFT_ShipmentPOLine):
+            state = inspect(obj)
+            if obj in session.dirty and not (state.attrs.QtyShipped.history.has_changes()
+                                             or state.attrs.ShipmentID.history.has_changes()):
+                continue
+            sids.add(obj.ShipmentID)
+            sids.update(state.attrs.ShipmentID.history.deleted)    # moved from
+        elif isinstance(obj, RFT_ContainerLine):
+            spl_ids.add(obj.ShipmentPOLineID)
+            spl_ids.update(inspect(obj).attrs.ShipmentPOLineID.history.deleted)
+    return sids, spl_ids
+
+@event.listens_for(Session, "after_flush")
+def _sync_landed_cost(session, flush_context):
+    # once per flush, not per row: saving a shipment touches many of its lines
+    sids, spl_ids = _landed_cost_shipments(session)
+    if not sids and not spl_ids:
+        return
+    connection = session.connection()
+    spl_ids = sorted(i for i in spl_ids if i is not None)
+    for i in range(0, len(spl_ids), LANDED_COST_CHUNK):
+        sids.update(connection.execute(
+            select(RFT_ShipmentPOLine.ShipmentID)
+            .where(RFT_ShipmentPOLine.ShipmentPOLineID.in_(spl_ids[i:i + LANDED_COST_CHUNK]))
+        ).scalars())
+    refresh_landed_cost(connection, sids)
+
+def rebuild_landed_cost(db):
+    """Repopulate RFT_LandedCost for every shipment (backfill / repair)."""
+    db.execute(delete(RFT_LandedCost))
+    db.execute(RFT_LandedCost.__table__.insert().from_select(_LANDED_COST_INSERT_COLUMNS, _landed_cost_select()))
+    db.commit()
+
+
 ####################################
 ####### SATATUS MANAGEMENT #########
 ####################################
@@ -435,6 +630,163 @@ class RFT_StatusHistory(Base):
     UpdatedBy = Column(String(50))
     Comments = Column(String(250))
 
+class RFT_CurrentStatus(Base):
+    """One row per (EntityType, EntityID): the latest RFT_StatusHistory entry.
+    Maintained by the after_insert hook below, in the same transaction as the
+    history insert, so readers can join on the key instead of a MAX() GROUP BY."""
+    __tablename__ = 'RFT_CurrentStatus'
+
+    EntityType      = Column(String(50), primary_key=True)
+    EntityID        = Column(Integer, primary_key=True)
+    Status          = Column(String(50))
+    StatusDate      = Column(DateTime, nullable=False)
+    StatusHistoryID = Column(Integer, nullable=False)
+
+# StatusDate is often func.now(), so read the stored row back rather than
+# trusting the Python-side value. Ties on StatusDate go to the newest history row.
+_CURRENT_STATUS_MERGE = text("""
+    MERGE RFT_CurrentStatus WITH (HOLDLOCK) AS cur
+    USING (
+        SELECT EntityType, EntityID, Status, StatusDate, StatusHistoryID
+        FROM RFT_StatusHistory
+        WHERE StatusHistoryID = :hid
+    ) AS src
+    ON cur.EntityType = src.EntityType AND cur.EntityID = src.EntityID
+    WHEN MATCHED AND (src.StatusDate > cur.StatusDate
+                      OR (src.StatusDate = cur.StatusDate
+                          AND src.StatusHistoryID > cur.StatusHistoryID)) THEN
+        UPDATE SET Status = src.Status,
+                   StatusDate = src.StatusDate,
+                   StatusHistoryID = src.StatusHistoryID
+    WHEN NOT MATCHED THEN
+        INSERT (EntityType, EntityID, Status, StatusDate, StatusHistoryID)
+        VALUES (src.EntityType, src.EntityID, src.Status, src.StatusDate, src.StatusHistoryID);
+""")
+
+@event.listens_for(RFT_StatusHistory, "after_insert")
+def _sync_current_status(mapper, connection, target):
+    connection.execute(_CURRENT_STATUS_MERGE, {"hid": target.StatusHistoryID})
+
+def rebuild_current_status(db):
+    """Repopulate RFT_CurrentStatus from the full history (backfill / repair)."""
+    db.execute(text("DELETE FROM RFT_CurrentStatus"))
+    db.execute(text("""
+        INSERT INTO RFT_CurrentStatus (EntityType, EntityID, Status, StatusDate, StatusHistoryID)
+        SELECT EntityType, EntityID, Status, StatusDate, StatusHistoryID
+        FROM (
+            SELECT h.*,
+                   ROW_NUMBER() OVER (PARTITION BY h.EntityType, h.EntityID
+                                      ORDER BY h.StatusDate DESC, h.StatusHistoryID DESC) AS rn
+            FROM RFT_StatusHistory h
+            WHERE h.EntityType IS NOT NULL
+        ) x
+        WHERE x.rn = 1
+    """))
+    db.commit()
+
+def current_status(entity_type, id_label="EntityID", status_label="Status"):
+    """
+    Latest status per entity of `entity_type`, as a subquery with columns
+    (<id_label>, <status_label>, StatusDate, StatusHistoryID). Join it on the id.
+    """
+    CS = RFT_CurrentStatus
+    return (
+        select(
+            CS.EntityID.label(id_label),
+            CS.Status.label(status_label),
+            CS.StatusDate.label("StatusDate"),
+            CS.StatusHistoryID.label("StatusHistoryID"),
+        )
+        .where(CS.EntityType == entity_type)
+        .subquery()
+    )
+
+
+####################################
+####### Dashboard rollups ##########
+####################################
+class RFT_DashboardCube(Base):
+    """
+    Pre-aggregated dashboard facts, rebuilt per shipment by rollups.py.
+
+    Grain: (ShipmentID, Brand, POMonth, CatName, PlanStatus, ActualStatus);
+    ShpMonth, ModeOfTransport, POD and ShipmentStatus are shipment attributes.
+    ContainerCount is the shipment's containers in (PlanStatus, ActualStatus),
+    so it repeats on every Brand/POMonth/CatName row of the shipment. Take
+    DISTINCT (ShipmentID, PlanStatus, ActualStatus, ContainerCount) before
+    summing. ShippedQty is per (ShipmentID, Brand, POMonth, CatName) and
+    TotalCost per ShipmentID, so they repeat the same way.
+    """
+    __tablename__ = 'RFT_DashboardCube'
+
+    ID              = Column(BigInteger, primary_key=True, autoincrement=True)
+    ShipmentID      = Column(Integer, nullable=False, index=True)
+    Brand           = Column(String(100))
+    POMonth         = Column(Date)          # first day of PO.PODate's month
+    ShpMonth        = Column(Date)          # first day of Shipment.CreatedDate's month
+    CatName         = Column(String(100))
+    ModeOfTransport = Column(String(50))
+    POD             = Column(String(100))
+    ShipmentStatus  = Column(String(50))
+    PlanStatus      = Column(String(50))    # latest 'Planed-Container' status
+    ActualStatus    = Column(String(50))    # latest 'Container' status
+    ContainerCount  = Column(Integer, nullable=False, default=0)
+    ShippedQty      = Column(Integer)
+    TotalCost       = Column(Numeric(18, 2))
+    RefreshedAt     = Column(DateTime)
+
+class RFT_PORollup(_CostColumns, Base):
+    """
+    One row per purchase order (with lines) for the PO cost report, rebuilt
+    per PO by rollups.py (`flask --app app refresh-po-rollup [--full]`).
+
+    PoTotalQty / TotalValue are over the PO's lines; QtyShipped and the cost
+    columns (costs.COST_COLUMNS, the PO lines' RFT_LandedCost allocations)
+    over its shipment lines; DeliveredQty over container lines whose container
+    is currently Delivered. BalanceQty = PoTotalQty - QtyShipped,
+    DeliveredPercent = DeliveredQty * 100 / PoTotalQty and OverheadPercent =
+    TotalCost * 100 / TotalValue, both 0-100 and NULL when the divisor is 0.
+    """
+    __tablename__ = 'RFT_PORollup'
+
+    POID                        = Column(Integer, primary_key=True, autoincrement=False)
+    Brand                       = Column(String(100))
+    PONumber                    = Column(String(50))
+    PoTotalQty                  = Column(Integer, nullable=False)
+    TotalValue                  = Column(Numeric(18, 2), nullable=False)
+    QtyShipped                  = Column(Integer, nullable=False)
+    DeliveredQty                = Column(Integer, nullable=False)
+    BalanceQty                  = Column(Integer, nullable=False)
+    TotalCost                   = Column(Numeric(18, 4), nullable=False)
+    DeliveredPercent            = Column(Float)
+    OverheadPercent             = Column(Float)
+    RefreshedAt                 = Column(DateTime)
+
+class RFT_RefreshWatermark(Base):
+    """How far each incremental rollup has processed (see rollups.py)."""
+    __tablename__ = 'RFT_RefreshWatermark'
+
+    Name            = Column(String(50), primary_key=True)
+    LastStatusID    = Column(Integer)       # highest RFT_StatusHistory.StatusHistoryID processed
+    LastRunAt       = Column(DateTime)      # server time the last refresh started
+    UpdatedAt       = Column(DateTime, server_default=text('GETDATE()'), onupdate=datetime.utcnow)
+
+
+####################################
+########## Export log ##############
+####################################
+class RFT_ExportLog(Base):
+    """One row per export; a delta export starts where the user's previous one did."""
+    __tablename__ = 'RFT_ExportLog'
+
+    ID              = Column(Integer, primary_key=True, autoincrement=True)
+    Username        = Column(String(100), nullable=False, index=True)
+    Report          = Column(String(50), nullable=False)
+    Mode            = Column(String(10), nullable=False)    # 'full' | 'delta'
+    Since           = Column(DateTime)                      # delta lower bound as applied (server time)
+    ExportedAt      = Column(DateTime, nullable=False)      # server time the export's query started
+    LastStatusID    = Column(Integer)                       # highest RFT_StatusHistory.StatusHistoryID at ExportedAt
+
 
 ####################################
 ####### Categories Mapping #########
@@ -627,10 +979,8 @@ class RFT_ArticleWeight(Base):
 
 
 
-class FreightTrackingView( Base):
-    __tablename__ = 'vw_AllFreightData'
-    
-    POID            = Column(Integer, primary_key=True)
+class _FreightDataColumns:
+    """Columns of vw_AllFreightData, shared by the view mapping and its snapshot table."""
     POLineID        = Column(Integer)
     ShipmentID      = Column(Integer)
     ShipmentPOLineID= Column(Integer)
@@ -719,6 +1069,34 @@ class FreightTrackingView( Base):
     POLevelStatus       = Column(String(100))
     ShipmentLevelStatus = Column(String(100))
     ContainerLevelStatus= Column(String(100))
-    
-    
-    
+
+
+class FreightTrackingView(_FreightDataColumns, Base):
+    __tablename__ = 'vw_AllFreightData'
+
+    POID            = Column(Integer, primary_key=True)
+
+
+class RFT_FreightSnapshot(_FreightDataColumns, Base):
+    """
+    Materialized copy of vw_AllFreightData, refreshed per PO by rollups.py
+    (incremental from RFT_RefreshWatermark, or `flask --app app refresh-freight-snapshot --full`).
+    With FREIGHT_SNAPSHOT = True in config, FreightTrackingData below points here.
+    """
+    __tablename__ = 'RFT_FreightSnapshot'
+
+    SnapshotRowID   = Column(BigInteger, primary_key=True, autoincrement=True)
+    POID            = Column(Integer, nullable=False, index=True)
+    RefreshedAt     = Column(DateTime)
+
+    __table_args__ = (
+        Index("IX_RFT_FreightSnapshot_Brand",          "Brand"),
+        Index("IX_RFT_FreightSnapshot_ShipmentNumber", "ShipmentNumber"),
+        Index("IX_RFT_FreightSnapshot_PODate",         "PODate"),
+        Index("IX_RFT_FreightSnapshot_POCreatedDate",  "POCreatedDate"),
+        Index("IX_RFT_FreightSnapshot_ShipmentID",     "ShipmentID"),
+    )
+
+# What the freight-data readers query: the live view, or the snapshot when
+# FREIGHT_SNAPSHOT is on. Both have the same data columns.
+FreightTrackingData = RFT_FreightSnapshot if getattr(Config, "FREIGHT_SNAPSHOT", False) else FreightTrackingView
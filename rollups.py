@@ -0,0 +1,404 @@
+# rollups.py
+"""
+Refresh of the materialized tables:
+
+RFT_DashboardCube, the pre-aggregated table the dashboard panels can read
+instead of joining Container -> Shipment -> PO lines -> PO and the
+current-status table on every request (DASHBOARD_CUBE = True in config).
+
+  refresh_dashboard_cube(db)             -> incremental: only shipments changed
+                                            since the RFT_RefreshWatermark row
+  refresh_dashboard_cube(db, full=True)  -> rebuild every row
+
+RFT_FreightSnapshot, a copy of vw_AllFreightData that FreightTrackingData
+points at when FREIGHT_SNAPSHOT = True, refreshed per PO the same way by
+refresh_freight_snapshot(db[, full=True]). A PO is reprocessed when it or
+one of its lines changed, got a status, or is on a changed shipment.
+
+RFT_PORollup, the per-PO figures behind the PO cost report (/po_report and
+its export), refreshed per PO by refresh_po_rollup(db[, full=True]): the
+snapshot's changed POs, plus POs whose landed costs were re-allocated or
+whose container lines changed.
+
+A shipment is "changed" when it, one of its PO lines / POs / category
+mappings, or one of its containers has a newer LastUpdated/UpdatedAt than the
+watermark, or when a status was recorded for it or its containers. Timestamps
+on these tables mix GETDATE() defaults with datetime.utcnow() updates, so the
+timestamp check looks back `overlap_hours` further than the last run.
+
+Deleted containers or shipment lines leave no timestamp behind; run a full
+rebuild after bulk deletes (deleted shipments are dropped on every refresh).
+"""
+import logging
+from datetime import timedelta
+from functools import reduce
+from operator import add
+
+from sqlalchemy import insert, union
+
+from models import (
+    select, delete, func, literal, literal_column, and_, or_, cast, Float,
+    RFT_DashboardCube, RFT_RefreshWatermark, RFT_CurrentStatus,
+    RFT_Shipment, RFT_ShipmentPOLine, RFT_Container, RFT_StatusHistory,
+    RFT_PurchaseOrder, RFT_PurchaseOrderLine, RFT_CategoriesMappingMain,
+    RFT_FreightSnapshot, FreightTrackingView, RFT_PORollup, RFT_LandedCost, RFT_ContainerLine,
+)
+from costs import COST_COLUMNS
+from utils import DELIVERED_STATUSES
+from cache import bump_data_version
+
+log = logging.getLogger(__name__)
+
+WATERMARK_NAME          = "dashboard_cube"
+SNAPSHOT_WATERMARK_NAME = "freight_snapshot"
+DEFAULT_OVERLAP_HOURS   = 24
+CHUNK                   = 500    # shipment ids per refresh step; bound 3x in _cube_select (SQL Server allows ~2100 parameters)
+SNAPSHOT_CHUNK          = 1000   # POIDs per snapshot refresh step, bound once per statement
+
+K   = RFT_DashboardCube
+S   = RFT_Shipment
+SP  = RFT_ShipmentPOLine
+C   = RFT_Container
+POL = RFT_PurchaseOrderLine
+PO  = RFT_PurchaseOrder
+CM  = RFT_CategoriesMappingMain
+SH  = RFT_StatusHistory
+CS  = RFT_CurrentStatus
+
+CUBE_COLUMNS = [
+    "ShipmentID", "Brand", "POMonth", "ShpMonth", "CatName", "ModeOfTransport", "POD",
+    "ShipmentStatus", "PlanStatus", "ActualStatus", "ContainerCount", "ShippedQty",
+    "TotalCost", "RefreshedAt",
+]
+
+
+def _month_start(col):
+    # literal day so the expression compiles identically in SELECT and GROUP BY
+    return func.datefromparts(func.year(col), func.month(col), literal_column("1"))
+
+def _cube_select(shipment_ids=None):
+    """SELECT producing cube rows (in CUBE_COLUMNS order) for `shipment_ids`, or all shipments."""
+    def _only(col):
+        return [col.in_(shipment_ids)] if shipment_ids is not None else []
+
+    # PO-side dimensions: one row per (shipment, brand, PO month, category)
+    lines = (
+        select(
+            SP.ShipmentID.label("ShipmentID"),
+            PO.Brand.label("Brand"),
+            _month_start(PO.PODate).label("POMonth"),
+            CM.CatName.label("CatName"),
+            func.sum(SP.QtyShipped).label("ShippedQty"),
+        )
+        .join(POL, POL.POLineID == SP.POLineID)
+        .join(PO,  PO.POID      == POL.POID)
+        .outerjoin(CM, CM.ID    == POL.CategoryMappingID)
+        .where(*_only(SP.ShipmentID))
+        .group_by(SP.ShipmentID, PO.Brand, _month_start(PO.PODate), CM.CatName)
+        .subquery("ln")
+    )
+
+    # container-side: containers per (shipment, planned status, actual status)
+    plan = CS.__table__.alias("plan_cs")
+    act  = CS.__table__.alias("act_cs")
+    ctns = (
+        select(
+            C.ShipmentID.label("ShipmentID"),
+            plan.c.Status.label("PlanStatus"),
+            act.c.Status.label("ActualStatus"),
+            func.count(C.ContainerID).label("n"),
+        )
+        .outerjoin(plan, and_(plan.c.EntityType == "Planed-Container", plan.c.EntityID == C.ContainerID))
+        .outerjoin(act,  and_(act.c.EntityType  == "Container",        act.c.EntityID  == C.ContainerID))
+        .where(*_only(C.ShipmentID))
+        .group_by(C.ShipmentID, plan.c.Status, act.c.Status)
+        .subquery("ct")
+    )
+
+    shp_status = CS.__table__.alias("shp_cs")
+    costs = [func.coalesce(getattr(S, col), 0) for col in COST_COLUMNS]
+
+    return (
+        select(
+            S.ShipmentID,
+            lines.c.Brand,
+            lines.c.POMonth,
+            _month_start(S.CreatedDate),
+            lines.c.CatName,
+            S.ModeOfTransport,
+            S.POD,
+            shp_status.c.Status,
+            ctns.c.PlanStatus,
+            ctns.c.ActualStatus,
+            func.coalesce(ctns.c.n, 0),          # shipment without containers -> one row, 0 containers
+            lines.c.ShippedQty,
+            reduce(add, costs) if costs else literal(0),
+            func.getdate(),
+        )
+        .join(lines, lines.c.ShipmentID == S.ShipmentID)
+        .outerjoin(ctns, ctns.c.ShipmentID == S.ShipmentID)
+        .outerjoin(shp_status, and_(shp_status.c.EntityType == "Shipment", shp_status.c.EntityID == S.ShipmentID))
+        .where(*_only(S.ShipmentID))
+    )
+
+
+def _new_status(last_status_id, max_status_id):
+    return and_(SH.StatusHistoryID > (last_status_id or 0), SH.StatusHistoryID <= max_status_id)
+
+def _changed_shipments_select(since, last_status_id, max_status_id):
+    """SELECT of the ids of shipments touched after `since`, or with status rows in (last_status_id, max_status_id]."""
+    def via_lines():
+        return select(SP.ShipmentID).join(POL, POL.POLineID == SP.POLineID)
+
+    new_status = _new_status(last_status_id, max_status_id)
+
+    return union(
+        select(S.ShipmentID).where(or_(S.LastUpdated > since, S.CreatedDate > since)),
+        select(SP.ShipmentID).where(SP.LastUpdated > since),
+        select(C.ShipmentID).where(C.UpdatedAt > since),
+        via_lines().where(POL.LastUpdated > since),
+        via_lines().join(PO, PO.POID == POL.POID).where(PO.LastUpdated > since),
+        via_lines().join(CM, CM.ID == POL.CategoryMappingID).where(CM.UpdatedAt > since),
+        select(SH.EntityID).where(SH.EntityType == "Shipment", new_status),
+        select(C.ShipmentID).join(SH, SH.EntityID == C.ContainerID)
+                            .where(SH.EntityType.in_(["Container", "Planed-Container"]), new_status),
+    )
+
+def _changed_shipments(db, since, last_status_id, max_status_id):
+    q = _changed_shipments_select(since, last_status_id, max_status_id)
+    return sorted({sid for (sid,) in db.execute(q) if sid is not None})
+
+
+def refresh_dashboard_cube(db, full=False, overlap_hours=DEFAULT_OVERLAP_HOURS):
+    """
+    Bring RFT_DashboardCube up to date and advance the watermark, in one transaction.
+    Returns the number of shipments reprocessed (None for a full rebuild).
+    """
+    started       = db.scalar(select(func.getdate()))
+    max_status_id = db.scalar(select(func.max(SH.StatusHistoryID))) or 0
+    wm            = db.get(RFT_RefreshWatermark, WATERMARK_NAME)
+
+    try:
+        if full or wm is None or wm.LastRunAt is None:
+            db.execute(delete(K), execution_options={"synchronize_session": False})
+            db.execute(insert(K).from_select(CUBE_COLUMNS, _cube_select()))
+            changed = None
+        else:
+            since   = wm.LastRunAt - timedelta(hours=overlap_hours)
+            changed = _changed_shipments(db, since, wm.LastStatusID, max_status_id)
+            for i in range(0, len(changed), CHUNK):
+                ids = changed[i:i + CHUNK]
+                db.execute(delete(K).where(K.ShipmentID.in_(ids)), execution_options={"synchronize_session": False})
+                db.execute(insert(K).from_select(CUBE_COLUMNS, _cube_select(ids)))
+            # shipments deleted since the last run
+            db.execute(delete(K).where(K.ShipmentID.not_in(select(S.ShipmentID))),
+                       execution_options={"synchronize_session": False})
+
+        if wm is None:
+            wm = RFT_RefreshWatermark(Name=WATERMARK_NAME)
+            db.add(wm)
+        wm.LastStatusID = max_status_id
+        wm.LastRunAt    = started
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    bump_data_version()   # cached dashboard aggregates may have been read from the cube
+    log.info("dashboard cube refreshed (%s)", "full" if changed is None else f"{len(changed)} shipments")
+    return None if changed is None else len(changed)
+
+
+# ── vw_AllFreightData snapshot ────────────────────────────────────────────
+FS   = RFT_FreightSnapshot
+VIEW = FreightTrackingView.__table__
+SNAPSHOT_COLUMNS = [c.name for c in VIEW.columns]      # same names in both tables
+
+def _snapshot_select(poids=None):
+    """SELECT of view rows (SNAPSHOT_COLUMNS + RefreshedAt) for `poids`, or all of them."""
+    q = select(*[VIEW.c[name] for name in SNAPSHOT_COLUMNS], func.getdate())
+    return q.where(VIEW.c.POID.in_(poids)) if poids is not None else q
+
+def _changed_pos_select(since, last_status_id, max_status_id):
+    """SELECT of the ids of POs whose snapshot rows may be stale (see the module docstring)."""
+    shipments = _changed_shipments_select(since, last_status_id, max_status_id)
+    return union(
+        select(PO.POID).where(or_(PO.LastUpdated > since, PO.CreatedDate > since)),
+        select(POL.POID).where(POL.LastUpdated > since),
+        select(POL.POID).join(CM, CM.ID == POL.CategoryMappingID).where(CM.UpdatedAt > since),
+        select(POL.POID).join(SP, SP.POLineID == POL.POLineID)
+                        .where(SP.ShipmentID.in_(shipments)),
+        select(SH.EntityID).where(SH.EntityType == "Purchase Order", _new_status(last_status_id, max_status_id)),
+    )
+
+def _changed_pos(db, since, last_status_id, max_status_id):
+    q = _changed_pos_select(since, last_status_id, max_status_id)
+    return sorted({poid for (poid,) in db.execute(q) if poid is not None})
+
+
+def refresh_freight_snapshot(db, full=False, overlap_hours=DEFAULT_OVERLAP_HOURS):
+    """
+    Bring RFT_FreightSnapshot up to date and advance its watermark, in one transaction.
+    Returns the number of POs reprocessed (None for a full rebuild).
+    """
+    started       = db.scalar(select(func.getdate()))
+    max_status_id = db.scalar(select(func.max(SH.StatusHistoryID))) or 0
+    wm            = db.get(RFT_RefreshWatermark, SNAPSHOT_WATERMARK_NAME)
+    columns       = SNAPSHOT_COLUMNS + ["RefreshedAt"]
+
+    try:
+        if full or wm is None or wm.LastRunAt is None:
+            db.execute(delete(FS), execution_options={"synchronize_session": False})
+            db.execute(insert(FS).from_select(columns, _snapshot_select()))
+            changed = None
+        else:
+            since   = wm.LastRunAt - timedelta(hours=overlap_hours)
+            changed = _changed_pos(db, since, wm.LastStatusID, max_status_id)
+            for i in range(0, len(changed), SNAPSHOT_CHUNK):
+                ids = changed[i:i + SNAPSHOT_CHUNK]
+                db.execute(delete(FS).where(FS.POID.in_(ids)), execution_options={"synchronize_session": False})
+                db.execute(insert(FS).from_select(columns, _snapshot_select(ids)))
+            # POs deleted since the last run
+            db.execute(delete(FS).where(FS.POID.not_in(select(PO.POID))),
+                       execution_options={"synchronize_session": False})
+
+        if wm is None:
+            wm = RFT_RefreshWatermark(Name=SNAPSHOT_WATERMARK_NAME)
+            db.add(wm)
+        wm.LastStatusID = max_status_id
+        wm.LastRunAt    = started
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    bump_data_version()   # cached filter options / aggregates may have been read from the snapshot
+    log.info("freight snapshot refreshed (%s)", "full" if changed is None else f"{len(changed)} POs")
+    return None if changed is None else len(changed)
+
+
+# ── PO cost report rollup ─────────────────────────────────────────────────
+PR  = RFT_PORollup
+LC  = RFT_LandedCost
+CL  = RFT_ContainerLine
+PO_ROLLUP_WATERMARK_NAME = "po_rollup"
+PO_ROLLUP_COLUMNS = [
+    "POID", "Brand", "PONumber", "PoTotalQty", "TotalValue", "QtyShipped", "DeliveredQty", "BalanceQty",
+    *COST_COLUMNS, "TotalCost", "DeliveredPercent", "OverheadPercent", "RefreshedAt",
+]
+
+def _po_rollup_select(poids=None):
+    """SELECT producing RFT_PORollup rows (in PO_ROLLUP_COLUMNS order) for `poids`, or all POs."""
+    def _only(col):
+        return [col.in_(poids)] if poids is not None else []
+
+    ordered = (
+        select(
+            POL.POID,
+            func.sum(POL.Qty).label("qty"),
+            func.sum(POL.TotalValue).label("value"),
+        )
+        .where(*_only(POL.POID))
+        .group_by(POL.POID)
+        .subquery("ord")
+    )
+    shipped = (
+        select(
+            POL.POID,
+            func.sum(LC.QtyShipped).label("qty"),
+            *[func.sum(getattr(LC, col)).label(col) for col in COST_COLUMNS],
+        )
+        .join(SP,  SP.ShipmentPOLineID == LC.ShipmentPOLineID)
+        .join(POL, POL.POLineID        == SP.POLineID)
+        .where(*_only(POL.POID))
+        .group_by(POL.POID)
+        .subquery("shp")
+    )
+    delivered = (
+        select(POL.POID, func.sum(CL.QtyInContainer).label("qty"))
+        .join(CS,  and_(CS.EntityType == "Container", CS.EntityID == CL.ContainerID))
+        .join(SP,  SP.ShipmentPOLineID == CL.ShipmentPOLineID)
+        .join(POL, POL.POLineID        == SP.POLineID)
+        .where(CS.Status.in_(DELIVERED_STATUSES), *_only(POL.POID))
+        .group_by(POL.POID)
+        .subquery("dlv")
+    )
+
+    po_qty    = func.coalesce(ordered.c.qty, 0)
+    po_value  = func.coalesce(ordered.c.value, 0)
+    qty_shp   = func.coalesce(shipped.c.qty, 0)
+    qty_dlv   = func.coalesce(delivered.c.qty, 0)
+    costs     = [func.coalesce(shipped.c[col], 0) for col in COST_COLUMNS]
+    total     = reduce(add, costs)
+
+    return (
+        select(
+            PO.POID,
+            PO.Brand,
+            PO.PONumber,
+            po_qty,
+            po_value,
+            qty_shp,
+            qty_dlv,
+            po_qty - qty_shp,
+            *costs,
+            total,
+            cast(qty_dlv, Float) * 100 / func.nullif(po_qty, 0),
+            cast(total, Float) * 100 / func.nullif(cast(po_value, Float), 0),
+            func.getdate(),
+        )
+        .join(ordered, ordered.c.POID == PO.POID)        # POs without lines have no row
+        .outerjoin(shipped,   shipped.c.POID   == PO.POID)
+        .outerjoin(delivered, delivered.c.POID == PO.POID)
+        .where(*_only(PO.POID))
+    )
+
+def _changed_rollup_pos(db, since, last_status_id, max_status_id):
+    """Ids of POs whose rollup rows may be stale: as for the snapshot, plus re-allocated landed costs and changed container lines."""
+    via_lines = select(POL.POID).join(SP, SP.POLineID == POL.POLineID)
+    q = union(
+        _changed_pos_select(since, last_status_id, max_status_id),
+        via_lines.join(LC, LC.ShipmentPOLineID == SP.ShipmentPOLineID).where(LC.UpdatedAt > since),
+        via_lines.join(CL, CL.ShipmentPOLineID == SP.ShipmentPOLineID).where(CL.LastUpdated > since),
+    )
+    return sorted({poid for (poid,) in db.execute(q) if poid is not None})
+
+
+def refresh_po_rollup(db, full=False, overlap_hours=DEFAULT_OVERLAP_HOURS):
+    """
+    Bring RFT_PORollup up to date and advance its watermark, in one transaction.
+    Returns the number of POs reprocessed (None for a full rebuild).
+    """
+    started       = db.scalar(select(func.getdate()))
+    max_status_id = db.scalar(select(func.max(SH.StatusHistoryID))) or 0
+    wm            = db.get(RFT_RefreshWatermark, PO_ROLLUP_WATERMARK_NAME)
+
+    try:
+        if full or wm is None or wm.LastRunAt is None:
+            db.execute(delete(PR), execution_options={"synchronize_session": False})
+            db.execute(insert(PR).from_select(PO_ROLLUP_COLUMNS, _po_rollup_select()))
+            changed = None
+        else:
+            since   = wm.LastRunAt - timedelta(hours=overlap_hours)
+            changed = _changed_rollup_pos(db, since, wm.LastStatusID, max_status_id)
+            for i in range(0, len(changed), SNAPSHOT_CHUNK):
+                ids = changed[i:i + SNAPSHOT_CHUNK]
+                db.execute(delete(PR).where(PR.POID.in_(ids)), execution_options={"synchronize_session": False})
+                db.execute(insert(PR).from_select(PO_ROLLUP_COLUMNS, _po_rollup_select(ids)))
+            # POs deleted since the last run
+            db.execute(delete(PR).where(PR.POID.not_in(select(PO.POID))),
+                       execution_options={"synchronize_session": False})
+
+        if wm is None:
+            wm = RFT_RefreshWatermark(Name=PO_ROLLUP_WATERMARK_NAME)
+            db.add(wm)
+        wm.LastStatusID = max_status_id
+        wm.LastRunAt    = started
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    bump_data_version()
+    log.info("PO rollup refreshed (%s)", "full" if changed is None else f"{len(changed)} POs")
+    return None if changed is None else len(changed)
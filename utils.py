@@ -7,20 +7,25 @@ from flask import (
   # flash,
   session,
   send_file,
-  make_response, url_for
+  make_response, url_for,
+  current_app, has_app_context
   # jsonify,
   # Blueprint,
   # abort
 )
 # from decimal import Decimal
-from openpyxl.styles import  Border, Side, Alignment, Font
 from io import BytesIO
-from openpyxl import Workbook
+import itertools
 import pandas as pd
+import numpy as np
 import random
 from datetime import datetime, timedelta
 from collections import defaultdict, namedtuple
 from models     import *
+from cache      import cached_aggregate
+from exports    import xlsx_response, frame_rows
+from costs      import COST_COLUMNS, COST_LABELS, cost_matrix, cost_breakdown
+from sqlalchemy import false
 import pycountry
 import re
 
@@ -29,13 +34,8 @@ DELIVERED_STATUSES = ['Delivered']
 OPEN_STATUSES = ["LC-Established", "PO-shared with supplier"]
 
 def cost_columns():
-  costcols = [
-      col.name
-      for col in inspect(RFT_Shipment).c
-      if isinstance(col.type, Numeric)
-          and (col.name.endswith("Cost") or col.name.endswith("Charges") or col.name in ("CustomDuties", "Penalties", "SaberSADDAD"))
-  ]
-  return costcols
+  """The shipment cost columns (costs.COST_COLUMNS) as a fresh list callers may extend."""
+  return list(COST_COLUMNS)
 
 # the four “real” container stages, in the order you want them reported:
 CONTAINER_STAGES = [
@@ -53,7 +53,7 @@ ExpenseRow = namedtuple("ExpenseRow",
 ####################  Computation functions   #####################
 def get_distinct(column_name):
     """Return a sorted list of distinct non-null values for the given column."""
-    col = getattr(FreightTrackingView, column_name)
+    col = getattr(FreightTrackingData, column_name)
     vals = (
       model.query(col)
            .filter(col.isnot(None))
@@ -93,8 +93,49 @@ def get_distinct_format(table, date_column, fmt):
     )
     return [v for (v,) in vals if v]
 
+def month_ranges(months):
+    """
+    months -- > list of 'yyyy-MM' strings (as returned by get_distinct_format)
+
+    Return the months as merged half-open [start, end) date ranges, e.g.
+    ['2024-01','2024-02','2024-04'] -> [(2024-01-01, 2024-03-01), (2024-04-01, 2024-05-01)].
+    Values that don't parse are ignored.
+    """
+    starts = set()
+    for m in months or []:
+        try:
+            starts.add(datetime.strptime(str(m).strip(), "%Y-%m").date())
+        except ValueError:
+            continue
+
+    ranges = []
+    for start in sorted(starts):
+        end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)  # first of next month
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+def month_filter(col, months):
+    """
+    Index-friendly replacement for func.format(col,'yyyy-MM').in_(months).
+
+    Return a list of criteria to splat into .filter(*...):
+      []       -> no months given ("All"), don't filter
+      [false]  -> months given but none valid, match nothing
+      [col >= x AND col < y OR ...] otherwise
+    """
+    if not months:
+        return []
+    ranges = month_ranges(months)
+    if not ranges:
+        return [false()]
+    return [or_(*(and_(col >= start, col < end) for start, end in ranges))]
+
 # Cost chart
-def compute_cost_by_brand(brands=None, months=None, shp_months=None, categories=None, sel_shp=None, sel_po=None):
+@cached_aggregate
+def compute_cost_by_brand(brands=None, months=None, shp_months=None, categories=None, sel_shp=None, sel_po=None, model=model):
   # brands=None
   # print(brands)
   S   = RFT_Shipment
@@ -104,7 +145,7 @@ def compute_cost_by_brand(brands=None, months=None, shp_months=None, categories=
   CM  = RFT_CategoriesMappingMain
   C   = RFT_Container
 
-  # --- 1) auto-discover your cost columns on Shipment ---
+  # --- 1) the shipment cost columns ---
   cost_cols = cost_columns()
 
   # --- 2) subquery: the DISTINCT shipments you care about ---
@@ -119,7 +160,7 @@ def compute_cost_by_brand(brands=None, months=None, shp_months=None, categories=
     .outerjoin(CM, CM.ID       == POL.CategoryMappingID)
     .filter(
       *( [PO.Brand.in_(brands)]       if brands   else [] ),
-      *( [func.format(PO.PODate,'yyyy-MM').in_(months)] if months else [] ),
+      *month_filter(PO.PODate, months),
       *( [CM.CatName.in_(categories)] if categories else [] )
     )
     .distinct()
@@ -177,89 +218,155 @@ def compute_cost_by_brand(brands=None, months=None, shp_months=None, categories=
   counts = {r.brand: r for r in counts}
   # counts = {r.brand: r for r in cnt_q.all()}
 
-  # --- 5) stitch into your output ---
+  # --- 5) totals / per-container in one pass, then stitch into your output ---
+  cnt = [counts.get(row.brand) for row in brand_costs]
+  cb  = cost_breakdown(
+      cost_matrix(brand_costs, cost_cols),
+      containers=[c.num_containers if c else 0 for c in cnt],
+  )
   out = []
-  for row in brand_costs:
-      c = counts.get(row.brand)
-      total = sum(getattr(row, col) for col in cost_cols)
+  for i, (row, c) in enumerate(zip(brand_costs, cnt)):
       out.append({
         "brand":         row.brand,
-        **{col: float(getattr(row, col)) for col in cost_cols},
-        "total_expense": float(total),
+        **dict(zip(cost_cols, cb.costs[i].tolist())),
+        "total_expense": float(cb.total[i]),
         "num_shipments":  c.num_shipments  if c else 0,
         "num_containers": c.num_containers if c else 0,
         "num_articles":   c.num_articles   if c else 0,
-        # For brands:
-        "num_containers": c.num_containers if c else 0,
-        "cost_per_container": float(total / c.num_containers) if c and c.num_containers else 0,
+        "cost_per_container": float(cb.per_container[i]),
       })
   # print(out)
   return out
 
-def compute_cost_by_shipment(shipment_numbers):
-    S = RFT_Shipment
-    C = RFT_Container
+@cached_aggregate
+def compute_cost_by_shipment(shipment_numbers=None, brand=None, months=None, categories=None,
+                             limit=None, offset=0, order="total", model=model):
+    """
+    Per-shipment cost breakdown for the cost drilldown, in one query.
 
-    # 1) auto-discover your cost columns on Shipment
+    Shipments are picked either by `shipment_numbers` or by brand / PO months /
+    categories (same chain as the brand cost chart). Shipments whose costs sum
+    to 0 are skipped.
+    order -- > "total" (highest total_expense first, i.e. top-N) or "shipment"
+    limit / offset -- > page of results (limit None = all)
+    """
+    S  = RFT_Shipment
+    C  = RFT_Container
+    SP, POL, PO, CM = RFT_ShipmentPOLine, RFT_PurchaseOrderLine, RFT_PurchaseOrder, RFT_CategoriesMappingMain
+
+    # 1) the shipment cost columns
     cost_cols = cost_columns()
 
-    # 2) build one aggregate query: sum each cost per ShipmentNumber
+    # 2) which shipments
+    filters = []
+    if shipment_numbers is not None:
+        filters.append(S.ShipmentNumber.in_(shipment_numbers))
+    if brand or months or categories:
+        picked = (
+            select(SP.ShipmentID)
+            .join(POL, POL.POLineID == SP.POLineID)
+            .join(PO,  PO.POID      == POL.POID)
+            .outerjoin(CM, CM.ID    == POL.CategoryMappingID)
+            .where(
+                *( [PO.Brand == brand] if brand else [] ),
+                *month_filter(PO.PODate, months),
+                *( [or_(CM.CatName.in_(categories), CM.CatName.is_(None))] if categories else [] ),
+            )
+        )
+        filters.append(S.ShipmentID.in_(picked))
+
+    # 3) containers per shipment, joined instead of counted row by row
+    ctn = (
+        select(C.ShipmentID, func.count(distinct(C.ContainerID)).label("n"))
+        .group_by(C.ShipmentID)
+        .subquery()
+    )
+
+    # 4) one aggregate query: sum each cost per ShipmentNumber
     aggregates = [
         func.coalesce(func.sum(getattr(S, col)), 0).label(col)
         for col in cost_cols
     ]
+    total_expr = reduce(add, [func.coalesce(func.sum(getattr(S, col)), 0) for col in cost_cols]) if cost_cols else literal(0)
 
-    
     q = (
         model.query(
         S.ShipmentNumber.label("shipment"),
         S.BLNumber.label("bl"),
+        func.coalesce(func.max(ctn.c.n), 0).label("num_containers"),
         *aggregates
         )
-        .filter(S.ShipmentNumber.in_(shipment_numbers))
+        .outerjoin(ctn, ctn.c.ShipmentID == S.ShipmentID)
+        .filter(*filters)
         .group_by(S.ShipmentNumber, S.BLNumber)  # Include BLNumber in group_by
+        .having(total_expr != 0)                 # skip shipments with no cost at all
     )
+    if order == "shipment":
+        q = q.order_by(S.ShipmentNumber)
+    else:
+        q = q.order_by(total_expr.desc(), S.ShipmentNumber)
+    if offset:
+        q = q.offset(offset)
+    if limit:
+        q = q.limit(limit)
+
+    # 5) costs, totals and per-container for the whole page in one pass
+    rows = q.all()
+    cb   = cost_breakdown(cost_matrix(rows, cost_cols), containers=[r.num_containers for r in rows])
 
     results = []
-    for row in q.all():
-        out = {"shipment": row.shipment, "bl": row.bl}
-        total = 0.0
-
-        # 3) pull each cost, convert to float, accumulate
-        for col in cost_cols:
-            fv = float(getattr(row, col) or 0)
-            out[col] = fv
-            total += fv
-        
-        # # ✅ Skip shipment if all values are 0
-        if total == 0:
-            continue
-        
-        # print(f"[{row.shipment}] Total: {total}")
-        # print({col: out[col] for col in cost_cols})  # DEBUG print
-        
-        shipment_id = model.query(S.ShipmentID).filter(S.ShipmentNumber == row.shipment).scalar()
-        out["num_containers"] = (
-            model.query(func.count(distinct(C.ContainerID)))
-            .filter(C.ShipmentID == shipment_id)
-            .scalar()
-        )
-
-        out["cost_per_container"] = (
-            total / out["num_containers"] if out["num_containers"] else 0
-        )
-
-        out["total_expense"] = total
-        results.append(out)
+    for i, row in enumerate(rows):
+        results.append({
+            "shipment":           row.shipment,
+            "bl":                 row.bl,
+            **dict(zip(cost_cols, cb.costs[i].tolist())),
+            "num_containers":     row.num_containers,
+            "cost_per_container": float(cb.per_container[i]),
+            "total_expense":      float(cb.total[i]),
+        })
 
     return results
 
 
 # Lead Time Chart
-def compute_leadtime_by_brand(brands=None, months=None, shp_months = None):
+def _grouped_stats(groups, values, n_groups, quantiles=(0.5, 0.9)):
+    """
+    Vectorized per-group count / mean / quantiles (NumPy's default linear interpolation).
+    groups -- > int array of group ids (0..n_groups-1), values -- > float array (NaN = no sample)
+    Returns (count, mean, [q arrays]); groups without samples get count 0 and NaN.
+    """
+    ok      = ~np.isnan(values)
+    g, v    = groups[ok], values[ok]
+    count   = np.bincount(g, minlength=n_groups)
+    total   = np.bincount(g, weights=v, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+
+    # sort by (group, value) so every group's samples are a sorted, contiguous slice
+    order   = np.lexsort((v, g))
+    v       = v[order]
+    starts  = np.concatenate(([0], np.cumsum(count)[:-1]))
+    has     = count > 0
+    out = []
+    for q in quantiles:
+        res = np.full(n_groups, np.nan)
+        pos = q * (count[has] - 1)
+        lo  = np.floor(pos).astype(int)
+        hi  = np.ceil(pos).astype(int)
+        s   = starts[has]
+        res[has] = v[s + lo] + (v[s + hi] - v[s + lo]) * (pos - lo)
+        out.append(res)
+    return count, mean, out
+
+@cached_aggregate
+def compute_leadtime_by_brand(brands=None, months=None, shp_months = None, model=model):
     """
-    Returns a list of dicts, one per brand, with avg lead‐time per configured interval.
+    Returns a list of dicts, one per brand, with avg lead‐time per configured interval:
+      {"brand": b, <IntervalName>: avg_days, ..., "stats": {<IntervalName>: {"n", "median", "p90"}}}
     Optional filters: brands (list of brand names), months (list of 'yyyy-MM' strings).
+
+    One query fetches DATEDIFF(day, start, end) for every interval per row; the
+    averages, sample counts, medians and p90s are then computed in NumPy.
     """
     # 1) load all intervals
     intervals = (
@@ -268,41 +375,49 @@ def compute_leadtime_by_brand(brands=None, months=None, shp_months = None):
         .order_by(RFT_IntervalConfig.ID)
         .all()
     )
+    brands = list(brands or [])
+    if not brands:
+        return []
 
-    results = []
-    for b in (brands or []):
-        row = {"brand": b}
-        for cfg in intervals:
-            sf = getattr(FreightTrackingView, cfg.StartField)
-            ef = getattr(FreightTrackingView, cfg.EndField)
-
-            q = (model.query(
-                    func.avg(
-                        func.datediff(literal_column("day"), sf, ef)
-                    )
-                )
-                .filter(FreightTrackingView.Brand == b,
-                        sf.isnot(None), ef.isnot(None))
+    # 2) one row per view row: Brand + one day-count per interval (NULL when either date is missing)
+    pairs = [(getattr(FreightTrackingData, cfg.StartField), getattr(FreightTrackingData, cfg.EndField))
+             for cfg in intervals]
+    rows = []
+    if pairs:
+        rows = (
+            model.query(
+                FreightTrackingData.Brand,
+                *(func.datediff(literal_column("day"), sf, ef).label(f"d{i}")
+                  for i, (sf, ef) in enumerate(pairs))
             )
+            .filter(
+                FreightTrackingData.Brand.in_(brands),
+                or_(*(and_(sf.isnot(None), ef.isnot(None)) for sf, ef in pairs)),
+                *month_filter(FreightTrackingData.PODate, months),        # PO date
+                *month_filter(FreightTrackingData.CreatedDate, shp_months), # Shipment creation date
+            )
+            .all()
+        )
 
-            # apply month filter if provided
-            if months:
-                q = q.filter(
-                  func.format(FreightTrackingView.PODate,'yyyy-MM')
-                  .in_(months)
-                )
-            
-            # Shipment creation date
-            if shp_months:
-                q = q.filter(
-                  func.format(FreightTrackingView.CreatedDate,'yyyy-MM')
-                  .in_(shp_months)
-                )
-
-            avg_days = q.scalar() or 0
-            row[cfg.IntervalName] = round(avg_days, 1)
-
-        results.append(row)
+    # 3) vectorized group stats per interval
+    # SQL Server compares Brand case/trailing-space insensitively, so match the same way
+    brand_idx = {str(b).strip().lower(): i for i, b in enumerate(brands)}
+    groups = np.fromiter((brand_idx[str(r[0]).strip().lower()] for r in rows), dtype=int, count=len(rows))
+    days   = np.array([tuple(r[1:]) for r in rows], dtype=float).reshape(len(rows), len(intervals))
+
+    def _r(x):
+        return round(float(x), 1) if not np.isnan(x) else 0
+
+    results = [{"brand": b, "stats": {}} for b in brands]
+    for j, cfg in enumerate(intervals):
+        count, mean, (median, p90) = _grouped_stats(groups, days[:, j], len(brands))
+        for i, row in enumerate(results):
+            row[cfg.IntervalName] = _r(mean[i])
+            row["stats"][cfg.IntervalName] = {
+                "n":      int(count[i]),
+                "median": _r(median[i]),
+                "p90":    _r(p90[i]),
+            }
 
     return results
 
@@ -315,11 +430,11 @@ def format_million(value):
         return "<0.01M"
     return f"{round(value / 1_000_000, 2)}M" if value < 10_000_000 else f"{round(value / 1_000_000):.0f}M"
 
-def compute_fulfillment_by_brand(brands=None):
+@cached_aggregate
+def compute_fulfillment_by_brand(brands=None, model=model):
     POL = RFT_PurchaseOrderLine
     SP = RFT_ShipmentPOLine
     PO = RFT_PurchaseOrder
-    SH = RFT_StatusHistory
     C = RFT_Container
 
     shipped_subq = (
@@ -331,31 +446,7 @@ def compute_fulfillment_by_brand(brands=None):
         .subquery()
     )
 
-    latest_status_date_subq = (
-        model.query(
-            SH.EntityID.label("ContainerID"),
-            func.max(SH.StatusDate).label("MaxDate")
-        )
-        .filter(SH.EntityType == 'Container')
-        .group_by(SH.EntityID)
-        .subquery()
-    )
-
-    latest_status_subq = (
-        model.query(
-            SH.EntityID.label("ContainerID"),
-            SH.Status.label("Status")
-        )
-        .join(
-            latest_status_date_subq,
-            and_(
-                SH.EntityID == latest_status_date_subq.c.ContainerID,
-                SH.StatusDate == latest_status_date_subq.c.MaxDate
-            )
-        )
-        .filter(SH.EntityType == 'Container')
-        .subquery()
-    )
+    latest_status_subq = current_status("Container", "ContainerID")
 
     q = (
         model.query(
@@ -440,11 +531,11 @@ def compute_fulfillment_by_brand(brands=None):
 
     return results
 
+@cached_aggregate
 def compute_fulfillment_by_po(pos=None):
     POL = RFT_PurchaseOrderLine
     SP = RFT_ShipmentPOLine
     PO = RFT_PurchaseOrder
-    SH = RFT_StatusHistory
     C = RFT_Container
 
     # Subquery: sum of QtyShipped per POLineID
@@ -458,32 +549,7 @@ def compute_fulfillment_by_po(pos=None):
     )
 
     # Subquery: latest Container Status per ContainerID
-    # Subquery: latest Container Status per ContainerID
-    latest_status_date_subq = (
-        model.query(
-            SH.EntityID.label("ContainerID"),
-            func.max(SH.StatusDate).label("MaxDate")
-        )
-        .filter(SH.EntityType == 'Container')
-        .group_by(SH.EntityID)
-        .subquery()
-    )
-    
-    latest_status_subq = (
-        model.query(
-            SH.EntityID.label("ContainerID"),
-            SH.Status.label("Status")
-        )
-        .join(
-            latest_status_date_subq,
-            and_(
-                SH.EntityID == latest_status_date_subq.c.ContainerID,
-                SH.StatusDate == latest_status_date_subq.c.MaxDate
-            )
-        )
-        .filter(SH.EntityType == 'Container')
-        .subquery()
-    )
+    latest_status_subq = current_status("Container", "ContainerID")
     
 
     # Main query
@@ -604,17 +670,77 @@ def pivot_matrix_to_rows(matrix, plan_groups, container_stages):
 
     return rows
 
+# Dashboard cube (see rollups.py)
+def _use_cube(sel_po=None):
+  """Read container/shipment counts from RFT_DashboardCube? (DASHBOARD_CUBE config switch)
+  The cube has no PO grain, so a single-PO filter always goes to the live tables."""
+  return (has_app_context() and current_app.config.get("DASHBOARD_CUBE", False)
+          and not sel_po)
+
+def _cube_filters(brands=None, months=None, shp_months=None, categories=None, sel_shp=None):
+  K = RFT_DashboardCube
+  return [
+    *( [K.Brand.in_(brands)] if brands else [] ),
+    *month_filter(K.POMonth, months),
+    *month_filter(K.ShpMonth, shp_months),
+    *( [K.CatName.in_(categories)] if categories else [] ),
+    *( [K.ShipmentID.in_(
+          select(RFT_Shipment.ShipmentID).where(or_(
+            RFT_Shipment.ShipmentNumber == sel_shp,
+            RFT_Shipment.BLNumber == sel_shp
+          )))] if sel_shp else [] ),
+  ]
+
+def _cube_container_counts(model, group_cols, *criteria):
+  """
+  Container counts from the cube grouped by `group_cols` (RFT_DashboardCube columns),
+  equivalent to COUNT(DISTINCT ContainerID) on the live joins: a shipment's count
+  repeats on each of its Brand/POMonth/CatName rows, so de-duplicate before summing.
+  Returns [(*group values, count), ...].
+  """
+  K = RFT_DashboardCube
+  keys  = [K.ShipmentID, K.PlanStatus, K.ActualStatus, K.ContainerCount]
+  extra = [c for c in group_cols if c.key not in {k.key for k in keys}]
+  inner = (
+    model.query(*keys, *extra)
+         .filter(K.ContainerCount > 0, *criteria)
+         .distinct()
+         .subquery()
+  )
+  cols = [inner.c[c.key] for c in group_cols]
+  return (
+    model.query(*cols, func.sum(inner.c.ContainerCount).label("ct"))
+         .group_by(*cols)
+         .all()
+  )
+
 def compute_container_plan_stage_counts_grouped(plan_prefixes, mot, brands=None, months=None,
-                                                shp_months=None, categories=None, sel_shp=None, sel_po=None):
+                                                shp_months=None, categories=None, sel_shp=None, sel_po=None, model=None):
     """
     Returns a dict-of-dicts for all containers whose latest planned-status starts with any of plan_prefixes,
     filtered by ModeOfTransport == mot and other optional filters.
     Output: { actual_status: { plan_status: count, ... }, ... }
     Also returns a sorted list of all distinct plan_status values seen.
     """
-    model = None
-    model = Session()
-    S   = RFT_StatusHistory
+    return compute_container_plan_stage_counts_by_mot(
+        plan_prefixes, [mot], brands=brands, months=months, shp_months=shp_months,
+        categories=categories, sel_shp=sel_shp, sel_po=sel_po, model=model
+    )[mot]
+
+def _mot_key(mot):
+    # SQL Server compares ModeOfTransport case-/trailing-space-insensitively; match that in Python
+    return (mot or "").strip().lower()
+
+@cached_aggregate
+def compute_container_plan_stage_counts_by_mot(plan_prefixes, mots, brands=None, months=None,
+                                               shp_months=None, categories=None, sel_shp=None, sel_po=None, model=None):
+    """
+    Same as compute_container_plan_stage_counts_grouped, for several modes of transport
+    in one query (grouped by ModeOfTransport).
+    Output: { mot: (matrix, plan_groups), ... } with an entry for every mot in `mots`.
+    """
+    if model is None:
+        model = Session()
     C   = RFT_Container
     SP  = RFT_ShipmentPOLine
     POL = RFT_PurchaseOrderLine
@@ -622,27 +748,7 @@ def compute_container_plan_stage_counts_grouped(plan_prefixes, mot, brands=None,
     SM  = RFT_StatusManagement
 
     # Step A: Latest planned-container status
-    latest_plan = (
-        model.query(
-            S.EntityID.label("ContainerID"),
-            func.max(S.StatusDate).label("maxdate")
-        )
-        .filter(S.EntityType == literal("Planed-Container"))
-        .group_by(S.EntityID)
-        .subquery()
-    )
-    latest_plan_status = (
-        model.query(
-            latest_plan.c.ContainerID,
-            S.Status.label("plan_status")
-        )
-        .join(S, and_(
-            S.EntityType == literal("Planed-Container"),
-            S.EntityID   == latest_plan.c.ContainerID,
-            S.StatusDate == latest_plan.c.maxdate
-        ))
-        .subquery()
-    )
+    latest_plan_status = current_status("Planed-Container", "ContainerID", "plan_status")
 
     # Step B: Filter plan statuses matching any prefix
     allowed_plan_set = set()
@@ -656,166 +762,183 @@ def compute_container_plan_stage_counts_grouped(plan_prefixes, mot, brands=None,
         allowed_plan_set.update(r[0] for r in results)
 
     if not allowed_plan_set:
-        return {}, []
+        return {m: ({}, []) for m in mots}
 
     # Step C: Latest actual container status
-    latest_act = (
-        model.query(
-            S.EntityID.label("ContainerID"),
-            func.max(S.StatusDate).label("maxdate")
-        )
-        .filter(S.EntityType == literal("Container"))
-        .group_by(S.EntityID)
-        .subquery()
-    )
-    latest_act_status = (
-        model.query(
-            latest_act.c.ContainerID,
-            S.Status.label("act_status")
-        )
-        .join(S, and_(
-            S.EntityType == literal("Container"),
-            S.EntityID   == latest_act.c.ContainerID,
-            S.StatusDate == latest_act.c.maxdate
-        ))
-        .subquery()
-    )
+    latest_act_status = current_status("Container", "ContainerID", "act_status")
 
     # Step D: Join and filter by optional dimensions
-    pairs = (
-        model.query(
-            latest_act_status.c.act_status.label("stage"),
-            latest_plan_status.c.plan_status.label("plan_status"),
-            func.count(func.distinct(latest_act_status.c.ContainerID)).label("ct")
-        )
-        .join(latest_plan_status,
-              latest_act_status.c.ContainerID == latest_plan_status.c.ContainerID)
-        .join(C, C.ContainerID == latest_act_status.c.ContainerID)
-        .join(SP, SP.ShipmentID == C.ShipmentID)
-        .join(RFT_Shipment, RFT_Shipment.ShipmentID == SP.ShipmentID)
-        .join(POL, POL.POLineID == SP.POLineID)
-        .join(PO,  PO.POID == POL.POID)
-        .outerjoin(RFT_CategoriesMappingMain, POL.CategoryMappingID == RFT_CategoriesMappingMain.ID)
-        .filter(
-            latest_plan_status.c.plan_status.in_(allowed_plan_set),
-            RFT_Shipment.ModeOfTransport == mot,
-            *( [PO.Brand.in_(brands)] if brands else [] ),
-            *( [func.format(PO.PODate,'yyyy-MM').in_(months)] if months else [] ),
-            *( [func.format(RFT_Shipment.CreatedDate,'yyyy-MM').in_(shp_months)] if shp_months else [] ),
-            *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else []),
-            *( [or_(
-                RFT_Shipment.ShipmentNumber == sel_shp,
-                RFT_Shipment.BLNumber == sel_shp
-            )] if sel_shp else [] ),
-            *( [PO.POID == sel_po] if sel_po else [] )
+    if _use_cube(sel_po):
+        K = RFT_DashboardCube
+        pairs = _cube_container_counts(
+            model, [K.ModeOfTransport, K.ActualStatus, K.PlanStatus],
+            K.PlanStatus.in_(allowed_plan_set),
+            K.ActualStatus.isnot(None),
+            K.ModeOfTransport.in_(mots),
+            *_cube_filters(brands, months, shp_months, categories, sel_shp),
         )
-        .group_by(
-            latest_act_status.c.act_status,
-            latest_plan_status.c.plan_status
+    else:
+        pairs = (
+            model.query(
+                RFT_Shipment.ModeOfTransport.label("mot"),
+                latest_act_status.c.act_status.label("stage"),
+                latest_plan_status.c.plan_status.label("plan_status"),
+                func.count(func.distinct(latest_act_status.c.ContainerID)).label("ct")
+            )
+            .join(latest_plan_status,
+                  latest_act_status.c.ContainerID == latest_plan_status.c.ContainerID)
+            .join(C, C.ContainerID == latest_act_status.c.ContainerID)
+            .join(SP, SP.ShipmentID == C.ShipmentID)
+            .join(RFT_Shipment, RFT_Shipment.ShipmentID == SP.ShipmentID)
+            .join(POL, POL.POLineID == SP.POLineID)
+            .join(PO,  PO.POID == POL.POID)
+            .outerjoin(RFT_CategoriesMappingMain, POL.CategoryMappingID == RFT_CategoriesMappingMain.ID)
+            .filter(
+                latest_plan_status.c.plan_status.in_(allowed_plan_set),
+                RFT_Shipment.ModeOfTransport.in_(mots),
+                *( [PO.Brand.in_(brands)] if brands else [] ),
+                *month_filter(PO.PODate, months),
+                *month_filter(RFT_Shipment.CreatedDate, shp_months),
+                *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else []),
+                *( [or_(
+                    RFT_Shipment.ShipmentNumber == sel_shp,
+                    RFT_Shipment.BLNumber == sel_shp
+                )] if sel_shp else [] ),
+                *( [PO.POID == sel_po] if sel_po else [] )
+            )
+            .group_by(
+                RFT_Shipment.ModeOfTransport,
+                latest_act_status.c.act_status,
+                latest_plan_status.c.plan_status
+            )
+            .all()
         )
-        .all()
-    )
 
     # Custom preferred order
     priority_order = ["Planed DTC Delivery", "Planed GES-RYD", "Planed LSC-JED", "Planed LSC", "Planed RDC", "Planed JDC"]
 
-    # Fallback for statuses not in priority_order → push to end
-    plan_groups = sorted(
-        { ps for (_, ps, _) in pairs },
-        key=lambda x: priority_order.index(x) if x in priority_order else len(priority_order)
-    )
+    by_mot = defaultdict(list)
+    for m, stage, ps, ct in pairs:
+        by_mot[_mot_key(m)].append((stage, ps, ct))
+
+    out = {}
+    for m in mots:
+        mot_pairs = by_mot.get(_mot_key(m), [])
+        # Fallback for statuses not in priority_order → push to end
+        plan_groups = sorted(
+            { ps for (_, ps, _) in mot_pairs },
+            key=lambda x: priority_order.index(x) if x in priority_order else len(priority_order)
+        )
 
-    # Step E: Pivot result into matrix
-    # plan_groups = sorted({ ps for (st, ps, ct) in pairs }, key=priority_order)
-    matrix     = defaultdict(lambda: defaultdict(int))
-    totals     = defaultdict(int)
-    for stage, ps, ct in pairs:
-        matrix[stage][ps] = ct
-        totals[stage] += ct
+        # Step E: Pivot result into matrix
+        matrix     = defaultdict(lambda: defaultdict(int))
+        for stage, ps, ct in mot_pairs:
+            matrix[stage][ps] = ct
 
-    return matrix, plan_groups
+        out[m] = (matrix, plan_groups)
+
+    return out
 
 
 # Shipment statuses
 def compute_shipment_status_counts(mot, brands=None, months=None, 
-                                   shp_months=None, categories=None, sel_shp=None, sel_po=None):
-  model = None
-  model = Session()
-  S   = RFT_StatusHistory
+                                   shp_months=None, categories=None, sel_shp=None, sel_po=None, model=None):
+  return compute_shipment_status_counts_by_mot(
+    [mot], brands=brands, months=months, shp_months=shp_months,
+    categories=categories, sel_shp=sel_shp, sel_po=sel_po, model=model
+  )[mot]
+
+@cached_aggregate
+def compute_shipment_status_counts_by_mot(mots, brands=None, months=None, 
+                                          shp_months=None, categories=None, sel_shp=None, sel_po=None, model=None):
+  """
+  Shipment counts per latest status for each mode of transport in `mots`, one query.
+  Output: { mot: [{"status", "count"}, ...] } (highest count first).
+  """
+  if model is None:
+    model = Session()
   SP  = RFT_ShipmentPOLine
   POL = RFT_PurchaseOrderLine
   PO  = RFT_PurchaseOrder
 
-  # 1) find each shipment’s max status date
-  latest = (
-    model.query(
-      S.EntityID.label("ShipmentID"),
-      func.max(S.StatusDate).label("maxdate")
-    )
-    .filter(S.EntityType == literal("Shipment"))
-    .group_by(S.EntityID)
-    .subquery("latest")
-  )
-
-  # 2) get the status text at that date
-  latest_status = (
-    model.query(
-      S.EntityID.label("ShipmentID"),
-      S.Status.label("status")
-    )
-    .join(latest,
-          and_(
-            S.EntityType  == literal("Shipment"),
-            S.EntityID    == latest.c.ShipmentID,
-            S.StatusDate  == latest.c.maxdate
-          ))
-    .subquery("latest_status")
-  )
+  # 1) each shipment’s current status
+  latest_status = current_status("Shipment", "ShipmentID", "status")
 
   # 3) join through your PO‐chain, filter by MOT, count DISTINCT shipments
-  q = (
-    model.query(
-      latest_status.c.status,
-      func.count(distinct(latest_status.c.ShipmentID)).label("count")
+  if _use_cube(sel_po):
+    K = RFT_DashboardCube
+    q = (
+      model.query(
+        K.ModeOfTransport,
+        K.ShipmentStatus,
+        func.count(distinct(K.ShipmentID)).label("count")
+      )
+      .filter(
+        K.ShipmentStatus.isnot(None),
+        K.ModeOfTransport.in_(mots),
+        *_cube_filters(brands, months, shp_months, categories, sel_shp),
+      )
+      .group_by(K.ModeOfTransport, K.ShipmentStatus)
+      .order_by(desc("count"))
     )
-    .join(SP, SP.ShipmentID == latest_status.c.ShipmentID)
-    .join(RFT_Shipment, RFT_Shipment.ShipmentID == SP.ShipmentID) #new
-    .join(POL, POL.POLineID   == SP.POLineID)
-    .join(PO,  PO.POID        == POL.POID)
-    .outerjoin(RFT_CategoriesMappingMain, POL.CategoryMappingID == RFT_CategoriesMappingMain.ID) #new
-    # .filter(RFT_Shipment.ModeOfTransport == mot)
-    .filter(
-        RFT_Shipment.ModeOfTransport == mot,
-        *( [PO.Brand.in_(brands)] if brands else [] ),
-        *( [func.format(PO.PODate,'yyyy-MM').in_(months)] if months else [] ),
-        *( [func.format(RFT_Shipment.CreatedDate,'yyyy-MM').in_(shp_months)] if shp_months else [] ),
-        *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else []),
-        # *( [RFT_Shipment.ShipmentNumber == sel_shp] if sel_shp else [] ),
-        *( [or_(
-            RFT_Shipment.ShipmentNumber == sel_shp,
-            RFT_Shipment.BLNumber == sel_shp
-        )] if sel_shp else [] ),
-        *( [PO.POID == sel_po] if sel_po else [] )
+  else:
+    q = (
+      model.query(
+        RFT_Shipment.ModeOfTransport,
+        latest_status.c.status,
+        func.count(distinct(latest_status.c.ShipmentID)).label("count")
+      )
+      .join(SP, SP.ShipmentID == latest_status.c.ShipmentID)
+      .join(RFT_Shipment, RFT_Shipment.ShipmentID == SP.ShipmentID) #new
+      .join(POL, POL.POLineID   == SP.POLineID)
+      .join(PO,  PO.POID        == POL.POID)
+      .outerjoin(RFT_CategoriesMappingMain, POL.CategoryMappingID == RFT_CategoriesMappingMain.ID) #new
+      # .filter(RFT_Shipment.ModeOfTransport == mot)
+      .filter(
+          RFT_Shipment.ModeOfTransport.in_(mots),
+          *( [PO.Brand.in_(brands)] if brands else [] ),
+          *month_filter(PO.PODate, months),
+          *month_filter(RFT_Shipment.CreatedDate, shp_months),
+          *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else []),
+          # *( [RFT_Shipment.ShipmentNumber == sel_shp] if sel_shp else [] ),
+          *( [or_(
+              RFT_Shipment.ShipmentNumber == sel_shp,
+              RFT_Shipment.BLNumber == sel_shp
+          )] if sel_shp else [] ),
+          *( [PO.POID == sel_po] if sel_po else [] )
+      )
+      .group_by(RFT_Shipment.ModeOfTransport, latest_status.c.status)
+      .order_by(desc("count"))
     )
-    .group_by(latest_status.c.status)
-    .order_by(desc("count"))
-  )
 
-  return [{"status": st, "count": ct} for st, ct in q.all()]
+  out = {m: [] for m in mots}
+  requested = {_mot_key(m): m for m in mots}
+  for m, st, ct in q.all():
+    out[requested[_mot_key(m)]].append({"status": st, "count": ct})
+  return out
 
 # Upcoming ETAs calc for DASH
-def compute_upcoming_eta(mot, brands = None, days_ahead: int = 7):
+def compute_upcoming_eta(mot, brands = None, days_ahead: int = 7, model=None):
   """
   Return all shipments whose ETADestination is between now and now+days_ahead,
   for the given ModeOfTransport, ordered by ETADestination ascending.
   """
-  model = None
-  model = Session()
+  return compute_upcoming_eta_by_mot([mot], brands=brands, days_ahead=days_ahead, model=model)[mot]
+
+@cached_aggregate
+def compute_upcoming_eta_by_mot(mots, brands = None, days_ahead: int = 7, model=None):
+  """
+  compute_upcoming_eta for every mode of transport in `mots` from one query.
+  Output: { mot: [rows ordered by ETADestination], ... }
+  """
+  if model is None:
+    model = Session()
   now    = datetime.utcnow()
   cutoff = now + timedelta(days=days_ahead)
 
   q = (
     model.query(
+        RFT_Shipment.ModeOfTransport  .label("mot"),
         RFT_Shipment.ShipmentNumber   .label("shipment"),
         RFT_Shipment.ETADestination   .label("eta"),
         RFT_Shipment.OriginPort       .label("origin_port"),
@@ -838,7 +961,7 @@ def compute_upcoming_eta(mot, brands = None, days_ahead: int = 7):
         RFT_PurchaseOrder.POID == RFT_PurchaseOrderLine.POID
     )
     .filter(
-        RFT_Shipment.ModeOfTransport == mot,
+        RFT_Shipment.ModeOfTransport.in_(mots),
         RFT_Shipment.ETADestination.isnot(None),
         RFT_Shipment.ETADestination >= now,
         RFT_Shipment.ETADestination <= cutoff,
@@ -847,6 +970,7 @@ def compute_upcoming_eta(mot, brands = None, days_ahead: int = 7):
     # include shipments with zero containers
     .outerjoin(RFT_Shipment.containers)
     .group_by(
+        RFT_Shipment.ModeOfTransport,
         RFT_Shipment.ShipmentNumber,
         RFT_Shipment.ETADestination,
         RFT_Shipment.OriginPort,
@@ -858,26 +982,28 @@ def compute_upcoming_eta(mot, brands = None, days_ahead: int = 7):
   )
   
 
-  return [
-      {
-          "shipment":      shp,
-          "eta":           eta,
-          "origin_port":   op,
-          "containers_num":cn,
-          "dest_country":  dc,
-          "BL":            bl,
-          "Brand":         br
-      }
-      for shp, eta, op, cn, dc, bl, br in q.all()
-  ]
+  out = {m: [] for m in mots}
+  requested = {_mot_key(m): m for m in mots}
+  for m, shp, eta, op, cn, dc, bl, br in q.all():
+    out[requested[_mot_key(m)]].append({
+        "shipment":      shp,
+        "eta":           eta,
+        "origin_port":   op,
+        "containers_num":cn,
+        "dest_country":  dc,
+        "BL":            bl,
+        "Brand":         br
+    })
+  return out
 
 # By Brand x Warehouse shipment statuses
-def compute_plan_status_by_brand(plan_prefixes, brands=None, months=None, categories=None, shp_months=None, sel_shp=None, sel_po=None):
+@cached_aggregate
+def compute_plan_status_by_brand(plan_prefixes, brands=None, months=None, categories=None, shp_months=None, sel_shp=None, sel_po=None, model=None):
     """
     Returns a matrix of the form: { plan_status: { brand: count, ... }, ... }
     """
-    model = Session()
-    S   = RFT_StatusHistory
+    if model is None:
+        model = Session()
     C   = RFT_Container
     SP  = RFT_ShipmentPOLine
     POL = RFT_PurchaseOrderLine
@@ -885,39 +1011,10 @@ def compute_plan_status_by_brand(plan_prefixes, brands=None, months=None, catego
     SM  = RFT_StatusManagement
 
     # Step A: Latest planned-container status
-    latest_plan = (
-        model.query(S.EntityID.label("ContainerID"), func.max(S.StatusDate).label("maxdate"))
-        .filter(S.EntityType == literal("Planed-Container"))
-        .group_by(S.EntityID)
-        .subquery()
-    )
-    latest_plan_status = (
-        model.query(latest_plan.c.ContainerID, S.Status.label("plan_status"))
-        .join(S, and_(
-            S.EntityType == literal("Planed-Container"),
-            S.EntityID   == latest_plan.c.ContainerID,
-            S.StatusDate == latest_plan.c.maxdate
-        ))
-        .subquery()
-    )
+    latest_plan_status = current_status("Planed-Container", "ContainerID", "plan_status")
 
     # ✅ Step B: Latest *actual* container status (we'll filter for "Delivered" here)
-    latest_actual = (
-        model.query(S.EntityID.label("ContainerID"), func.max(S.StatusDate).label("maxdate"))
-        .filter(S.EntityType == literal("Container"))
-        .group_by(S.EntityID)
-        .subquery()
-    )
-    latest_actual_status = (
-        model.query(latest_actual.c.ContainerID, S.Status.label("actual_status"))
-        .join(S, and_(
-            S.EntityType == literal("Container"),
-            S.EntityID   == latest_actual.c.ContainerID,
-            S.StatusDate == latest_actual.c.maxdate
-        ))
-        .filter(S.Status.in_(DELIVERED_STATUSES))  # ✅ Filter only Delivered containers
-        .subquery()
-    )
+    latest_actual_status = current_status("Container", "ContainerID", "actual_status")
     
     # Step B: Get allowed planned statuses
     allowed_plan_set = set()
@@ -932,35 +1029,47 @@ def compute_plan_status_by_brand(plan_prefixes, brands=None, months=None, catego
 
 
     # Step D: Join and filter by optional dimensions
-    pairs = (
-        model.query(
-            latest_plan_status.c.plan_status,
-            PO.Brand,
-            func.count(func.distinct(C.ContainerID)).label("ct")
+    if _use_cube(sel_po):
+        K = RFT_DashboardCube
+        pairs = _cube_container_counts(
+            model, [K.PlanStatus, K.Brand],
+            K.PlanStatus.in_(allowed_plan_set),
+            K.ActualStatus.in_(DELIVERED_STATUSES),  # ✅ only Delivered containers
+            *_cube_filters(brands, months, shp_months, categories, sel_shp),
         )
-        .join(latest_actual_status, latest_actual_status.c.ContainerID == latest_plan_status.c.ContainerID)
-        .join(C, C.ContainerID == latest_plan_status.c.ContainerID)
-        .join(SP, SP.ShipmentID == C.ShipmentID)
-        .join(RFT_Shipment, RFT_Shipment.ShipmentID == SP.ShipmentID)
-        .join(POL, POL.POLineID == SP.POLineID)
-        .join(PO,  PO.POID == POL.POID)
-        .outerjoin(RFT_CategoriesMappingMain, POL.CategoryMappingID == RFT_CategoriesMappingMain.ID)
-        .filter(
-            latest_plan_status.c.plan_status.in_(allowed_plan_set),
-            # RFT_Shipment.ModeOfTransport == mot,
-            *( [PO.Brand.in_(brands)] if brands else [] ),
-            *( [func.format(PO.PODate,'yyyy-MM').in_(months)] if months else [] ),
-            *( [func.format(RFT_Shipment.CreatedDate,'yyyy-MM').in_(shp_months)] if shp_months else [] ),
-            *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else []),
-            *( [or_(
-                RFT_Shipment.ShipmentNumber == sel_shp,
-                RFT_Shipment.BLNumber == sel_shp
-            )] if sel_shp else [] ),
-            *( [PO.POID == sel_po] if sel_po else [] )
+    else:
+        pairs = (
+            model.query(
+                latest_plan_status.c.plan_status,
+                PO.Brand,
+                func.count(func.distinct(C.ContainerID)).label("ct")
+            )
+            .join(latest_actual_status, and_(
+                latest_actual_status.c.ContainerID == latest_plan_status.c.ContainerID,
+                latest_actual_status.c.actual_status.in_(DELIVERED_STATUSES)  # ✅ only Delivered containers
+            ))
+            .join(C, C.ContainerID == latest_plan_status.c.ContainerID)
+            .join(SP, SP.ShipmentID == C.ShipmentID)
+            .join(RFT_Shipment, RFT_Shipment.ShipmentID == SP.ShipmentID)
+            .join(POL, POL.POLineID == SP.POLineID)
+            .join(PO,  PO.POID == POL.POID)
+            .outerjoin(RFT_CategoriesMappingMain, POL.CategoryMappingID == RFT_CategoriesMappingMain.ID)
+            .filter(
+                latest_plan_status.c.plan_status.in_(allowed_plan_set),
+                # RFT_Shipment.ModeOfTransport == mot,
+                *( [PO.Brand.in_(brands)] if brands else [] ),
+                *month_filter(PO.PODate, months),
+                *month_filter(RFT_Shipment.CreatedDate, shp_months),
+                *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else []),
+                *( [or_(
+                    RFT_Shipment.ShipmentNumber == sel_shp,
+                    RFT_Shipment.BLNumber == sel_shp
+                )] if sel_shp else [] ),
+                *( [PO.POID == sel_po] if sel_po else [] )
+            )
+            .group_by(latest_plan_status.c.plan_status, PO.Brand)
+            .all()
         )
-        .group_by(latest_plan_status.c.plan_status, PO.Brand)
-        .all()
-    )
 
     # Step E: Pivot
     matrix = defaultdict(lambda: defaultdict(int))
@@ -1010,13 +1119,14 @@ def compute_plan_status_by_brand(plan_prefixes, brands=None, months=None, catego
     return table_data, brand_cols
 
 # POD x Brand
-def compute_pod_by_brand_only_delivered(brands=None, months=None, categories=None, shp_months=None, sel_shp=None, sel_po=None):
+@cached_aggregate
+def compute_pod_by_brand_only_delivered(brands=None, months=None, categories=None, shp_months=None, sel_shp=None, sel_po=None, model=None):
     """
     Returns a matrix of the form: { POD: { brand: count, ... }, ... }
     Only includes containers whose latest actual status is in DELIVERED_STATUSES and POD is not null.
     """
-    model = Session()
-    S   = RFT_StatusHistory
+    if model is None:
+        model = Session()
     C   = RFT_Container
     SP  = RFT_ShipmentPOLine
     POL = RFT_PurchaseOrderLine
@@ -1024,52 +1134,48 @@ def compute_pod_by_brand_only_delivered(brands=None, months=None, categories=Non
     SHP = RFT_Shipment
 
     # Step A: Latest actual container status
-    latest_actual = (
-        model.query(S.EntityID.label("ContainerID"), func.max(S.StatusDate).label("maxdate"))
-        .filter(S.EntityType == literal("Container"))
-        .group_by(S.EntityID)
-        .subquery()
-    )
-
-    latest_actual_status = (
-        model.query(latest_actual.c.ContainerID, S.Status.label("actual_status"))
-        .join(S, and_(
-            S.EntityType == literal("Container"),
-            S.EntityID   == latest_actual.c.ContainerID,
-            S.StatusDate == latest_actual.c.maxdate
-        ))
-        .filter(S.Status.in_(DELIVERED_STATUSES))
-        .subquery()
-    )
+    latest_actual_status = current_status("Container", "ContainerID", "actual_status")
 
     # Step B: Join and filter
-    pairs = (
-        model.query(
-            SHP.POD,
-            PO.Brand,
-            func.count(func.distinct(C.ContainerID)).label("ct")
+    if _use_cube(sel_po):
+        K = RFT_DashboardCube
+        pairs = _cube_container_counts(
+            model, [K.POD, K.Brand],
+            K.POD.isnot(None),
+            K.ActualStatus.in_(DELIVERED_STATUSES),
+            *_cube_filters(brands, months, shp_months, categories, sel_shp),
         )
-        .join(latest_actual_status, latest_actual_status.c.ContainerID == C.ContainerID)
-        .join(SP, SP.ShipmentID == C.ShipmentID)
-        .join(SHP, SHP.ShipmentID == SP.ShipmentID)
-        .join(POL, POL.POLineID == SP.POLineID)
-        .join(PO, PO.POID == POL.POID)
-        .outerjoin(RFT_CategoriesMappingMain, POL.CategoryMappingID == RFT_CategoriesMappingMain.ID)
-        .filter(
-            SHP.POD.isnot(None),
-            *( [PO.Brand.in_(brands)] if brands else [] ),
-            *( [func.format(PO.PODate,'yyyy-MM').in_(months)] if months else [] ),
-            *( [func.format(SHP.CreatedDate,'yyyy-MM').in_(shp_months)] if shp_months else [] ),
-            *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else [] ),
-            *( [or_(
-                SHP.ShipmentNumber == sel_shp,
-                SHP.BLNumber == sel_shp
-            )] if sel_shp else [] ),
-            *( [PO.POID == sel_po] if sel_po else [] )
+    else:
+        pairs = (
+            model.query(
+                SHP.POD,
+                PO.Brand,
+                func.count(func.distinct(C.ContainerID)).label("ct")
+            )
+            .join(latest_actual_status, and_(
+                latest_actual_status.c.ContainerID == C.ContainerID,
+                latest_actual_status.c.actual_status.in_(DELIVERED_STATUSES)
+            ))
+            .join(SP, SP.ShipmentID == C.ShipmentID)
+            .join(SHP, SHP.ShipmentID == SP.ShipmentID)
+            .join(POL, POL.POLineID == SP.POLineID)
+            .join(PO, PO.POID == POL.POID)
+            .outerjoin(RFT_CategoriesMappingMain, POL.CategoryMappingID == RFT_CategoriesMappingMain.ID)
+            .filter(
+                SHP.POD.isnot(None),
+                *( [PO.Brand.in_(brands)] if brands else [] ),
+                *month_filter(PO.PODate, months),
+                *month_filter(SHP.CreatedDate, shp_months),
+                *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else [] ),
+                *( [or_(
+                    SHP.ShipmentNumber == sel_shp,
+                    SHP.BLNumber == sel_shp
+                )] if sel_shp else [] ),
+                *( [PO.POID == sel_po] if sel_po else [] )
+            )
+            .group_by(SHP.POD, PO.Brand)
+            .all()
         )
-        .group_by(SHP.POD, PO.Brand)
-        .all()
-    )
 
     # Step C: Pivot into table
     matrix = defaultdict(lambda: defaultdict(int))
@@ -1096,7 +1202,8 @@ def compute_pod_by_brand_only_delivered(brands=None, months=None, categories=Non
     return table_data, brand_cols
 
 # ATA-Wh x Month
-def compute_monthly_dtc_vs_total(plan_prefixes, brands=None, months=None, categories=None, shp_months=None, sel_shp=None, sel_po=None):
+@cached_aggregate
+def compute_monthly_dtc_vs_total(plan_prefixes, brands=None, months=None, categories=None, shp_months=None, sel_shp=None, sel_po=None, model=None):
     """
     Returns a matrix:
         {
@@ -1104,8 +1211,8 @@ def compute_monthly_dtc_vs_total(plan_prefixes, brands=None, months=None, catego
             "Total (excluding DTC)": { "2025-01": 10, "2025-02": 5, ... }
         }
     """
-    model = Session()
-    S = RFT_StatusHistory
+    if model is None:
+        model = Session()
     C = RFT_Container
     SP = RFT_ShipmentPOLine
     POL = RFT_PurchaseOrderLine
@@ -1114,41 +1221,10 @@ def compute_monthly_dtc_vs_total(plan_prefixes, brands=None, months=None, catego
     SHP = RFT_Shipment
 
     # Get latest planned-container statuses
-    latest_plan = (
-        model.query(S.EntityID.label("ContainerID"), func.max(S.StatusDate).label("maxdate"))
-        .filter(S.EntityType == literal("Planed-Container"))
-        .group_by(S.EntityID)
-        .subquery()
-    )
-
-    latest_plan_status = (
-        model.query(latest_plan.c.ContainerID, S.Status.label("plan_status"))
-        .join(S, and_(
-            S.EntityType == literal("Planed-Container"),
-            S.EntityID == latest_plan.c.ContainerID,
-            S.StatusDate == latest_plan.c.maxdate
-        ))
-        .subquery()
-    )
+    latest_plan_status = current_status("Planed-Container", "ContainerID", "plan_status")
 
     # Step A: Latest actual container status
-    latest_actual = (
-        model.query(S.EntityID.label("ContainerID"), func.max(S.StatusDate).label("maxdate"))
-        .filter(S.EntityType == literal("Container"))
-        .group_by(S.EntityID)
-        .subquery()
-    )
-
-    latest_actual_status = (
-        model.query(latest_actual.c.ContainerID, S.Status.label("actual_status"))
-        .join(S, and_(
-            S.EntityType == literal("Container"),
-            S.EntityID   == latest_actual.c.ContainerID,
-            S.StatusDate == latest_actual.c.maxdate
-        ))
-        .filter(S.Status.in_(DELIVERED_STATUSES))
-        .subquery()
-    )
+    latest_actual_status = current_status("Container", "ContainerID", "actual_status")
     
     # Get allowed plan statuses
     allowed_plan_set = set()
@@ -1170,7 +1246,10 @@ def compute_monthly_dtc_vs_total(plan_prefixes, brands=None, months=None, catego
             func.count(func.distinct(C.ContainerID))
         )
         .join(latest_plan_status, latest_plan_status.c.ContainerID == C.ContainerID)
-        .join(latest_actual_status, latest_actual_status.c.ContainerID == C.ContainerID)
+        .join(latest_actual_status, and_(
+            latest_actual_status.c.ContainerID == C.ContainerID,
+            latest_actual_status.c.actual_status.in_(DELIVERED_STATUSES)
+        ))
         # .join(latest_plan_status, latest_plan_status.c.ContainerID == C.ContainerID)
         .join(SP, SP.ShipmentID == C.ShipmentID)
         .join(POL, POL.POLineID == SP.POLineID)
@@ -1181,8 +1260,8 @@ def compute_monthly_dtc_vs_total(plan_prefixes, brands=None, months=None, catego
             latest_plan_status.c.plan_status.in_(allowed_plan_set),
             C.ATAWH != None,
             *( [PO.Brand.in_(brands)] if brands else [] ),
-            *( [func.format(PO.PODate,'yyyy-MM').in_(months)] if months else [] ),
-            *( [func.format(SHP.CreatedDate,'yyyy-MM').in_(shp_months)] if shp_months else [] ),
+            *month_filter(PO.PODate, months),
+            *month_filter(SHP.CreatedDate, shp_months),
             *( [RFT_CategoriesMappingMain.CatName.in_(categories)] if categories else [] ),
             *( [or_(
                 SHP.ShipmentNumber == sel_shp,
@@ -1310,36 +1389,17 @@ def generate_unique_shipment_number():
         if not exists:
             return shipment_number
 
-def export_to_excel(sheet_name, table_view): # Function to export to excel with formating
-    # Create a workbook and worksheet
-    df = pd.DataFrame.from_dict(table_view)
-    wb = Workbook()
-    ws = wb.active
-
-    # Add the table headers from the DataFrame columns
-    header = df.columns.tolist()
-    ws.append(header)
-
-    # Apply formatting to the table headers
-    bold_font = Font(bold=True)
-    all_borders = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    center_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-
-    for cell in ws[1]:
-        cell.font = bold_font
-        cell.border = all_borders
-        cell.alignment = center_alignment
-
-    for row in df.itertuples(index=False):
-        ws.append(row)
-
-    # Save the workbook to a BytesIO object
-    excel_file = BytesIO()
-    wb.save(excel_file)
-    excel_file.seek(0)
-
-    # Return the Excel file as a response
-    return send_file(excel_file, mimetype='application/vnd.ms-excel', as_attachment=True, download_name=f"{sheet_name}.xlsx")
+def export_to_excel(sheet_name, table_view, columns=None): # Function to export to excel with formating
+    """
+    Stream `table_view` (an iterable of dicts / row mappings) as
+    <sheet_name>.xlsx. `columns` defaults to the keys of the first row.
+    """
+    table_view = iter(table_view)
+    if columns is None:
+        first      = next(table_view, None)
+        columns    = list(first.keys()) if first is not None else []
+        table_view = itertools.chain([first] if first is not None else [], table_view)
+    return xlsx_response(table_view, list(columns), f"{sheet_name}.xlsx")
 
 def etl_purchase_orders(batch_id):
   # preload brand & category maps
@@ -1439,6 +1499,7 @@ def fetch_expense_data(brands=None, start_date=None, end_date=None):
     PO      = RFT_PurchaseOrder
     POLine  = RFT_PurchaseOrderLine
     CatMap  = RFT_CategoriesMappingMain
+    LC      = RFT_LandedCost        # each line's share of its shipment's costs
 
     # ── A) Latest delivery date per Shipment ─────────────────────────────
     latest = (
@@ -1454,40 +1515,6 @@ def fetch_expense_data(brands=None, start_date=None, end_date=None):
       .subquery()
     )
 
-    # B) shipment-level aggregates: total_cost & total_qty
-    total_cost = (
-        func.coalesce(func.sum(SH.FreightCost),               0) +
-        func.coalesce(func.sum(SH.CustomDuties),              0) +
-        func.coalesce(func.sum(SH.SaberSADDAD),               0) +
-        func.coalesce(func.sum(SH.DemurrageCharges),          0) +
-        func.coalesce(func.sum(SH.Penalties),                 0) +
-        func.coalesce(func.sum(SH.OtherCharges),              0) +
-        func.coalesce(func.sum(SH.YardCharges),               0) +
-        func.coalesce(func.sum(SH.ClearanceTransportCharges), 0) +
-        func.coalesce(func.sum(SH.DO_Port_Charges),           0) +
-        func.coalesce(func.sum(SH.MAWANICharges),             0) +
-        func.coalesce(func.sum(SH.InspectionCharges),         0)
-    ).label("total_cost")
-
-    shipment_costs = (
-      model.query(
-        SH.ShipmentID,
-        total_cost,
-        func.sum(SP.QtyShipped).label("total_qty"),
-        latest.c.delivery_date
-      )
-      .join(latest, latest.c.ShipmentID == SH.ShipmentID)
-      .join(SP,      SP.ShipmentID    == SH.ShipmentID)
-      .group_by(SH.ShipmentID, latest.c.delivery_date)
-      .subquery()
-    )
-
-    # expense_per_unit = total_cost / total_qty
-    expense_per_unit = (
-      (shipment_costs.c.total_cost / 
-       func.nullif(shipment_costs.c.total_qty, 0))
-    ).label("expense_per_unit")
-
     # ── C) Category expression for PO lines ──────────────────────────────
     # If SubCat exists, concat; else just CatName
     cat1 = func.coalesce(CatMap.CatDesc, literal(""))
@@ -1508,52 +1535,127 @@ def fetch_expense_data(brands=None, start_date=None, end_date=None):
         cat_expr,
         POLine.Article.label("article"),
         SH.ShipmentNumber.label("shipment"),
-        shipment_costs.c.delivery_date,
-        # total expense for this article = qty_shipped × expense_per_unit
-        (SP.QtyShipped * expense_per_unit).label("total_expense")
+        latest.c.delivery_date,
+        # total expense for this article = its allocated share of the shipment's costs
+        LC.TotalCost.label("total_expense")
       )
       .join(POLine, PO.POID == POLine.POID)
       .outerjoin(CatMap,
                  POLine.CategoryMappingID == CatMap.ID)
       .join(SP, POLine.POLineID == SP.POLineID)
-      .join(shipment_costs,
-            shipment_costs.c.ShipmentID == SP.ShipmentID)
-      .join(SH, SH.ShipmentID == shipment_costs.c.ShipmentID)
+      .join(LC, LC.ShipmentPOLineID == SP.ShipmentPOLineID)
+      .join(latest, latest.c.ShipmentID == SP.ShipmentID)
+      .join(SH, SH.ShipmentID == SP.ShipmentID)
     )
 
     # F) apply filters
     if brands:
         q = q.filter(PO.Brand.in_(brands))
     if start_date:
-        q = q.filter(shipment_costs.c.delivery_date >= start_date)
+        q = q.filter(latest.c.delivery_date >= start_date)
     if end_date:
-        q = q.filter(shipment_costs.c.delivery_date <= end_date)
+        q = q.filter(latest.c.delivery_date <= end_date)
 
     # G) materialize
     return [
       ExpenseRow(*row)
       for row in q.order_by(
         PO.Brand, cat_expr, POLine.Article,
-        shipment_costs.c.delivery_date
+        latest.c.delivery_date
       ).all()
     ]
 
-def build_expense_columns(rows):
+# date buckets for the expense pivot's columns: name -> (pandas period, column label format)
+EXPENSE_BUCKETS = {
+    "week":    ("W", "Week ending %Y-%m-%d"),
+    "month":   ("M", "%Y-%m"),
+    "quarter": ("Q", "%Y-Q%q"),
+    "year":    ("Y", "%Y"),
+}
+EXPENSE_KEY_COLS = ["brand", "cat", "article"]
+EXPENSE_OTHER    = "Other"      # column the shipments / buckets beyond top_n are summed into
+
+# the pivot in coordinate form: `keys` (brand / cat / article per pivot row, in
+# that order), column `labels`, and one (row, col, value) triple per non-empty
+# cell, sorted by row then column
+ExpensePivot = namedtuple("ExpensePivot", ["keys", "labels", "row", "col", "value"])
+
+def pivot_expenses(rows, top_n=None, bucket=None):
     """
-    Pivot the flat list of ExpenseRow into a wide table:
-      [brand, cat, article, 'SHIP# (YYYY-MM-DD)', ...]
+    Pivot ExpenseRows to (brand, cat, article) x shipment, summing the expense
+    of every line that lands in the same cell. Rows and columns are integer
+    codes (sorted categoricals), cells are only kept where an article had a
+    line, so the work grows with the number of lines, not rows x columns.
+    bucket -- > None: one column per shipment, 'SHIP# (YYYY-MM-DD)', by delivery date;
+                a key of EXPENSE_BUCKETS: one column per period of the delivery date
+    top_n  -- > keep the top_n columns with the highest total, sum the rest into EXPENSE_OTHER
     """
-    pivot = defaultdict(lambda: {"brand":None, "cat":None, "article":None})
-    for r in rows:
-        key = (r.brand, r.cat, r.article)
-        grp = pivot[key]
-        grp["brand"], grp["cat"], grp["article"] = r.brand, r.cat, r.article
-
-        date_str = r.delivery_date.strftime("%Y-%m-%d") if r.delivery_date else "Unknown"
-        col_name = f"{r.shipment} ({date_str})"
-        grp[col_name] = float(r.total_expense or 0)
+    df = pd.DataFrame(rows, columns=ExpenseRow._fields)
+    if df.empty:
+        empty = np.array([], dtype=int)
+        return ExpensePivot(pd.DataFrame(columns=EXPENSE_KEY_COLS), [], empty, empty, np.array([]))
+
+    amount = df["total_expense"].astype(float).fillna(0).to_numpy()
+
+    # 1) row codes: brand / cat / article codes raveled into one sortable code
+    cats  = [pd.Categorical(df[c].fillna("")) for c in EXPENSE_KEY_COLS]
+    sizes = [len(c.categories) for c in cats]
+    uniq, row = np.unique(np.ravel_multi_index([c.codes for c in cats], sizes), return_inverse=True)
+    keys = pd.DataFrame({
+        name: c.categories[codes]
+        for name, c, codes in zip(EXPENSE_KEY_COLS, cats, np.unravel_index(uniq, sizes))
+    })
+
+    # 2) column codes: shipments or date buckets, in date order
+    dates = pd.to_datetime(df["delivery_date"])
+    if bucket:
+        freq, fmt = EXPENSE_BUCKETS[bucket]
+        periods   = dates.dt.to_period(freq)
+        order_key = periods.dt.start_time
+        labels    = periods.dt.strftime(fmt).fillna("Unknown")
+    else:
+        order_key = dates
+        labels    = df["shipment"].astype(str) + " (" + dates.dt.strftime("%Y-%m-%d").fillna("Unknown") + ")"
+    order = (
+        pd.DataFrame({"key": order_key, "label": labels})
+        .sort_values(["key", "label"], na_position="last")["label"]
+        .drop_duplicates()
+    )
+    col    = pd.Categorical(labels, categories=order).codes
+    labels = list(order)
+
+    # 3) optional top-N columns, the rest folded into one
+    if top_n and len(labels) > top_n:
+        totals = np.bincount(col, weights=amount, minlength=len(labels))
+        keep   = np.sort(np.argsort(-totals, kind="stable")[:top_n])
+        remap  = np.full(len(labels), top_n)
+        remap[keep] = np.arange(top_n)
+        col    = remap[col]
+        labels = [labels[i] for i in keep] + [EXPENSE_OTHER]
+
+    # 4) sum into cells; flat codes sort by row, then column
+    cells, idx = np.unique(row * len(labels) + col, return_inverse=True)
+    value      = np.bincount(idx, weights=amount)
+    cell_row, cell_col = np.divmod(cells, len(labels))
+    return ExpensePivot(keys, labels, cell_row, cell_col, value)
+
+def build_expense_columns(rows, top_n=None, bucket=None, offset=0, limit=None):
+    """
+    One page of the wide expense table (see pivot_expenses):
+      rows [brand, cat, article, 'SHIP# (YYYY-MM-DD)' or bucket, ...] for
+      pivot rows offset .. offset+limit (all with limit None), shipment keys
+      only where the article has a cell; columns: brand / cat / article and
+      every shipment / bucket column used on the page, in pivot order.
+    Returns (rows, columns, total number of pivot rows).
+    """
+    pv    = pivot_expenses(rows, top_n=top_n, bucket=bucket)
+    total = len(pv.keys)
+    stop  = total if limit is None else min(total, offset + limit)
 
-    wide_rows = list(pivot.values())
+    wide_rows = pv.keys.iloc[offset:stop].to_dict("records")
+    lo, hi    = np.searchsorted(pv.row, [offset, stop])
+    for r, c, v in zip(pv.row[lo:hi], pv.col[lo:hi], pv.value[lo:hi]):
+        wide_rows[r - offset][pv.labels[c]] = float(v)
 
     # build column metadata
     columns = [
@@ -1561,21 +1663,14 @@ def build_expense_columns(rows):
       {"name":"cat",     "label":"Category", "type":"String"},
       {"name":"article", "label":"Article",  "type":"String"},
     ]
-
-    if wide_rows:
-      # any extra keys beyond brand/cat/article are shipment columns
-      shipment_cols = sorted(
-        k for k in wide_rows[0].keys()
-        if k not in {"brand","cat","article"}
-      )
-      for col in shipment_cols:
+    for c in np.unique(pv.col[lo:hi]):
         columns.append({
-          "name":  col,
-          "label": col,
+          "name":  pv.labels[c],
+          "label": pv.labels[c],
           "type":  "Numeric"
         })
 
-    return wide_rows, columns
+    return wide_rows, columns, total
 
 def export_shipment_expense_report(shipment_id=None):
   """
@@ -1585,292 +1680,101 @@ def export_shipment_expense_report(shipment_id=None):
   """
   # 1) discover your cost columns
   cost_cols = cost_columns()  # e.g. ["FreightCost", "CustomDuties", …]
+  LC = RFT_LandedCost
 
-  # 1) one SUM() per cost column, labeled with its own name
-  sum_exprs = [
-      func.coalesce(func.sum(getattr(RFT_Shipment, col)), 0).label(col)
-      for col in cost_cols
-  ]
-
-  # 2) build TotalExpense by SQL-adding *those* labeled sums
-  #    reduce(add, sum_exprs) → e.g. "FreightCost + CustomDuties + …"
-  total_expr = reduce(add, sum_exprs).label("TotalExpense")
-
-  # 3) ship-level subquery now becomes
-  ship_tot = (
+  # 2) one row per shipment PO line, costs already allocated by RFT_LandedCost
+  q = (
     model.query(
-      RFT_Shipment.ShipmentID,
-      RFT_Shipment.ShipmentNumber,
       RFT_Shipment.BLNumber,
-      RFT_PurchaseOrder.Brand.label("Brand"),
-      *sum_exprs,
-      total_expr
-    )
-    .join(RFT_ShipmentPOLine,   RFT_ShipmentPOLine.ShipmentID == RFT_Shipment.ShipmentID)
-    .join(RFT_PurchaseOrderLine, RFT_PurchaseOrderLine.POLineID == RFT_ShipmentPOLine.POLineID)
-    .join(RFT_PurchaseOrder,     RFT_PurchaseOrder.POID   == RFT_PurchaseOrderLine.POID)
-    .group_by(
-      RFT_Shipment.ShipmentID,
       RFT_Shipment.ShipmentNumber,
-      RFT_Shipment.BLNumber,
-      RFT_PurchaseOrder.Brand,
-      *[getattr(RFT_Shipment, col) for col in cost_cols]
-    )
-    .subquery()
-  )
-  # 5) total shipped quantity per shipment
-  qty_tot = (
-    model.query(
-      RFT_ShipmentPOLine.ShipmentID,
-      func.coalesce(func.sum(RFT_ShipmentPOLine.QtyShipped), 0).label("ShipmentQty")
-    )
-    .group_by(RFT_ShipmentPOLine.ShipmentID)
-    .subquery()
-  )
-
-  # 6) line-level join
-  q = (
-    model.query(
-      ship_tot.c.ShipmentNumber,
-      ship_tot.c.Brand,
-      ship_tot.c.BLNumber,
+      RFT_PurchaseOrder.Brand.label("Brand"),
       RFT_PurchaseOrder.PONumber,
       RFT_PurchaseOrderLine.SapItemLine.label("SAPLineItem"),
       RFT_PurchaseOrderLine.Article,
-      RFT_ShipmentPOLine.QtyShipped,
-      *[ship_tot.c[col] for col in cost_cols],
-      ship_tot.c.TotalExpense,
-      qty_tot.c.ShipmentQty
+      LC.QtyShipped,
+      *[getattr(LC, col).label(col + "PerArticle") for col in cost_cols],
+      LC.TotalCost.label("TotalExpensePerArticle"),
     )
-    .join( RFT_Shipment,          RFT_Shipment.ShipmentID == ship_tot.c.ShipmentID )
-    .join( RFT_ShipmentPOLine,    RFT_ShipmentPOLine.ShipmentID == ship_tot.c.ShipmentID )
+    .select_from(LC)
+    .join( RFT_Shipment,          RFT_Shipment.ShipmentID == LC.ShipmentID )
+    .join( RFT_ShipmentPOLine,    RFT_ShipmentPOLine.ShipmentPOLineID == LC.ShipmentPOLineID )
     .join( RFT_PurchaseOrderLine, RFT_ShipmentPOLine.POLineID == RFT_PurchaseOrderLine.POLineID )
     .join( RFT_PurchaseOrder,     RFT_PurchaseOrderLine.POID == RFT_PurchaseOrder.POID )
-    .join( qty_tot,               qty_tot.c.ShipmentID == ship_tot.c.ShipmentID )
   )
   if shipment_id:
-      q = q.filter(ship_tot.c.ShipmentID.in_(shipment_id))
+      q = q.filter(LC.ShipmentID.in_(shipment_id))
 
   rows = q.all()
 
-  # 7) to DataFrame
+  # 3) to DataFrame
   df = pd.DataFrame([r._asdict() for r in rows])
   
   cost_cols.append("TotalExpense") # Add this in the last. will find a batter solution
   
-  # 8) compute per-article prorated cost columns
+  # 4) round the per-article cost columns
   for col in cost_cols:
       per_col = col + "PerArticle"
-      df[per_col] = (
-          (df[col] / df["ShipmentQty"]).astype(float) * df["QtyShipped"].astype(float)
-      ).fillna(0).round(2)
+      df[per_col] = df[per_col].astype(float).fillna(0).round(2)
 
-  # 9) select only the final columns
+  # 5) select only the final columns
   out_cols = (
     ["BLNumber","ShipmentNumber","Brand","PONumber","SAPLineItem","Article","QtyShipped"]
     + [c + "PerArticle" for c in cost_cols]
   )
   df = df[out_cols]
 
-  # 10) write the Excel (same as before)
-  output = BytesIO()
-  with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-      sheet = "ArticleExp"
-      df.to_excel(writer, sheet_name=sheet, index=False, startrow=1)
-
-      wb = writer.book
-      ws = writer.sheets[sheet]
-
-      # write the totals row in row 0
-      ws.write(0, 0, f"Brand: {df['Brand'].iat[0]}")
-      ws.write(0, 6, f"TotalQty: {df['QtyShipped'].sum()}")
-      col_idx = 7
-      for c in cost_cols:
-          total = df[c + "PerArticle"].sum()
-          ws.write(0, col_idx, f"Total: {total:.2f}")
-          col_idx += 1
-
-      # adjust column widths
-      widths = {"A":15,"B":15,"C":12,"D":12,"E":12,"F":15,"G":10}
-      for i, _ in enumerate(cost_cols, start=7):
-          widths[chr(65 + i)] = 18
-      for col, w in widths.items():
-          ws.set_column(f"{col}:{col}", w)
-
-  output.seek(0)
-  # return send_file(
-  #     output,
-  #     as_attachment=True,
-  #     download_name="Shipment_expense_report.xlsx",
-  #     mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-  # )
-  
-  resp = make_response(send_file(
-      output,
-      mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-      as_attachment=True,
-      download_name='shipments.xlsx'
-  ))
+  # 6) write the Excel: a totals row above the header
+  money_cols = [c + "PerArticle" for c in cost_cols]
+  totals = (
+    [f"Brand: {df['Brand'].iat[0]}", None, None, None, None, None, f"TotalQty: {df['QtyShipped'].sum()}"]
+    + [f"Total: {df[c].sum():.2f}" for c in money_cols]
+  )
+  resp = xlsx_response(
+      frame_rows(df), out_cols, "shipments.xlsx",
+      sheet_name = "ArticleExp",
+      money_cols = money_cols,
+      preamble   = [totals],
+  )
   # tack on the header your JS can read
   resp.headers['X-Redirect-URL'] = url_for('main.createdShipments')
   return resp
 
 # PO wise report front end helpers SAME used in below export func
 def build_po_report_df(shipment_numbers=None):
-    # A) filter shipments if requested
-  ship_q = model.query(RFT_Shipment)
-  if shipment_numbers:
-      ship_q = ship_q.filter(RFT_Shipment.ShipmentNumber.in_(shipment_numbers))
-  ship_q = ship_q.subquery()
-
-  # B) per‐shipment totals for each cost category
-  ship_totals = (
-      model.query(
-          ship_q.c.ShipmentID,
-          ship_q.c.ShipmentNumber,
-          ship_q.c.BLNumber,
-          *(func.coalesce(func.sum(getattr(ship_q.c, col)), 0).label(col) for col in [
-              "FreightCost","CustomDuties","SaberSADDAD","DemurrageCharges",
-              "Penalties","OtherCharges","DO_Port_Charges",
-              "ClearanceTransportCharges","YardCharges"
-          ])
-      )
-      .group_by(ship_q.c.ShipmentID, ship_q.c.ShipmentNumber, ship_q.c.BLNumber)
-      .subquery()
-  )
-
-  # C) total shipped qty per shipment
-  shipped_qty = (
-      model.query(
-          RFT_ShipmentPOLine.ShipmentID,
-          func.coalesce(func.sum(RFT_ShipmentPOLine.QtyShipped), 0).label("TotalShippedQty")
-      )
-      .group_by(RFT_ShipmentPOLine.ShipmentID)
-      .subquery()
-  )
-
-  # D) delivered qty per PO‐line
-  H1 = aliased(RFT_StatusHistory)
-  latest_cont = (
-      model.query(
-          H1.EntityID.label("ContainerID"),
-          func.max(H1.StatusDate).label("MaxDate")
-      )
-      .filter(H1.EntityType=="Container")
-      .group_by(H1.EntityID)
-      .subquery()
-  )
-  H2 = aliased(RFT_StatusHistory)
-  cont_status = (
-      model.query(latest_cont.c.ContainerID, H2.Status)
-      .join(H2,
-            (H2.EntityID==latest_cont.c.ContainerID)&
-            (H2.StatusDate==latest_cont.c.MaxDate)&
-            (H2.EntityType=="Container")
-      )
-      .subquery()
-  )
-  delivered_qty = (
-      model.query(
-          RFT_ContainerLine.ShipmentPOLineID,
-          func.coalesce(func.sum(RFT_ContainerLine.QtyInContainer), 0).label("DeliveredQty")
-      )
-      .join(RFT_Container, RFT_ContainerLine.ContainerID==RFT_Container.ContainerID)
-      .join(cont_status, cont_status.c.ContainerID==RFT_Container.ContainerID)
-      .filter(cont_status.c.Status.in_(DELIVERED_STATUSES))
-      .group_by(RFT_ContainerLine.ShipmentPOLineID)
-      .subquery()
-  )
-
-  # E) original PO‐line qty
-  po_total_line = (
-      model.query(
-          RFT_PurchaseOrderLine.POLineID,
-          RFT_PurchaseOrderLine.Qty.label("PoTotalQty")
-      )
-      .subquery()
-  )
-
-  # F) pull each PO-line’s prorated costs and quantities
-  rows = (
-      model.query(
-          RFT_PurchaseOrder.PONumber.label("PONumber"),
-          RFT_PurchaseOrder.Brand.label("Brand"),
-          RFT_ShipmentPOLine.QtyShipped,
-          po_total_line.c.PoTotalQty,
-          func.coalesce(delivered_qty.c.DeliveredQty, 0).label("DeliveredQty"),
-          # prorated costs per line
-          (ship_totals.c.FreightCost  / shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("FreightCostPerLine"),
-          (ship_totals.c.CustomDuties/ shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("CustomDutiesPerLine"),
-          (ship_totals.c.SaberSADDAD / shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("SaberSADDADPerLine"),
-          (ship_totals.c.DemurrageCharges/ shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("DemurrageChargesPerLine"),
-          (ship_totals.c.Penalties   / shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("PenaltiesPerLine"),
-          (ship_totals.c.OtherCharges / shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("OtherChargesPerLine"),
-          (ship_totals.c.DO_Port_Charges/ shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("DO_Port_ChargesPerLine"),
-          (ship_totals.c.ClearanceTransportCharges/ shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("ClearanceTransportChargesPerLine"),
-          (ship_totals.c.YardCharges  / shipped_qty.c.TotalShippedQty * RFT_ShipmentPOLine.QtyShipped).label("YardChargesPerLine"),
-      )
-      .select_from(ship_totals)
-      .join(RFT_ShipmentPOLine,   ship_totals.c.ShipmentID == RFT_ShipmentPOLine.ShipmentID)
-      .join(RFT_PurchaseOrderLine, RFT_ShipmentPOLine.POLineID == RFT_PurchaseOrderLine.POLineID)
-      .join(RFT_PurchaseOrder,     RFT_PurchaseOrderLine.POID   == RFT_PurchaseOrder.POID)
-      .outerjoin(delivered_qty, delivered_qty.c.ShipmentPOLineID == RFT_ShipmentPOLine.ShipmentPOLineID)
-      .join(shipped_qty, shipped_qty.c.ShipmentID == ship_totals.c.ShipmentID)
-      .join(po_total_line, po_total_line.c.POLineID == RFT_PurchaseOrderLine.POLineID)
-      .all()
-  )
-
-  # G) line-level DataFrame
-  df_lines = pd.DataFrame([r._asdict() for r in rows])
-  df_lines["BalanceQty"] = df_lines["PoTotalQty"] - df_lines["DeliveredQty"]
-  money_cols = [c for c in df_lines.columns if c.endswith("PerLine")]
-  df_lines[money_cols] = df_lines[money_cols].astype(float).round(2)
-
-    # — H) build a master list of all POs (even those without shipments), now including Total PO value
-  po_master = (
-      model.query(
-          RFT_PurchaseOrder.Brand.label("Brand"),
-          RFT_PurchaseOrder.PONumber.label("PONumber"),
-          func.sum(RFT_PurchaseOrderLine.Qty).label("PoTotalQty"),
-          # assume you have a unit‐price column on the PO line:
-          func.sum(RFT_PurchaseOrderLine.TotalValue).label("TotalValue")
-      )
-      .join(RFT_PurchaseOrderLine, RFT_PurchaseOrder.POID == RFT_PurchaseOrderLine.POID)
-      .group_by(RFT_PurchaseOrder.Brand, RFT_PurchaseOrder.PONumber)
-      .all()
-  )
-  df_po = pd.DataFrame([r._asdict() for r in po_master])
-
-  # — I) aggregate line‐level to PO‐level (as before)
-  agg_ship = {
-      "QtyShipped": "sum",
-      "DeliveredQty": "sum",
-      **{col: "sum" for col in money_cols}
-  }
-  df_ship = (
-      df_lines
-      .groupby(["Brand","PONumber"], as_index=False)
-      .agg(agg_ship)
+  """
+  The PO cost report from RFT_PORollup (refreshed by rollups.refresh_po_rollup):
+  a totals row, then one row per PO. With `shipment_numbers`, only the POs on
+  those shipments (each still with its whole-PO figures).
+  """
+  R = RFT_PORollup
+  money_cols = [col + "PerLine" for col in COST_COLUMNS]
+
+  # A) one row per PO, already aggregated
+  q = model.query(
+      R.Brand, R.PONumber, R.TotalValue, R.PoTotalQty, R.QtyShipped,
+      R.DeliveredQty, R.BalanceQty, R.TotalCost, R.DeliveredPercent, R.OverheadPercent,
+      *[getattr(R, col) for col in COST_COLUMNS],
   )
-
-  # — J) merge, fill zeros, and compute the revised BalanceQty
-  df = df_po.merge(df_ship, on=["Brand","PONumber"], how="left")
-  df.fillna({**{"QtyShipped":0,"DeliveredQty":0}, **{col:0 for col in money_cols}}, inplace=True)
-
-
-  # 2) BalanceQty = PoTotalQty - ((REMOVED: QtyShipped +) DeliveredQty)
-  df["BalanceQty"] = df["PoTotalQty"] - (df["QtyShipped"])
-
-  # 3) Total Cost = sum of all cost columns
-  df["TotalCost"] = df[money_cols].sum(axis=1)
-
-  # 4) % delivered vs PO
-  df["FL%(PO VS Delivered)"] = df["DeliveredQty"] / df["PoTotalQty"] * 100
-
-  # 5) Overhead Cost % = TotalCost / TotalValue
-  df["OH-Cost %"] = df["TotalCost"].astype(int) / df["TotalValue"].astype(int) 
-
-  # — L) rebuild two-row header (same as before, just include the new columns)
+  if shipment_numbers:
+      q = q.filter(R.POID.in_(
+          select(RFT_PurchaseOrderLine.POID)
+          .join(RFT_ShipmentPOLine, RFT_ShipmentPOLine.POLineID == RFT_PurchaseOrderLine.POLineID)
+          .join(RFT_Shipment,       RFT_Shipment.ShipmentID     == RFT_ShipmentPOLine.ShipmentID)
+          .where(RFT_Shipment.ShipmentNumber.in_(shipment_numbers))
+      ))
+  rows = q.order_by(R.Brand, R.PONumber).all()
+
+  # B) DataFrame in the report's column names
+  df = pd.DataFrame(rows, columns=[
+      "Brand", "PONumber", "TotalValue", "PoTotalQty", "QtyShipped",
+      "DeliveredQty", "BalanceQty", "TotalCost", "FL%(PO VS Delivered)", "OH-Cost %",
+      *money_cols,
+  ])
+  float_cols = ["TotalValue", "TotalCost", "FL%(PO VS Delivered)", "OH-Cost %", *money_cols]
+  df[float_cols]  = df[float_cols].astype(float)
+  df[money_cols]  = df[money_cols].round(2)
+
+  # C) totals row above the POs
   header1 = {
       "Brand":"", 
       "PONumber":"",
@@ -1884,14 +1788,12 @@ def build_po_report_df(shipment_numbers=None):
   }
   df = pd.concat([pd.DataFrame([header1]), df], ignore_index=True, sort=False)
 
-  # — M) final column order
+  # D) final column order
   final_cols = [
       "Brand","PONumber", "TotalValue","PoTotalQty", "QtyShipped",
       "DeliveredQty","BalanceQty","TotalCost"
   ] + ["FL%(PO VS Delivered)","OH-Cost %"] + money_cols
-  df = df[final_cols]
-  
-  return df
+  return df[final_cols]
 
 def build_po_columns(df):
     """
@@ -1914,15 +1816,7 @@ def build_po_columns(df):
       "TotalCost"                         :"Total Cost",
       "FL%(PO VS Delivered)"              :"FL%(PO VS Delivered)",
       "OH-Cost %"                         :"Overhead Cost %",
-      "FreightCostPerLine"                :'Freight Cost',
-      "CustomDutiesPerLine"               :'Custom Duties',
-      "SaberSADDADPerLine"                :'Saber SADDAD',
-      "DemurrageChargesPerLine"           :'Demurrage Charges',
-      "PenaltiesPerLine"                  :'Penalties',
-      "OtherChargesPerLine"               :'Other Charges',
-      "DO_Port_ChargesPerLine"            :'DO Port Charges',
-      "ClearanceTransportChargesPerLine"  :'Clearance Transport',
-      "YardChargesPerLine"                :'Yard Charges'
+      **{col + "PerLine": label for col, label in COST_LABELS.items()},
     }
     for col in df.columns:
         # choose type based on dtype
@@ -1938,61 +1832,24 @@ def build_po_columns(df):
 # EXPORT PO wise report of expense and fulfillment and costs
 def export_po_report(shipment_numbers=None):
   
-  df = build_po_report_df()
-
-  final_cols = [
-      "Brand","PONumber", "TotalValue","PoTotalQty", "QtyShipped",
-      "DeliveredQty","BalanceQty","TotalCost"
-  ] + ["FL%(PO VS Delivered)","OH-Cost %"]
-  
-  # — N) write out to Excel *with* conditional formatting
-  out = BytesIO()
-  with pd.ExcelWriter(out, engine="xlsxwriter") as writer:
-      df.to_excel(writer, index=False, sheet_name="PO_report")
-      workbook  = writer.book
-      worksheet = writer.sheets["PO_report"]
-
-      # formats
-      green_fmt = workbook.add_format({'font_color': 'green'})
-      red_fmt   = workbook.add_format({'font_color': 'red'})
-      # define a percent format (two decimals, e.g. 12.34%)
-      percent_fmt = workbook.add_format({'num_format': '0.00%'})
-
-      # locate zero-based column indexes
-      fl_col = final_cols.index("FL%(PO VS Delivered)")
-      oh_col = final_cols.index("OH-Cost %")
-      
-      # apply the percent format to the entire column (rows 1..n)
-      worksheet.set_column(fl_col, fl_col, 12, percent_fmt)
-      worksheet.set_column(oh_col, oh_col, 12, percent_fmt)
-
-      nrows = len(df)  # includes header1 row
-      # locate columns by index
-      fl_col = final_cols.index("FL%(PO VS Delivered)")
-      oh_col = final_cols.index("OH-Cost %")
-
-      # FL% == 100 → green
-      worksheet.conditional_format(
-          2, fl_col, nrows, fl_col,
-          {'type':'cell','criteria':'==','value':100,'format': green_fmt}
-      )
-      # OH-Cost % < 10 → green
-      worksheet.conditional_format(
-          2, oh_col, nrows, oh_col,
-          {'type':'cell','criteria':'<','value':10,'format': green_fmt}
-      )
-      # OH-Cost % >= 10 → red
-      worksheet.conditional_format(
-          2, oh_col, nrows, oh_col,
-          {'type':'cell','criteria':'>=','value':10,'format': red_fmt}
-      )
-
-  out.seek(0)
-  return send_file(
-      out,
-      download_name="PO_report.xlsx",
-      as_attachment=True,
-      mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+  df = build_po_report_df(shipment_numbers)
+
+  # — N) write out to Excel *with* conditional formatting (row 1 is the totals row)
+  green = {'font_color': 'green'}
+  red   = {'font_color': 'red'}
+  return xlsx_response(
+      frame_rows(df), list(df.columns), "PO_report.xlsx",
+      sheet_name   = "PO_report",
+      money_cols   = ["TotalValue", "TotalCost"] + [c for c in df.columns if c.endswith("PerLine")],
+      conditional  = {
+          # FL% == 100 → green
+          "FL%(PO VS Delivered)": [{'type': 'cell', 'criteria': '==', 'value': 100, 'format': green}],
+          # OH-Cost % < 10 → green, >= 10 → red
+          "OH-Cost %": [
+              {'type': 'cell', 'criteria': '<',  'value': 10, 'format': green},
+              {'type': 'cell', 'criteria': '>=', 'value': 10, 'format': red},
+          ],
+      },
   )
 
 